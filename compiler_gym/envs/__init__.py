@@ -2,6 +2,7 @@
 #
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
+from compiler_gym.envs.async_compiler_env import AsyncCompilerEnv
 from compiler_gym.envs.compiler_env import (
     CompilerEnv,
     CompilerEnvState,
@@ -9,15 +10,22 @@ from compiler_gym.envs.compiler_env import (
     observation_t,
     step_t,
 )
+from compiler_gym.envs.compiler_vec_env import CompilerVecEnv
 from compiler_gym.envs.llvm.llvm_env import LlvmEnv
+from compiler_gym.envs.subproc_compiler_vec_env import SubprocCompilerVecEnv
+from compiler_gym.envs.transposition_cache import TranspositionCache
 from compiler_gym.util.registration import COMPILER_GYM_ENVS
 
 __all__ = [
+    "AsyncCompilerEnv",
     "CompilerEnv",
     "CompilerEnvState",
+    "CompilerVecEnv",
     "LlvmEnv",
     "observation_t",
     "info_t",
     "step_t",
+    "SubprocCompilerVecEnv",
+    "TranspositionCache",
     "COMPILER_GYM_ENVS",
 ]
@@ -0,0 +1,274 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""This module defines an asyncio interface to CompilerGym environments."""
+import asyncio
+from functools import partial
+from typing import Iterable, List, Optional, Union
+
+from compiler_gym.envs.compiler_env import CompilerEnv, step_t
+from compiler_gym.service import observation_t
+from compiler_gym.service.connection import (
+    AsyncConnection,
+    ServiceError,
+    ServiceTransportError,
+)
+from compiler_gym.service.proto import (
+    Benchmark,
+    EndEpisodeRequest,
+    GetObservationsRequest,
+    ObservationRequest,
+)
+from compiler_gym.views import ObservationView
+
+
+class AsyncObservationView(object):
+    """An asyncio view into the observation spaces of an
+    :class:`AsyncCompilerEnv`.
+
+    Example usage:
+
+    >>> await env.observation.get("Autophase")
+    [0, 1, ..., 2]
+    >>> await env.observation.get_many(["Autophase", "IrInstructionCount"])
+    [[0, 1, ..., 2], [1024]]
+    """
+
+    def __init__(self, env: "AsyncCompilerEnv", view: ObservationView):
+        self._env = env
+        self._view = view
+        self._use_get_observations = True
+
+    @property
+    def spaces(self):
+        """The observation spaces of the wrapped environment."""
+        return self._view.spaces
+
+    async def get(self, observation_space: str) -> observation_t:
+        """Request an observation from the given space.
+
+        :param observation_space: The observation space to query.
+        :return: An observation.
+        :raises KeyError: If the requested observation space does not exist.
+        """
+        space = self.spaces[observation_space]
+        connection = self._env.connection
+        observation = await connection(
+            connection.stub.GetObservation,
+            ObservationRequest(
+                session_id=self._view.session_id, observation_space=space.index
+            ),
+        )
+        return space.cb(observation)
+
+    async def get_many(self, observation_spaces: Iterable[str]) -> List[observation_t]:
+        """Request observations from several observation spaces at once.
+
+        The asyncio counterpart to :meth:`ObservationView.get_many()
+        <compiler_gym.views.ObservationView.get_many>`.
+
+        :param observation_spaces: The observation spaces to query.
+        :return: A list of observations, one for each observation space.
+        :raises KeyError: If a requested observation space does not exist.
+        """
+        spaces = [
+            self.spaces[observation_space] for observation_space in observation_spaces
+        ]
+        # Remove duplicate indices, preserving order.
+        indices = list(dict.fromkeys(space.index for space in spaces))
+        connection = self._env.connection
+
+        observations = None
+        if self._use_get_observations:
+            try:
+                reply = await connection(
+                    connection.stub.GetObservations,
+                    GetObservationsRequest(
+                        session_id=self._view.session_id, observation_space=indices
+                    ),
+                )
+                observations = reply.observation
+            except NotImplementedError:
+                # Fall back to one request per observation space from now on.
+                self._use_get_observations = False
+        if observations is None:
+            observations = await asyncio.gather(
+                *[
+                    connection(
+                        connection.stub.GetObservation,
+                        ObservationRequest(
+                            session_id=self._view.session_id, observation_space=index
+                        ),
+                    )
+                    for index in indices
+                ]
+            )
+
+        # Decode the observation of each index once, and derive the observations
+        # of every space from it. An observation that is passed through shared
+        # memory can only be decoded once.
+        observations = dict(zip(indices, observations))
+        base_observations = {}
+        for space in spaces:
+            if space.index not in base_observations:
+                base_observations[space.index] = space.base_cb(
+                    observations[space.index]
+                )
+        return [space.translate(base_observations[space.index]) for space in spaces]
+
+    def __repr__(self):
+        return f"AsyncObservationView[{', '.join(sorted(self.spaces.keys()))}]"
+
+
+class AsyncCompilerEnv(object):
+    """An asyncio wrapper around a :class:`CompilerEnv
+    <compiler_gym.envs.CompilerEnv>`.
+
+    The wrapped environment provides the service, the spaces, and the episode
+    state. The episode RPCs are made using a :code:`grpc.aio` channel to the
+    same service, so that many environments can be stepped concurrently from a
+    single thread:
+
+    >>> env = AsyncCompilerEnv(gym.make("llvm-autophase-ic-v0"))
+    >>> observation = await env.reset()
+    >>> observation, reward, done, info = await env.step(0)
+    >>> await env.observation.get("IrInstructionCount")
+    [1024]
+    >>> await env.close()
+
+    Attributes which are not defined by this class, such as
+    :code:`action_space` or :code:`episode_reward`, are read from the wrapped
+    environment.
+
+    :ivar env: The wrapped environment.
+    :vartype env: CompilerEnv
+    :ivar connection: The asyncio connection to the service.
+    :vartype connection: AsyncConnection
+    :ivar observation: A view of the available observation spaces that
+        permits asynchronous access to observations.
+    :vartype observation: AsyncObservationView
+    """
+
+    def __init__(self, env: CompilerEnv):
+        """Constructor.
+
+        :param env: The environment to wrap. The service of this environment is
+            started if it is not already running.
+        """
+        self.env = env
+        if self.env.service is None:
+            self.env.reset()
+        self.connection = self._make_connection()
+        self.observation = AsyncObservationView(self, self.env.observation)
+
+    def _make_connection(self) -> AsyncConnection:
+        return AsyncConnection(
+            self.env.service.connection.url,
+            rpc_call_max_seconds=self.env.connection_settings.rpc_call_max_seconds,
+        )
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that are not found on this object.
+        if name == "env":
+            raise AttributeError(name)
+        return getattr(self.env, name)
+
+    async def reset(
+        self,
+        benchmark: Optional[Union[str, Benchmark]] = None,
+        action_space: Optional[str] = None,
+    ) -> Optional[observation_t]:
+        """Reset the environment state.
+
+        The asyncio counterpart to :meth:`CompilerEnv.reset()
+        <compiler_gym.envs.CompilerEnv.reset>`. If the service has been closed,
+        e.g. because of an earlier error, the wrapped environment restarts it
+        on a worker thread.
+
+        :param benchmark: The name of the benchmark to use.
+        :param action_space: The name of the action space to use.
+        :return: The initial observation.
+        """
+        env = self.env
+        if env.service is None:
+            observation = await asyncio.get_event_loop().run_in_executor(
+                None, partial(env.reset, benchmark=benchmark, action_space=action_space)
+            )
+            await self.connection.close()
+            self.connection = self._make_connection()
+            return observation
+
+        env.action_space_name = action_space or env.action_space_name
+
+        # Stop an existing episode.
+        env._close_step_stream()
+        if env.in_episode:
+            await self.connection(
+                self.connection.stub.EndEpisode,
+                EndEpisodeRequest(session_id=env._session_id),
+            )
+            env._session_id = None
+
+        if benchmark:
+            env.benchmark = benchmark
+
+        reply = await self.connection(
+            self.connection.stub.StartEpisode, env._make_start_episode_request()
+        )
+        env._on_start_episode_reply(reply)
+
+        if env._eager_observation_is_list:
+            return await self.observation.get_many(
+                [space.id for space in env._eager_observation_spaces]
+            )
+        elif env._eager_observation:
+            return await self.observation.get(env.observation_space.id)
+
+    async def step(self, action: int) -> step_t:
+        """Take a step.
+
+        The asyncio counterpart to :meth:`CompilerEnv.step()
+        <compiler_gym.envs.CompilerEnv.step>`.
+
+        :param action: Value from the action_space.
+        :return: A tuple of observation, reward, done, and info.
+        """
+        return await self.multistep([action])
+
+    async def multistep(
+        self, actions: Iterable[int], per_action_feedback: bool = False
+    ) -> step_t:
+        """Take a sequence of steps and return the final observation and reward.
+
+        The asyncio counterpart to :meth:`CompilerEnv.multistep()
+        <compiler_gym.envs.CompilerEnv.multistep>`.
+
+        :param actions: A sequence of values from the action_space.
+        :param per_action_feedback: Whether to return the reward and
+            :code:`action_had_no_effect` flag of every action in the
+            :code:`info` dict.
+        :return: A tuple of observation, reward, done, and info.
+        """
+        env = self.env
+        assert env.in_episode, "Must call reset() before step()"
+        request = env._make_action_request(actions, per_action_feedback)
+        try:
+            reply = await self.connection(self.connection.stub.TakeAction, request)
+        except (ServiceError, ServiceTransportError, TimeoutError) as e:
+            return env._on_step_error(e)
+        return env._on_action_reply(reply, per_action_feedback)
+
+    async def close(self):
+        """Close the environment and the wrapped environment."""
+        await self.connection.close()
+        self.env.close()
+
+    async def __aenter__(self) -> "AsyncCompilerEnv":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __repr__(self):
+        return f"Async{self.env!r}"
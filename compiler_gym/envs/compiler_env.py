@@ -4,8 +4,12 @@
 # LICENSE file in the root directory of this source tree.
 """This module defines the OpenAI gym interface for compilers."""
 import csv
+import itertools
+import json
 import os
+import struct
 import warnings
+from copy import copy, deepcopy
 from io import StringIO
 from pathlib import Path
 from time import time
@@ -17,21 +21,37 @@ import numpy as np
 from gym.spaces import Space
 
 from compiler_gym.datasets.dataset import Dataset, require
+from compiler_gym.envs.transposition_cache import (
+    TranspositionCache,
+    TranspositionCacheNode,
+)
 from compiler_gym.service import (
     CompilerGymServiceConnection,
     ConnectionOpts,
     ServiceError,
+    ServiceIsClosed,
+    ServicePool,
     observation_t,
 )
-from compiler_gym.service.connection import ServiceTransportError
+from compiler_gym.service.connection import (
+    ManagedConnection,
+    RequestStream,
+    ServiceTransportError,
+)
 from compiler_gym.service.proto import (
+    ActionReply,
     ActionRequest,
     AddBenchmarkRequest,
     Benchmark,
     EndEpisodeRequest,
+    ForkSessionRequest,
     GetBenchmarksRequest,
     GetVersionReply,
     GetVersionRequest,
+    ResetSessionRequest,
+    RestoreSessionRequest,
+    SnapshotSessionRequest,
+    StartEpisodeReply,
     StartEpisodeRequest,
 )
 from compiler_gym.spaces import NamedDiscrete
@@ -42,11 +62,30 @@ from compiler_gym.views import (
     RewardView,
 )
 
+# The header of a snapshot is the size of the client state, which is followed by
+# the client state and the service state.
+_SNAPSHOT_HEADER_FORMAT = "<Q"
+
+# A counter that identifies every registration of a Benchmark message, so that
+# episodes of programs that are registered with the same URI use different
+# roots of the transposition cache.
+_benchmark_registration_ids = itertools.count()
+
 # Type hints.
 info_t = Dict[str, Any]
 step_t = Tuple[Optional[observation_t], Optional[float], bool, info_t]
 
 
+def _space_names_list(
+    spaces: Optional[Union[str, List[str]]]
+) -> Tuple[List[str], bool]:
+    """Convert an eager space argument to a list of space names and a flag
+    indicating whether a list of spaces was provided."""
+    if isinstance(spaces, (list, tuple)):
+        return list(spaces), bool(spaces)
+    return ([] if spaces is None else [spaces]), False
+
+
 def _to_csv(*columns) -> str:
     buf = StringIO()
     writer = csv.writer(buf)
@@ -186,22 +225,29 @@ class CompilerEnv(gym.Env):
     :ivar episode_reward: If
         :func:`CompilerEnv.reward_space <compiler_gym.envs.CompilerGym.reward_space>`
         is set, this value is the sum of all rewards for the current episode.
+        If a list of reward spaces is set, this is a list of the sums of the
+        rewards of each space.
     """
 
     def __init__(
         self,
-        service: Union[str, Path],
+        service: Union[str, Path, ServicePool, CompilerGymServiceConnection],
         benchmark: Optional[Union[str, Benchmark]] = None,
-        observation_space: Optional[str] = None,
-        reward_space: Optional[str] = None,
+        observation_space: Optional[Union[str, List[str]]] = None,
+        reward_space: Optional[Union[str, List[str]]] = None,
         action_space: Optional[str] = None,
         connection_settings: Optional[ConnectionOpts] = None,
+        transposition_cache: Optional[TranspositionCache] = None,
     ):
         """Construct and initialize a CompilerGym service environment.
 
         :param service: The hostname and port of a service that implements the
             CompilerGym service interface, or the path of a binary file
-            which provides the CompilerGym service interface when executed.
+            which provides the CompilerGym service interface when executed,
+            or a :class:`ServicePool <compiler_gym.service.ServicePool>` of
+            running services to take a service from. A
+            :class:`CompilerGymServiceConnection <compiler_gym.service.CompilerGymServiceConnection>`
+            may be passed to share an existing service, see :func:`share()`.
             See :doc:`/compiler_gym/service` for details.
         :param benchmark: The name of the benchmark to use for this environment.
             The choice of benchmark can be deferred by not providing this
@@ -209,13 +255,20 @@ class CompilerEnv(gym.Env):
             :code:`CompilerEnv.benchmarks` attribute and passing it to
             :func:`reset()` when called.
         :param observation_space: Compute and return observations at each
-            :func:`step()` from this space. If not provided, :func:`step()`
-            returns :code:`None` for the observation value.
+            :func:`step()` from this space, or from each space in a list of
+            spaces. If not provided, :func:`step()` returns :code:`None` for
+            the observation value.
         :param reward_space: Compute and return reward at each :func:`step()`
-            from this space. If not provided, :func:`step()` returns
-            :code:`None` for the reward value.
+            from this space, or from each space in a list of spaces. If not
+            provided, :func:`step()` returns :code:`None` for the reward
+            value.
         :param action_space: The name of the action space to use. If not
             specified, the default action space for this compiler is used.
+        :param transposition_cache: A cache of the results of steps, which is
+            used by :func:`step()` to skip executing sequences of actions that
+            have been taken before. The cache is used only for episodes whose
+            eager observation and reward spaces are all deterministic. See
+            :class:`TranspositionCache <compiler_gym.envs.TranspositionCache>`.
         :raises FileNotFoundError: If service is a path to a file that is not
             found.
         :raises TimeoutError: If the compiler service fails to initialize
@@ -223,8 +276,23 @@ class CompilerEnv(gym.Env):
         """
         self.metadata = {"render.modes": ["human", "ansi"]}
 
-        self.service_endpoint = service
-        self.connection_settings = connection_settings or ConnectionOpts()
+        # If a service pool is provided, services are taken from the pool and
+        # use the connection settings of the pool.
+        self._service_pool: Optional[ServicePool] = None
+        # If a service connection is provided, it is shared with the other
+        # users of the connection.
+        self._shared_service: Optional[CompilerGymServiceConnection] = None
+        if isinstance(service, ServicePool):
+            self._service_pool = service
+            self.service_endpoint = service.endpoint
+            self.connection_settings = service.opts
+        elif isinstance(service, CompilerGymServiceConnection):
+            self._shared_service = service
+            self.service_endpoint = service.endpoint
+            self.connection_settings = service.opts
+        else:
+            self.service_endpoint = service
+            self.connection_settings = connection_settings or ConnectionOpts()
         self.datasets_site_path: Optional[Path] = None
         self.available_datasets: Dict[str, Dataset] = {}
 
@@ -237,12 +305,31 @@ class CompilerEnv(gym.Env):
         # user-provided custom benchmarks so that we can register them with a
         # reset service.
         self._custom_benchmarks: Dict[str, Benchmark] = {}
+        # A map from the URIs of custom benchmarks to the ID of their most
+        # recent registration. See _transposition_cache_key.
+        self._custom_benchmark_registrations: Dict[str, int] = {}
 
         self.action_space_name = action_space
 
-        self.service = CompilerGymServiceConnection(
-            self.service_endpoint, self.connection_settings
-        )
+        # An optional stream for sending actions to the service, opened at the
+        # start of each episode. See ConnectionOpts.use_step_stream.
+        self._step_stream: Optional[RequestStream] = None
+
+        # The request and reply that started the current episode, if the
+        # session can be returned to the start of the episode in place. See
+        # _reset_in_place().
+        self._start_episode: Optional[
+            Tuple[StartEpisodeRequest, StartEpisodeReply]
+        ] = None
+
+        # The node of the transposition cache for the current state, or None if
+        # the cache is not used for the current episode, and the actions that
+        # were served from the cache but not yet executed by the service.
+        self.transposition_cache = transposition_cache
+        self._cache_node: Optional[TranspositionCacheNode] = None
+        self._cache_pending: List[int] = []
+
+        self.service = self._make_service()
 
         # Process the available action, observation, and reward spaces.
         self.action_spaces = [
@@ -250,13 +337,16 @@ class CompilerEnv(gym.Env):
             for space in self.service.action_spaces
         ]
         self.observation = self._observation_view_type(
-            get_observation=lambda req: self.service(
+            get_observation=lambda req: self._episode_rpc(
                 self.service.stub.GetObservation, req
             ),
             spaces=self.service.observation_spaces,
+            get_observations=lambda req: self._episode_rpc(
+                self.service.stub.GetObservations, req
+            ),
         )
         self.reward = self._reward_view_type(
-            get_reward=lambda req: self.service(self.service.stub.GetReward, req),
+            get_reward=lambda req: self._episode_rpc(self.service.stub.GetReward, req),
             spaces=self.service.reward_spaces,
         )
 
@@ -271,7 +361,7 @@ class CompilerEnv(gym.Env):
         self.action_space: Optional[Space] = None
         self.observation_space: Optional[Space] = None
         self.reward_range: Tuple[float, float] = (-np.inf, np.inf)
-        self.episode_reward: Optional[float] = None
+        self.episode_reward: Optional[Union[float, List[float]]] = None
         self.episode_start_time: float = time()
 
         # Initialize eager observation/reward and benchmark.
@@ -279,6 +369,193 @@ class CompilerEnv(gym.Env):
         self.reward_space = reward_space
         self.benchmark = benchmark
 
+    def _make_service(self) -> CompilerGymServiceConnection:
+        """Connect to a service, taking a running service from the service pool
+        if one was provided."""
+        if self._shared_service:
+            # A shared service is used only once. If this environment later
+            # restarts its service, it starts a new service of its own.
+            shared_service, self._shared_service = self._shared_service, None
+            return shared_service.share()
+        if self._service_pool and not self._service_pool.closed:
+            return self._service_pool.acquire()
+        return CompilerGymServiceConnection(
+            self.service_endpoint, self.connection_settings
+        )
+
+    def share(self) -> "CompilerEnv":
+        """Create a new environment that uses the same service as this one.
+
+        The new environment has its own episode, but shares the service
+        process, and so the benchmark cache of the service, with this
+        environment. This is cheaper than starting a new service for every
+        environment. The service is shut down when the last environment that
+        uses it is closed:
+
+        >>> env = gym.make("llvm-v0")
+        >>> other_env = env.share()
+        >>> env.close()  # The service is still running.
+        >>> other_env.close()  # The service is shut down.
+
+        The new environment uses the same benchmark, action space, and eager
+        observation and reward spaces as this environment.
+
+        :return: A new environment.
+        :raises ServiceIsClosed: If this environment is closed.
+        """
+        if self.service is None:
+            raise ServiceIsClosed("Cannot share the service of a closed environment")
+
+        if self._eager_observation_is_list:
+            observation_space = [space.id for space in self._eager_observation_spaces]
+        elif self._eager_observation:
+            observation_space = self._eager_observation_spaces[0].id
+        else:
+            observation_space = None
+
+        if self._eager_reward_is_list:
+            reward_space = list(self._eager_reward_spaces)
+        elif self._eager_reward:
+            reward_space = self._eager_reward_spaces[0]
+        else:
+            reward_space = None
+
+        # The eager spaces are set after construction, as subclasses may add
+        # spaces, e.g. derived observation spaces, after CompilerEnv.__init__().
+        env = type(self)(
+            service=self.service,
+            benchmark=self._user_specified_benchmark_uri,
+            action_space=self.action_space_name,
+            transposition_cache=self.transposition_cache,
+        )
+        env.observation_space = observation_space
+        env.reward_space = reward_space
+        # Record the custom benchmarks, which have already been registered with
+        # the service, in case the new environment restarts its service.
+        env._custom_benchmarks.update(self._custom_benchmarks)
+        env._custom_benchmark_registrations.update(self._custom_benchmark_registrations)
+        return env
+
+    def fork(self) -> "CompilerEnv":
+        """Create a copy of this environment in its current state.
+
+        The new environment shares the service of this environment (see
+        :func:`share()`), and starts with a copy of the current episode, so it
+        can be used to explore a different sequence of actions from the current
+        state without replaying the actions that led to it:
+
+        >>> env.reset()
+        >>> env.step(0)
+        >>> fork = env.fork()
+        >>> fork.step(1)  # Does not affect env.
+
+        The two environments are independent from then on.
+
+        :return: A new environment.
+        :raises NotImplementedError: If the service does not support forking
+            sessions.
+        """
+        assert self.in_episode, "Must call reset() before fork()"
+        self._apply_cached_steps()
+        reply = self.service(
+            self.service.stub.ForkSession,
+            ForkSessionRequest(session_id=self._session_id),
+        )
+
+        env = self.share()
+        env._session_id = reply.session_id
+        env.observation.session_id = reply.session_id
+        env.reward.session_id = reply.session_id
+        env._benchmark_in_use_uri = self._benchmark_in_use_uri
+        env._action_space = self._action_space
+        env.episode_reward = copy(self.episode_reward)
+        env.episode_start_time = self.episode_start_time
+        env._cache_node = self._cache_node
+        env._open_step_stream()
+        return env
+
+    def snapshot(self) -> bytes:
+        """Serialize the current state of the environment.
+
+        The snapshot contains the state of the episode in the service, e.g. the
+        current program and the reward state, and the episode state of this
+        environment. It can be stored, e.g. in memory or on disk, and passed to
+        :func:`restore()` to return to this state without replaying the
+        actions that led to it:
+
+        >>> env.reset()
+        >>> env.step(0)
+        >>> snapshot = env.snapshot()
+        >>> env.step(1)
+        >>> env.restore(snapshot)  # Back to the state after step(0).
+
+        The format of the snapshot is opaque and specific to the service.
+
+        :return: The serialized state.
+        :raises NotImplementedError: If the service does not support snapshots.
+        """
+        assert self.in_episode, "Must call reset() before snapshot()"
+        self._apply_cached_steps()
+        reply = self.service(
+            self.service.stub.SnapshotSession,
+            SnapshotSessionRequest(session_id=self._session_id),
+        )
+        client_state = json.dumps(self._get_snapshot_state()).encode("utf-8")
+        return (
+            struct.pack(_SNAPSHOT_HEADER_FORMAT, len(client_state))
+            + client_state
+            + reply.state
+        )
+
+    def restore(self, snapshot: bytes) -> None:
+        """Restore the state of the environment from a snapshot.
+
+        The current episode continues from the state of the snapshot. The
+        snapshot may have been taken using a different environment, but the
+        environment must be using the same kind of service.
+
+        :param snapshot: A serialized state returned by :func:`snapshot()`.
+        :raises ValueError: If the snapshot is invalid.
+        :raises NotImplementedError: If the service does not support snapshots.
+        """
+        assert self.in_episode, "Must call reset() before restore()"
+        header_size = struct.calcsize(_SNAPSHOT_HEADER_FORMAT)
+        if len(snapshot) < header_size:
+            raise ValueError("Invalid snapshot")
+        (client_state_size,) = struct.unpack_from(_SNAPSHOT_HEADER_FORMAT, snapshot)
+        client_state_end = header_size + client_state_size
+        try:
+            client_state = json.loads(snapshot[header_size:client_state_end])
+        except ValueError as e:
+            raise ValueError(f"Invalid snapshot: {e}") from None
+
+        self.service(
+            self.service.stub.RestoreSession,
+            RestoreSessionRequest(
+                session_id=self._session_id, state=snapshot[client_state_end:]
+            ),
+        )
+        # The restored state replaces any steps that were served from the
+        # transposition cache. Its position in the cache is not known.
+        self._cache_node = None
+        self._cache_pending = []
+        # A restored session cannot be reset in place.
+        self._start_episode = None
+        self._set_snapshot_state(client_state)
+
+    def _get_snapshot_state(self) -> Dict[str, Any]:
+        """Return the client state that is stored in a snapshot. Subclasses
+        may extend this to store additional state."""
+        return {
+            "benchmark": self._benchmark_in_use_uri,
+            "episode_reward": self.episode_reward,
+        }
+
+    def _set_snapshot_state(self, state: Dict[str, Any]) -> None:
+        """Restore the client state that was stored in a snapshot."""
+        self._benchmark_in_use_uri = state["benchmark"]
+        self.episode_reward = state["episode_reward"]
+
     @property
     def versions(self) -> GetVersionReply:
         """Get the version numbers from the compiler service."""
@@ -311,10 +588,18 @@ class CompilerEnv(gym.Env):
 
     @property
     def state(self) -> CompilerEnvState:
-        """The tuple representation of the current environment state."""
+        """The tuple representation of the current environment state.
+
+        If a list of reward spaces is set, the episode reward of the first
+        reward space is used.
+        """
         return CompilerEnvState(
             benchmark=self.benchmark,
-            reward=self.episode_reward,
+            reward=(
+                self.episode_reward[0]
+                if self._eager_reward_is_list
+                else self.episode_reward
+            ),
             walltime=self.episode_walltime,
             commandline=self.commandline(),
         )
@@ -403,40 +688,59 @@ class CompilerEnv(gym.Env):
                 self.service.stub.AddBenchmark,
                 AddBenchmarkRequest(benchmark=[benchmark]),
             )
+            # The message may replace the program of a benchmark that is in
+            # use, so the current episode cannot be reset in place, and the
+            # new program must not share results in the transposition cache
+            # with the old one.
+            self._start_episode = None
+            self._custom_benchmark_registrations[benchmark.uri] = next(
+                _benchmark_registration_ids
+            )
         else:
             raise TypeError(f"Unsupported benchmark type: {type(benchmark).__name__}")
 
     @property
-    def reward_space(self) -> Optional[RewardSpaceSpec]:
+    def reward_space(
+        self,
+    ) -> Optional[Union[RewardSpaceSpec, List[RewardSpaceSpec]]]:
         """The eager reward space. This is the reward that is returned by
         :func:`~step()`.
 
         :getter: Returns a :class:`RewardSpaceSpec <compiler_gym.views.RewardSpaceSpec>`,
-            or :code:`None` if not set.
-        :setter: Set the eager reward space.
+            or :code:`None` if not set. If a list of reward spaces was set,
+            returns a list of :class:`RewardSpaceSpec <compiler_gym.views.RewardSpaceSpec>`.
+        :setter: Set the eager reward space, or a list of eager reward spaces.
+            If a list is set, :func:`~step()` returns a list of rewards, one
+            for each space, and all of them are computed by the service in the
+            same request as the action.
 
         .. note::
             Setting a new eager reward space has no effect until
             :func:`~reset()` is called on the environment.
         """
+        if self._eager_reward_is_list:
+            return [self.reward.spaces[space] for space in self._eager_reward_spaces]
         return (
-            self.reward.spaces[self._eager_reward_space]
-            if self._eager_reward_space
+            self.reward.spaces[self._eager_reward_spaces[0]]
+            if self._eager_reward
             else None
         )
 
     @reward_space.setter
-    def reward_space(self, reward_space: Optional[str]) -> None:
-        if reward_space is not None and reward_space not in self.reward.spaces:
-            raise LookupError(f"Reward space not found: {reward_space}")
+    def reward_space(self, reward_space: Optional[Union[str, List[str]]]) -> None:
+        reward_spaces, is_list = _space_names_list(reward_space)
+        for space in reward_spaces:
+            if space not in self.reward.spaces:
+                raise LookupError(f"Reward space not found: {space}")
         if self.in_episode:
             warnings.warn(
                 "Changing eager reward space has no effect until reset() is called."
             )
-        self._eager_reward: bool = reward_space is not None
-        self._eager_reward_space: str = reward_space or ""
-        if self._eager_reward:
-            self.reward_range = self.reward.spaces[reward_space].range
+        self._eager_reward: bool = bool(reward_spaces)
+        self._eager_reward_is_list: bool = is_list
+        self._eager_reward_spaces: List[str] = reward_spaces
+        if self._eager_reward and not is_list:
+            self.reward_range = self.reward.spaces[reward_spaces[0]].range
         else:
             self.reward_range = (-np.inf, np.inf)
 
@@ -450,42 +754,62 @@ class CompilerEnv(gym.Env):
         return self._session_id is not None
 
     @property
-    def observation_space(self) -> Optional[ObservationSpaceSpec]:
+    def observation_space(
+        self,
+    ) -> Optional[Union[ObservationSpaceSpec, List[ObservationSpaceSpec]]]:
         """The eager observation space. This is the observation value that is
         returned by :func:`~step()`.
 
         :getter: Returns the specification of the eager observation space, or
-            :code:`None` if not set.
-        :setter: Set the eager observation space.
+            :code:`None` if not set. If a list of observation spaces was set,
+            returns a list of specifications.
+        :setter: Set the eager observation space, or a list of eager
+            observation spaces. If a list is set, :func:`~step()` returns a
+            list of observations, one for each space, and all of them are
+            computed by the service in the same request as the action.
 
         .. note::
             Setting a new eager observation space has no effect until
             :func:`~reset()` is called on the environment.
         """
-        return self._eager_observation_space
+        if self._eager_observation_is_list:
+            return self._eager_observation_spaces
+        return self._eager_observation_spaces[0] if self._eager_observation else None
 
     @observation_space.setter
-    def observation_space(self, observation_space: Optional[str]) -> None:
-        if (
-            observation_space is not None
-            and observation_space not in self.observation.spaces
-        ):
-            raise LookupError(f"Observation space not found: {observation_space}")
+    def observation_space(
+        self, observation_space: Optional[Union[str, List[str]]]
+    ) -> None:
+        observation_spaces, is_list = _space_names_list(observation_space)
+        for space in observation_spaces:
+            if space not in self.observation.spaces:
+                raise LookupError(f"Observation space not found: {space}")
         if self.in_episode:
             warnings.warn(
                 "Changing eager observation space has no effect until reset() is called."
             )
-        self._eager_observation = observation_space is not None
-        if self._eager_observation:
-            self._eager_observation_space = self.observation.spaces[observation_space]
-        else:
-            self._eager_observation_space = None
+        self._eager_observation = bool(observation_spaces)
+        self._eager_observation_is_list = is_list
+        self._eager_observation_spaces: List[ObservationSpaceSpec] = [
+            self.observation.spaces[space] for space in observation_spaces
+        ]
+
+    @property
+    def _eager_space_lists(self) -> bool:
+        """Whether the eager observations and rewards are requested from the
+        service as lists of spaces."""
+        return self._eager_observation_is_list or self._eager_reward_is_list
 
     def close(self):
         """Close the environment.
 
         Once closed, :func:`reset` must be called before the environment is used
         again."""
+        self._close_step_stream()
+        self._cache_node = None
+        self._cache_pending = []
+        self._start_episode = None
+
         # Try and close out the episode, but errors are okay.
         if self.in_episode:
             try:
@@ -530,15 +854,18 @@ class CompilerEnv(gym.Env):
             subsequent calls to :code:`reset()` will use this action space.
             If no aciton space is provided, the default action space is used.
         :return: The initial observation.
+
+        If the environment is already in an episode, and the new episode uses
+        the same benchmark and spaces, the service may return the current
+        session to its initial state rather than starting a new one, which is
+        much cheaper.
         """
         if retry_count > self.connection_settings.init_max_attempts:
             raise OSError(f"Failed to reset environment after {retry_count} attempts")
 
         # Start a new service if required.
         if self.service is None:
-            self.service = CompilerGymServiceConnection(
-                self.service_endpoint, self.connection_settings
-            )
+            self.service = self._make_service()
             # Re-register any custom benchmarks.
             self.service(
                 self.service.stub.AddBenchmark,
@@ -547,41 +874,27 @@ class CompilerEnv(gym.Env):
 
         self.action_space_name = action_space or self.action_space_name
 
+        if self._reset_in_place(benchmark):
+            return self._initial_observation()
+
         # Stop an existing episode.
+        self._close_step_stream()
         if self.in_episode:
             self.service(
                 self.service.stub.EndEpisode,
                 EndEpisodeRequest(session_id=self._session_id),
             )
             self._session_id = None
+            self._start_episode = None
 
         # Update the user requested benchmark, if provided. NOTE: This means
         # that env.reset(benchmark=None) does NOT unset a forced benchmark.
         if benchmark:
             self.benchmark = benchmark
 
+        request = self._make_start_episode_request()
         try:
-            reply = self.service(
-                self.service.stub.StartEpisode,
-                StartEpisodeRequest(
-                    benchmark=self._user_specified_benchmark_uri,
-                    action_space=(
-                        [a.name for a in self.action_spaces].index(
-                            self.action_space_name
-                        )
-                        if self.action_space_name
-                        else 0
-                    ),
-                    use_eager_observation_space=self._eager_observation,
-                    eager_observation_space=(
-                        self.observation_space.index if self.observation_space else None
-                    ),
-                    use_eager_reward_space=bool(self.reward_space),
-                    eager_reward_space=(
-                        self.reward_space.index if self.reward_space else None
-                    ),
-                ),
-            )
+            reply = self.service(self.service.stub.StartEpisode, request)
         except (ServiceError, ServiceTransportError):
             # Abort and retry on error.
             self.service.close()
@@ -592,11 +905,120 @@ class CompilerEnv(gym.Env):
                 retry_count=retry_count + 1,
             )
 
+        self._on_start_episode_reply(reply)
+        self._start_episode = (request, reply)
+        self._open_step_stream()
+        self._cache_node = self._transposition_cache_root()
+
+        return self._initial_observation()
+
+    def _reset_in_place(self, benchmark: Optional[Union[str, Benchmark]]) -> bool:
+        """Return the current session to the start of its episode, if the
+        reset would start a new episode on the same benchmark with the same
+        spaces.
+
+        This skips the cost of ending the session and creating a new one from
+        the benchmark, which dominates the cost of :func:`reset()` for search
+        loops that repeatedly reset to the same benchmark.
+
+        :param benchmark: The benchmark that was passed to :func:`reset()`.
+        :return: :code:`True` if the session was reset, else :code:`False`.
+        """
+        if not self.in_episode or self._start_episode is None:
+            return False
+        # A Benchmark message may replace the program of an existing benchmark.
+        if isinstance(benchmark, Benchmark):
+            return False
+        if benchmark and benchmark != self._user_specified_benchmark_uri:
+            return False
+        start_request, start_reply = self._start_episode
+        # A random benchmark is selected for every episode unless one is
+        # requested.
+        if not start_request.benchmark:
+            return False
+        if self._make_start_episode_request() != start_request:
+            return False
+
+        try:
+            self.service(
+                self.service.stub.ResetSession,
+                ResetSessionRequest(session_id=self._session_id),
+            )
+        except (NotImplementedError, TypeError):
+            # The service does not support resetting sessions, or this session
+            # cannot be reset in place, e.g. because it was forked or restored.
+            self._start_episode = None
+            return False
+
+        self._on_start_episode_reply(start_reply)
+        # The step stream of the session is kept open, unless the connection
+        # settings have changed.
+        if bool(self._step_stream) != self.connection_settings.use_step_stream:
+            self._open_step_stream()
+        self._cache_node = self._transposition_cache_root()
+        return True
+
+    def _initial_observation(self) -> Optional[observation_t]:
+        """Return the eager observation at the start of an episode."""
+        if self._eager_observation_is_list:
+            return self.observation.get_many(
+                [space.id for space in self._eager_observation_spaces]
+            )
+        elif self._eager_observation:
+            return self.observation[self.observation_space.id]
+
+    def _make_start_episode_request(self) -> StartEpisodeRequest:
+        """Construct the request message for a :func:`reset()` call."""
+        if self._eager_space_lists:
+            eager_spaces = {
+                "eager_observation_space_list": [
+                    space.index for space in self._eager_observation_spaces
+                ],
+                "eager_reward_space_list": [
+                    self.reward.spaces[space].index
+                    for space in self._eager_reward_spaces
+                ],
+            }
+        else:
+            eager_spaces = {
+                "use_eager_observation_space": self._eager_observation,
+                "eager_observation_space": (
+                    self.observation_space.index if self.observation_space else None
+                ),
+                "use_eager_reward_space": self._eager_reward,
+                "eager_reward_space": (
+                    self.reward_space.index if self.reward_space else None
+                ),
+            }
+
+        # Shared memory can only be used if the service runs on this machine.
+        shared_memory_observation_threshold = (
+            self.connection_settings.shared_memory_observation_threshold
+            if isinstance(self.service.connection, ManagedConnection)
+            else 0
+        )
+
+        return StartEpisodeRequest(
+            benchmark=self._user_specified_benchmark_uri,
+            action_space=(
+                [a.name for a in self.action_spaces].index(self.action_space_name)
+                if self.action_space_name
+                else 0
+            ),
+            shared_memory_observation_threshold=shared_memory_observation_threshold,
+            **eager_spaces,
+        )
+
+    def _on_start_episode_reply(self, reply: StartEpisodeReply) -> None:
+        """Update the environment state from the reply to a :func:`reset()`
+        call."""
         self._benchmark_in_use_uri = reply.benchmark
         self._session_id = reply.session_id
         self.observation.session_id = reply.session_id
         self.reward.session_id = reply.session_id
         self.episode_start_time = time()
+        self._cache_node = None
+        self._cache_pending = []
 
         # If the action space has changed, update it.
         if reply.HasField("new_action_space"):
@@ -604,51 +1026,308 @@ class CompilerEnv(gym.Env):
                 self.action_space.name, reply.new_action_space.action
             )
 
-        if self.reward_space:
+        if self._eager_reward_is_list:
+            self.episode_reward = [0] * len(self._eager_reward_spaces)
+        elif self._eager_reward:
             self.episode_reward = 0
 
-        if self._eager_observation:
-            return self.observation[self.observation_space.id]
-
     def step(self, action: int) -> step_t:
         """Take a step.
 
         :param action: Value from the action_space.
         :return: A tuple of observation, reward, done, and info. Observation and
-            reward are None if eager observation/reward is not set. If done
+            reward are None if eager observation/reward is not set, and are
+            lists if lists of eager observation/reward spaces are set. If done
             is True, observation and reward may also be None (e.g. because the
             service failed).
         """
+        if self._cache_node is not None:
+            return self._step_with_transposition_cache(action)
+        return self.multistep([action])
+
+    def _step_with_transposition_cache(self, action: int) -> step_t:
+        """Take a step, serving the result from the transposition cache if the
+        action has been taken from the current state before."""
         assert self.in_episode, "Must call reset() before step()"
-        observation, reward = None, None
-        request = ActionRequest(session_id=self._session_id, action=[action])
+        cache = self.transposition_cache
+        node = cache.lookup(self._cache_node, action)
+        if node is not None:
+            # The service does not execute the action until its state is
+            # needed, see _apply_cached_steps().
+            self._cache_node = node
+            self._cache_pending.append(action)
+            self._record_actions([action])
+            self.episode_reward = deepcopy(node.episode_reward)
+            return deepcopy(node.step_result)
+
+        parent = self._cache_node
         try:
-            reply = self.service(self.service.stub.TakeAction, request)
+            self._apply_cached_steps()
         except (ServiceError, ServiceTransportError, TimeoutError) as e:
-            self.close()
-            info = {"error_details": str(e)}
-            if self.reward_space:
-                reward = self.reward_space.reward_on_error(self.episode_reward)
-            if self.observation_space:
-                observation = self.observation_space.default_value
-            return observation, reward, True, info
+            return self._on_step_error(e)
+
+        # Take the step without the cache, then record the result.
+        self._cache_node = None
+        result = self.multistep([action])
+        info = result[3]
+        if "error_details" in info or info["new_action_space"]:
+            # Stop using the cache for the remainder of the episode.
+            return result
+
+        state = None
+        if (
+            cache.snapshot_interval
+            and (parent.depth + 1) % cache.snapshot_interval == 0
+        ):
+            try:
+                state = self.service(
+                    self.service.stub.SnapshotSession,
+                    SnapshotSessionRequest(session_id=self._session_id),
+                ).state
+            except NotImplementedError:
+                pass
+        self._cache_node = cache.insert(
+            parent, action, result, self.episode_reward, state
+        )
+        return result
+
+    def _transposition_cache_root(self) -> Optional[TranspositionCacheNode]:
+        """The node of the transposition cache for the start of an episode, or
+        :code:`None` if the cache is not used for the episode.
+
+        Step results are cached only if every eager observation and reward
+        space is deterministic, since a cached result must be the same as the
+        result of taking the action again.
+        """
+        if self.transposition_cache is None:
+            return None
+        eager_spaces = self._eager_observation_spaces + [
+            self.reward.spaces[space] for space in self._eager_reward_spaces
+        ]
+        if not all(space.deterministic for space in eager_spaces):
+            return None
+        return self.transposition_cache.root(self._transposition_cache_key)
+
+    @property
+    def _transposition_cache_key(self) -> Tuple:
+        """The key of the current episode in the transposition cache."""
+        return (
+            self._benchmark_in_use_uri,
+            self._custom_benchmark_registrations.get(self._benchmark_in_use_uri),
+            self.action_space.name,
+            tuple(space.id for space in self._eager_observation_spaces),
+            self._eager_observation_is_list,
+            tuple(self._eager_reward_spaces),
+            self._eager_reward_is_list,
+        )
+
+    def _apply_cached_steps(self) -> None:
+        """Execute the actions that were served from the transposition cache,
+        bringing the state of the service up to date with this environment."""
+        if not self._cache_pending:
+            return
+        pending, self._cache_pending = self._cache_pending, []
+
+        # Walk back from the current state to the nearest snapshot of the
+        # service state, or to the current state of the service.
+        node, replay = self._cache_node, []
+        while node.state is None and len(replay) < len(pending):
+            replay.append(node.action)
+            node = node.parent
+        if len(replay) < len(pending):
+            self.service(
+                self.service.stub.RestoreSession,
+                RestoreSessionRequest(session_id=self._session_id, state=node.state),
+            )
+            self._start_episode = None
+        if replay:
+            self._take_action(
+                ActionRequest(session_id=self._session_id, action=replay[::-1])
+            )
+
+    def _episode_rpc(self, stub_method, request):
+        """Call an RPC that uses the state of the current episode."""
+        self._apply_cached_steps()
+        return self.service(stub_method, request)
+
+    def multistep(
+        self, actions: Iterable[int], per_action_feedback: bool = False
+    ) -> step_t:
+        """Take a sequence of steps and return the final observation and reward.
+
+        The actions are sent to the service in a single request, so the cost
+        of running a sequence of actions is one round trip, irrespective of the
+        number of actions. This is equivalent to:
+
+        >>> for action in actions:
+        ...     observation, reward, done, info = env.step(action)
+        ...     if done:
+        ...         break
+
+        except that the returned reward is the sum of rewards of all actions,
+        and the observation is computed only once, after the final action.
+
+        To recover the reward of each individual action, set
+        :code:`per_action_feedback`. The service then also returns the reward
+        and :code:`action_had_no_effect` flag of every action, which are stored
+        in the :code:`info` dict as :code:`per_action_reward` and
+        :code:`per_action_had_no_effect` lists. The rewards list is empty if no
+        eager reward space is set. For example:
+
+        >>> _, _, _, info = env.multistep(actions, per_action_feedback=True)
+        >>> for action, reward in zip(actions, info["per_action_reward"]):
+        ...     print(action, reward)
+
+        :param actions: A sequence of values from the action_space.
+        :param per_action_feedback: Whether to return the reward and
+            :code:`action_had_no_effect` flag of every action in the
+            :code:`info` dict.
+        :return: A tuple of observation, reward, done, and info. Observation and
+            reward are None if eager observation/reward is not set, and are
+            lists if lists of eager observation/reward spaces are set. If done
+            is True, observation and reward may also be None (e.g. because the
+            service failed).
+        """
+        assert self.in_episode, "Must call reset() before step()"
+        if self._cache_node is not None:
+            # The transposition cache records single steps, so it is not used
+            # for the remainder of the episode.
+            try:
+                self._apply_cached_steps()
+            except (ServiceError, ServiceTransportError, TimeoutError) as e:
+                return self._on_step_error(e)
+            self._cache_node = None
+        request = self._make_action_request(actions, per_action_feedback)
+        try:
+            reply = self._take_action(request)
+        except (ServiceError, ServiceTransportError, TimeoutError) as e:
+            return self._on_step_error(e)
+        return self._on_action_reply(reply, per_action_feedback)
+
+    def _take_action(self, request: ActionRequest) -> ActionReply:
+        """Send an action request to the service, using the episode's step
+        stream if there is one."""
+        if self._step_stream:
+            try:
+                return self._step_stream(request)
+            except NotImplementedError:
+                # The service does not support streaming. Fall back to unary
+                # calls for the remainder of the episode.
+                self._step_stream = None
+            except Exception:
+                # An error ends the stream, so open a new one for the next step.
+                self._open_step_stream()
+                raise
+        return self.service(self.service.stub.TakeAction, request)
+
+    def _open_step_stream(self) -> None:
+        """Open a step stream for the current episode, if enabled."""
+        self._close_step_stream()
+        if self.connection_settings.use_step_stream:
+            self._step_stream = RequestStream(
+                self.service.stub.StepStream,
+                self.service.connection.url,
+                timeout=self.connection_settings.rpc_call_max_seconds,
+            )
+
+    def _close_step_stream(self) -> None:
+        if self._step_stream:
+            self._step_stream.close()
+            self._step_stream = None
+
+    def _make_action_request(
+        self, actions: Iterable[int], per_action_feedback: bool
+    ) -> ActionRequest:
+        """Construct the request message for a :func:`multistep()` call."""
+        actions = list(actions)
+        self._record_actions(actions)
+        return ActionRequest(
+            session_id=self._session_id,
+            action=actions,
+            per_action_feedback=per_action_feedback,
+        )
+
+    def _record_actions(self, actions: List[int]) -> None:
+        """Called with the actions that are taken in the current episode.
+        Subclasses may override this to record the actions."""
+
+    def _on_step_error(self, error: Exception) -> step_t:
+        """Close the environment after a failed :func:`multistep()` call and
+        return the default observation and reward."""
+        self.close()
+        observation, reward = None, None
+        info = {"error_details": str(error)}
+        if self._eager_reward_is_list:
+            reward = [
+                space.reward_on_error(episode_reward)
+                for space, episode_reward in zip(self.reward_space, self.episode_reward)
+            ]
+        elif self._eager_reward:
+            reward = self.reward_space.reward_on_error(self.episode_reward)
+        if self._eager_observation_is_list:
+            observation = [
+                space.default_value for space in self._eager_observation_spaces
+            ]
+        elif self._eager_observation:
+            observation = self.observation_space.default_value
+        return observation, reward, True, info
+
+    def _on_action_reply(self, reply: ActionReply, per_action_feedback: bool) -> step_t:
+        """Update the environment state from the reply to a
+        :func:`multistep()` call and return the step result."""
+        observation, reward = None, None
 
         # If the action space has changed, update it.
         if reply.HasField("new_action_space"):
             self.action_space = self._make_action_space(
-                self.action_space.name, reply.action_space.action
+                self.action_space.name, reply.new_action_space.action
             )
 
-        if self.observation_space:
-            observation = self.observation_space.cb(reply.observation)
-        if self._eager_reward:
-            reward = reply.reward.reward
+        if self._eager_space_lists:
+            # A service which does not support lists of eager spaces leaves
+            # these fields empty.
+            if len(reply.observation_list) != len(self._eager_observation_spaces) or (
+                len(reply.reward_list) != len(self._eager_reward_spaces)
+            ):
+                raise NotImplementedError(
+                    "Service does not support lists of eager observation and reward spaces"
+                )
+            if self._eager_observation:
+                observation = [
+                    space.cb(value)
+                    for space, value in zip(
+                        self._eager_observation_spaces, reply.observation_list
+                    )
+                ]
+            if self._eager_reward:
+                reward = [value.reward for value in reply.reward_list]
+            # If only one of the observation and reward spaces is a list,
+            # unpack the other one.
+            if self._eager_observation and not self._eager_observation_is_list:
+                observation = observation[0]
+            if self._eager_reward and not self._eager_reward_is_list:
+                reward = reward[0]
+        else:
+            if self._eager_observation:
+                observation = self.observation_space.cb(reply.observation)
+            if self._eager_reward:
+                reward = reply.reward.reward
+
+        if self._eager_reward_is_list:
+            self.episode_reward = [
+                episode_reward + r
+                for episode_reward, r in zip(self.episode_reward, reward)
+            ]
+        elif self._eager_reward:
             self.episode_reward += reward
 
         info = {
             "action_had_no_effect": reply.action_had_no_effect,
             "new_action_space": reply.HasField("new_action_space"),
         }
+        if per_action_feedback:
+            info["per_action_reward"] = list(reply.per_action_reward)
+            info["per_action_had_no_effect"] = list(reply.per_action_had_no_effect)
 
         return observation, reward, reply.end_of_episode, info
 
@@ -663,13 +1342,16 @@ class CompilerEnv(gym.Env):
         "ansi", which returns a string representation of the current environment
         state.
 
+        If a list of eager observation spaces is set, the first observation
+        space is rendered.
+
         :param mode: The render mode to use.
         :raises TypeError: If eager observations are not set, or if the
             requested render mode does not exist.
         """
         if not self.observation_space:
             raise ValueError("Cannot call render() when no observation space is used")
-        observation = self.observation[self.observation_space.id]
+        observation = self.observation[self._eager_observation_spaces[0].id]
         if mode == "human":
             print(observation)
         elif mode == "ansi":
@@ -0,0 +1,260 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""This module defines a vectorized interface to CompilerGym environments."""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from compiler_gym.envs.compiler_env import CompilerEnv, info_t
+from compiler_gym.service import CompilerGymServiceConnection
+from compiler_gym.service.proto import Benchmark
+
+# Type hints.
+vec_step_t = Tuple[Any, np.ndarray, np.ndarray, List[info_t]]
+
+
+def _stack(values: List[Any]) -> Any:
+    """Stack the observations of several environments into a single array. If
+    the observations cannot be stacked, e.g. because they are strings or have
+    different shapes, a list is returned."""
+    if all(value is None for value in values):
+        return None
+    if all(isinstance(value, np.ndarray) for value in values) and (
+        len({value.shape for value in values}) == 1
+    ):
+        return np.stack(values)
+    return list(values)
+
+
+def _per_env_benchmarks(
+    benchmark: Optional[Union[str, Benchmark, List]], num_envs: int
+) -> List[Optional[Union[str, Benchmark]]]:
+    """Return the benchmark for each environment of a vector environment."""
+    if isinstance(benchmark, list):
+        if len(benchmark) != num_envs:
+            raise ValueError(
+                f"Expected {num_envs} benchmarks, received {len(benchmark)}"
+            )
+        return benchmark
+    return [benchmark] * num_envs
+
+
+class CompilerVecEnv(object):
+    """A vector of :class:`CompilerEnv <compiler_gym.envs.CompilerEnv>`
+    environments that are stepped concurrently.
+
+    Each call to :meth:`step()` takes one action for every environment and
+    returns batched results. Observations which are arrays of the same shape are
+    stacked into a single array, e.g. the :code:`Autophase` observations of
+    :code:`N` environments are returned as an :code:`(N, 56)` matrix. Rewards
+    and done flags are returned as arrays of length :code:`N`:
+
+    >>> env = gym.make("llvm-autophase-ic-v0")
+    >>> vec_env = CompilerVecEnv.from_env(env, num_envs=64)
+    >>> observations = vec_env.reset()
+    >>> observations.shape
+    (64, 56)
+    >>> observations, rewards, dones, infos = vec_env.step([0] * 64)
+
+    The environments are stepped on a pool of threads. Each step is a blocking
+    RPC to a compiler service, so the steps of different environments run
+    concurrently.
+
+    When :code:`auto_reset` is set, an environment which reaches the end of an
+    episode is reset by :meth:`step()`. The observation that is returned for
+    that environment is the first observation of the new episode, and the final
+    observation of the old episode is stored in the :code:`info` dict as
+    :code:`terminal_observation`. An error in :meth:`step()` closes the
+    service of an environment. If the environments that shared the service all
+    failed, the service is restarted once and shared by them again, rather than
+    each of them starting a service of its own.
+
+    :ivar envs: The environments.
+    :vartype envs: List[CompilerEnv]
+    :ivar auto_reset: Whether environments are reset at the end of an episode.
+    :vartype auto_reset: bool
+    """
+
+    def __init__(
+        self,
+        envs: Iterable[CompilerEnv],
+        auto_reset: bool = True,
+        max_workers: Optional[int] = None,
+    ):
+        """Constructor.
+
+        :param envs: The environments to step. The vector environment takes
+            ownership of the environments, and closes them when it is closed.
+        :param auto_reset: Whether to reset environments that reach the end of
+            an episode.
+        :param max_workers: The number of threads used to step the
+            environments. Defaults to one thread per environment.
+        :raises ValueError: If no environments are provided.
+        """
+        self.envs: List[CompilerEnv] = list(envs)
+        if not self.envs:
+            raise ValueError("CompilerVecEnv requires at least one environment")
+        self.auto_reset = auto_reset
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or len(self.envs),
+            thread_name_prefix="CompilerVecEnv",
+        )
+
+    @classmethod
+    def from_env(
+        cls, env: CompilerEnv, num_envs: int, auto_reset: bool = True
+    ) -> "CompilerVecEnv":
+        """Create a vector environment from copies of an environment which share
+        its service. See :meth:`CompilerEnv.share()
+        <compiler_gym.envs.CompilerEnv.share>`.
+
+        :param env: An environment. The vector environment takes ownership of
+            it.
+        :param num_envs: The number of environments.
+        :param auto_reset: Whether to reset environments that reach the end of
+            an episode.
+        :return: A vector environment.
+        :raises ValueError: If :code:`num_envs` is not positive.
+        """
+        if num_envs < 1:
+            raise ValueError(f"num_envs must be positive, not: {num_envs}")
+        return cls(
+            [env] + [env.share() for _ in range(num_envs - 1)], auto_reset=auto_reset
+        )
+
+    @property
+    def num_envs(self) -> int:
+        """The number of environments."""
+        return len(self.envs)
+
+    def __len__(self) -> int:
+        return len(self.envs)
+
+    @property
+    def action_space(self):
+        """The action space of a single environment."""
+        return self.envs[0].action_space
+
+    @property
+    def observation_space(self):
+        """The eager observation space of a single environment."""
+        return self.envs[0].observation_space
+
+    @property
+    def reward_space(self):
+        """The eager reward space of a single environment."""
+        return self.envs[0].reward_space
+
+    def _stack_observations(self, observations: List[Any]) -> Any:
+        if self.envs[0]._eager_observation_is_list:
+            # Stack each of the eager observation spaces separately.
+            return [_stack(list(values)) for values in zip(*observations)]
+        return _stack(observations)
+
+    def reset(self, benchmark: Optional[Union[str, Benchmark, List]] = None) -> Any:
+        """Reset all of the environments.
+
+        :param benchmark: The benchmark to use for every environment, or a list
+            of benchmarks, one for each environment. If not provided, each
+            environment uses its own benchmark.
+        :return: The batched initial observations.
+        :raises ValueError: If a list of benchmarks of the wrong length is
+            provided.
+        """
+        observations = list(
+            self._executor.map(
+                lambda args: args[0].reset(benchmark=args[1]),
+                zip(self.envs, _per_env_benchmarks(benchmark, self.num_envs)),
+            )
+        )
+        return self._stack_observations(observations)
+
+    def _step(self, env: CompilerEnv, action: int):
+        observation, reward, done, info = env.step(action)
+        # An environment whose service was closed by an error is reset by
+        # _reset_failed_envs().
+        if done and self.auto_reset and env.service is not None:
+            info["terminal_observation"] = observation
+            observation = env.reset()
+        return observation, reward, done, info
+
+    def _reset_failed_envs(
+        self,
+        services: List[Optional[CompilerGymServiceConnection]],
+        results: List[Tuple[Any, Any, bool, info_t]],
+    ) -> None:
+        """Reset the environments whose service was closed by an error in
+        :meth:`step()`, updating their results in place.
+
+        An environment returns to the service that it used before the step if
+        the service is still used by other environments. Else, the service is
+        restarted once for all of the environments that used it.
+
+        :param services: The service of each environment before the step.
+        :param results: The result of the step of each environment.
+        """
+        restarted_services: Dict[int, CompilerGymServiceConnection] = {}
+        for i, (env, service) in enumerate(zip(self.envs, services)):
+            if env.service is not None or not results[i][2]:
+                continue
+            if service is not None and service.closed:
+                if id(service) not in restarted_services:
+                    restarted_services[id(service)] = CompilerGymServiceConnection(
+                        env.service_endpoint, env.connection_settings
+                    )
+                env._shared_service = restarted_services[id(service)]
+            elif service is not None:
+                env._shared_service = service
+            observation, reward, done, info = results[i]
+            info["terminal_observation"] = observation
+            results[i] = env.reset(), reward, done, info
+
+        # Each environment added itself as a user of the restarted service, so
+        # release the reference that was created by restarting it.
+        for service in restarted_services.values():
+            service.close()
+
+    def step(self, actions: Iterable[int]) -> vec_step_t:
+        """Take one step in every environment.
+
+        :param actions: An action for each environment.
+        :return: A tuple of the batched observations, an array of rewards, an
+            array of done flags, and a list of info dicts, one for each
+            environment.
+        :raises ValueError: If the number of actions does not match the number
+            of environments.
+        """
+        actions = list(actions)
+        if len(actions) != self.num_envs:
+            raise ValueError(
+                f"Expected {self.num_envs} actions, received {len(actions)}"
+            )
+        services = [env.service for env in self.envs]
+        results = list(self._executor.map(self._step, self.envs, actions))
+        if self.auto_reset:
+            self._reset_failed_envs(services, results)
+        observations, rewards, dones, infos = zip(*results)
+        return (
+            self._stack_observations(list(observations)),
+            np.array(rewards, dtype=np.float64),
+            np.array(dones, dtype=bool),
+            list(infos),
+        )
+
+    def close(self) -> None:
+        """Close all of the environments."""
+        for env in self.envs:
+            env.close()
+        self._executor.shutdown()
+
+    def __enter__(self) -> "CompilerVecEnv":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"CompilerVecEnv({self.envs[0]!r}, num_envs={self.num_envs})"
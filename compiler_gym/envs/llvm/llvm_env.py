@@ -6,14 +6,15 @@
 import os
 import shutil
 from pathlib import Path
-from typing import Iterable, List, Optional, Union, cast
+from typing import Any, Dict, Iterable, List, Optional, Union, cast
 
 import numpy as np
 from gym.spaces import Dict as DictSpace
 
-from compiler_gym.envs.compiler_env import CompilerEnv, step_t
+from compiler_gym.envs.compiler_env import CompilerEnv
 from compiler_gym.envs.llvm.benchmarks import make_benchmark
 from compiler_gym.envs.llvm.datasets import LLVM_DATASETS
+from compiler_gym.service.proto import StartEpisodeReply
 from compiler_gym.spaces import Commandline, CommandlineFlag, Scalar, Sequence
 from compiler_gym.third_party.autophase import AUTOPHASE_FEATURE_NAMES
 from compiler_gym.third_party.inst2vec import Inst2vecEncoder
@@ -154,13 +155,26 @@ class LlvmEnv(CompilerEnv):
     def _observation_view_type(self):
         return LlvmObservationView
 
-    def step(self, action: int) -> step_t:
-        self.actions.append(action)
-        return super().step(action)
+    def fork(self) -> "LlvmEnv":
+        env = super().fork()
+        env.actions = list(self.actions)
+        return env
 
-    def reset(self, *args, **kwargs):
+    def _get_snapshot_state(self) -> Dict[str, Any]:
+        state = super()._get_snapshot_state()
+        state["actions"] = self.actions
+        return state
+
+    def _set_snapshot_state(self, state: Dict[str, Any]) -> None:
+        super()._set_snapshot_state(state)
+        self.actions = list(state["actions"])
+
+    def _record_actions(self, actions: List[int]) -> None:
+        self.actions += actions
+
+    def _on_start_episode_reply(self, reply: StartEpisodeReply) -> None:
         self.actions = []
-        return super().reset(*args, **kwargs)
+        super()._on_start_episode_reply(reply)
 
     def _make_action_space(self, name: str, entries: List[str]) -> Commandline:
         flags = [
@@ -0,0 +1,143 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include "compiler_gym/envs/llvm/service/BaselineCostsCache.h"
+
+#include <fcntl.h>
+#include <fmt/format.h>
+#include <glog/logging.h>
+#include <unistd.h>
+
+#include <array>
+#include <boost/crc.hpp>
+#include <cstring>
+#include <fstream>
+#include <iterator>
+#include <vector>
+
+#include "compiler_gym/util/RunfilesPath.h"
+#include "llvm/Config/llvm-config.h"
+
+namespace fs = boost::filesystem;
+
+namespace compiler_gym::llvm_service {
+
+namespace {
+
+// A record is a marker, followed by a module hash, followed by its baseline
+// costs, followed by a checksum of the preceding bytes.
+constexpr uint32_t kRecordMarker = 0x43424743;  // "CGBC"
+constexpr size_t kMarkerSize = sizeof(kRecordMarker);
+constexpr size_t kHashSize = sizeof(llvm::ModuleHash);
+constexpr size_t kChecksumSize = sizeof(uint32_t);
+constexpr size_t kRecordSize = kMarkerSize + kHashSize + sizeof(BaselineCosts) + kChecksumSize;
+
+using Record = std::array<char, kRecordSize>;
+
+uint32_t getChecksum(const char* record) {
+  boost::crc_32_type crc;
+  crc.process_bytes(record, kRecordSize - kChecksumSize);
+  return crc.checksum();
+}
+
+bool isValidRecord(const char* record) {
+  uint32_t marker;
+  uint32_t checksum;
+  std::memcpy(&marker, record, kMarkerSize);
+  std::memcpy(&checksum, record + kRecordSize - kChecksumSize, kChecksumSize);
+  return marker == kRecordMarker && checksum == getChecksum(record);
+}
+
+}  // anonymous namespace
+
+BaselineCostsCache::BaselineCostsCache(const fs::path& path) : path_(path), readOffset_(0) {}
+
+BaselineCostsCache& BaselineCostsCache::instance() {
+  // The number of costs is part of the name, as it determines the size of a
+  // record. The version of the cost functions is part of the name so that
+  // costs computed by an older version are not reused.
+  static BaselineCostsCache cache(
+      util::getCachePath(fmt::format("llvm/baseline_costs-v{}-{}-{}.bin", costFunctionsVersion,
+                                     LLVM_VERSION_STRING, numBaselineCosts)));
+  return cache;
+}
+
+bool BaselineCostsCache::lookup(const llvm::ModuleHash& hash, BaselineCosts* baselineCosts) {
+  std::lock_guard<std::mutex> lock(mutex_);
+  auto it = baselineCosts_.find(hash);
+  if (it == baselineCosts_.end()) {
+    // The costs may have been added by another process.
+    readNewRecords();
+    it = baselineCosts_.find(hash);
+    if (it == baselineCosts_.end()) {
+      return false;
+    }
+  }
+  *baselineCosts = it->second;
+  return true;
+}
+
+void BaselineCostsCache::insert(const llvm::ModuleHash& hash, const BaselineCosts& baselineCosts) {
+  std::lock_guard<std::mutex> lock(mutex_);
+  // Include any costs that were added by other processes, so that the newest
+  // record of a module has every cost that is known.
+  readNewRecords();
+  auto it = baselineCosts_.emplace(hash, getEmptyBaselineCosts()).first;
+  mergeBaselineCosts(baselineCosts, &it->second);
+
+  Record record;
+  std::memcpy(record.data(), &kRecordMarker, kMarkerSize);
+  std::memcpy(record.data() + kMarkerSize, hash.data(), kHashSize);
+  std::memcpy(record.data() + kMarkerSize + kHashSize, it->second.data(), sizeof(BaselineCosts));
+  const uint32_t checksum = getChecksum(record.data());
+  std::memcpy(record.data() + kRecordSize - kChecksumSize, &checksum, kChecksumSize);
+
+  boost::system::error_code ec;
+  fs::create_directories(path_.parent_path(), ec);
+  const int fd = open(path_.c_str(), O_WRONLY | O_CREAT | O_APPEND, 0644);
+  if (fd == -1) {
+    LOG(WARNING) << "Failed to open baseline costs cache " << path_.string() << ": "
+                 << std::strerror(errno);
+    return;
+  }
+  // A single write, so that the record is not interleaved with the records
+  // of other processes.
+  if (write(fd, record.data(), record.size()) != static_cast<ssize_t>(record.size())) {
+    LOG(WARNING) << "Failed to write to baseline costs cache " << path_.string();
+  }
+  close(fd);
+}
+
+void BaselineCostsCache::readNewRecords() {
+  std::ifstream file(path_.string(), std::ios::binary);
+  if (!file.is_open()) {
+    return;
+  }
+  file.seekg(readOffset_);
+  const std::vector<char> buffer(std::istreambuf_iterator<char>(file), {});
+
+  // A write that failed part way, e.g. because the disk is full, leaves an
+  // invalid record in the file. Skip forward a byte at a time until the next
+  // valid record, so that the records after it are still read. A trailing
+  // partial record may be a write that is in progress, so it is read again
+  // next time.
+  size_t offset = 0;
+  while (offset + kRecordSize <= buffer.size()) {
+    const char* record = buffer.data() + offset;
+    if (!isValidRecord(record)) {
+      ++offset;
+      continue;
+    }
+    llvm::ModuleHash hash;
+    BaselineCosts baselineCosts;
+    std::memcpy(hash.data(), record + kMarkerSize, kHashSize);
+    std::memcpy(baselineCosts.data(), record + kMarkerSize + kHashSize, sizeof(BaselineCosts));
+    auto it = baselineCosts_.emplace(hash, getEmptyBaselineCosts()).first;
+    mergeBaselineCosts(baselineCosts, &it->second);
+    offset += kRecordSize;
+  }
+  readOffset_ += offset;
+}
+
+}  // namespace compiler_gym::llvm_service
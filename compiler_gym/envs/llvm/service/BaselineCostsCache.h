@@ -0,0 +1,63 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#pragma once
+
+#include <map>
+#include <mutex>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/Cost.h"
+#include "llvm/IR/ModuleSummaryIndex.h"
+
+namespace compiler_gym::llvm_service {
+
+// A persistent cache of the baseline costs of benchmarks, keyed by the hash of
+// the benchmark's LLVM module. The cache is a file of fixed-size records that
+// is shared by every service on the machine, so the baseline costs of a
+// benchmark are computed only once. Baseline costs are computed on demand, so
+// a record may contain only some of the costs of a module. The records of a
+// module are merged when read.
+//
+// Records are only ever appended to the file, each using a single write to a
+// file that is opened in append mode, so concurrent writers do not need to
+// lock the file. Each record starts with a marker and ends with a checksum.
+// Readers skip invalid records, e.g. from a write that failed part way, and
+// resume at the next valid record. A trailing partial record, e.g. from a
+// write that is still in progress, is read again later. Errors reading or
+// writing the file are logged and otherwise ignored, since the costs can
+// always be recomputed.
+//
+// This class is thread safe.
+class BaselineCostsCache {
+ public:
+  explicit BaselineCostsCache(const boost::filesystem::path& path);
+
+  // The cache used by the LLVM service, which is stored in the CompilerGym
+  // cache directory. The name of the file includes the version of the cost
+  // functions and the LLVM version, as the costs depend on both.
+  static BaselineCostsCache& instance();
+
+  // Look up the baseline costs of a module. Costs that are not in the cache
+  // are NaN. Returns false if no costs of the module are in the cache.
+  [[nodiscard]] bool lookup(const llvm::ModuleHash& hash, BaselineCosts* baselineCosts);
+
+  // Add the computed baseline costs of a module to the cache.
+  void insert(const llvm::ModuleHash& hash, const BaselineCosts& baselineCosts);
+
+  inline const boost::filesystem::path& path() const { return path_; }
+
+ private:
+  // Read the records that have been appended to the file since the last read.
+  // Must be called with the mutex held.
+  void readNewRecords();
+
+  const boost::filesystem::path path_;
+  std::mutex mutex_;
+  std::map<llvm::ModuleHash, BaselineCosts> baselineCosts_;
+  // The number of bytes of the file that have been read.
+  size_t readOffset_;
+};
+
+}  // namespace compiler_gym::llvm_service
@@ -7,8 +7,11 @@
 #include <fmt/format.h>
 #include <glog/logging.h>
 
+#include <algorithm>
+#include <cmath>
 #include <stdexcept>
 
+#include "compiler_gym/envs/llvm/service/BaselineCostsCache.h"
 #include "llvm/ADT/SmallVector.h"
 #include "llvm/Bitcode/BitcodeReader.h"
 #include "llvm/Bitcode/BitcodeWriter.h"
@@ -22,22 +25,16 @@ namespace compiler_gym::llvm_service {
 
 namespace {
 
-BaselineCosts getBaselineCosts(const llvm::Module& unoptimizedModule,
-                               const fs::path& workingDirectory) {
-  BaselineCosts baselineCosts;
-  setbaselineCosts(unoptimizedModule, &baselineCosts, workingDirectory);
-  return baselineCosts;
-}
-
-BenchmarkHash getModuleHash(const llvm::Module& module) {
-  BenchmarkHash hash;
-  llvm::SmallVector<char, 256> buffer;
-  // Writing the entire bitcode to a buffer that is then discarded is
-  // inefficient.
-  llvm::BitcodeWriter writer(buffer);
+// Serialize a module to bitcode and compute its hash in a single pass.
+std::shared_ptr<const Bitcode> writeBitcodeWithHash(const llvm::Module& module,
+                                                    BenchmarkHash* hash) {
+  auto bitcode = std::make_shared<Bitcode>();
+  llvm::BitcodeWriter writer(*bitcode);
   writer.writeModule(module, /*ShouldPreserveUseListOrder=*/false,
-                     /*Index=*/nullptr, /*GenerateHash=*/true, &hash);
-  return hash;
+                     /*Index=*/nullptr, /*GenerateHash=*/true, hash);
+  writer.writeSymtab();
+  writer.writeStrtab();
+  return bitcode;
 }
 
 std::unique_ptr<llvm::Module> makeModuleOrDie(llvm::LLVMContext& context, const Bitcode& bitcode,
@@ -50,6 +47,17 @@ std::unique_ptr<llvm::Module> makeModuleOrDie(llvm::LLVMContext& context, const
 
 }  // anonymous namespace
 
+BenchmarkHash getModuleHash(const llvm::Module& module) {
+  BenchmarkHash hash;
+  llvm::SmallVector<char, 256> buffer;
+  // Writing the entire bitcode to a buffer that is then discarded is
+  // inefficient.
+  llvm::BitcodeWriter writer(buffer);
+  writer.writeModule(module, /*ShouldPreserveUseListOrder=*/false,
+                     /*Index=*/nullptr, /*GenerateHash=*/true, &hash);
+  return hash;
+}
+
 std::unique_ptr<llvm::Module> makeModule(llvm::LLVMContext& context, const Bitcode& bitcode,
                                          const std::string& name, Status* status) {
   llvm::MemoryBufferRef buffer(llvm::StringRef(bitcode.data(), bitcode.size()), name);
@@ -69,34 +77,118 @@ std::unique_ptr<llvm::Module> makeModule(llvm::LLVMContext& context, const Bitco
 // A benchmark is an LLVM module and the LLVM context that owns it.
 Benchmark::Benchmark(const std::string& name, const Bitcode& bitcode,
                      const fs::path& workingDirectory, std::optional<fs::path> bitcodePath,
-                     const BaselineCosts* baselineCosts)
+                     const BaselineCosts* baselineCosts, const BenchmarkHash* hash,
+                     std::shared_ptr<const Bitcode> unoptimizedBitcode)
     : context_(std::make_unique<llvm::LLVMContext>()),
       module_(makeModuleOrDie(*context_, bitcode, name)),
-      baselineCosts_(baselineCosts ? *baselineCosts : getBaselineCosts(*module_, workingDirectory)),
-      hash_(getModuleHash(*module_)),
+      unoptimizedBitcode_(std::move(unoptimizedBitcode)),
+      baselineCosts_(baselineCosts ? *baselineCosts : getEmptyBaselineCosts()),
+      workingDirectory_(workingDirectory),
       name_(name),
       bitcodeSize_(bitcode.size()),
-      bitcodePath_(bitcodePath) {}
+      bitcodePath_(bitcodePath) {
+  if (hash) {
+    hash_ = *hash;
+  } else {
+    unoptimizedBitcode_ = writeBitcodeWithHash(*module_, &hash_);
+  }
+}
 
 Benchmark::Benchmark(const std::string& name, std::unique_ptr<llvm::LLVMContext> context,
                      std::unique_ptr<llvm::Module> module, size_t bitcodeSize,
                      const fs::path& workingDirectory, std::optional<fs::path> bitcodePath,
-                     const BaselineCosts* baselineCosts)
+                     const BaselineCosts* baselineCosts, const BenchmarkHash* hash,
+                     std::shared_ptr<const Bitcode> unoptimizedBitcode)
     : context_(std::move(context)),
       module_(std::move(module)),
-      baselineCosts_(baselineCosts ? *baselineCosts : getBaselineCosts(*module_, workingDirectory)),
-      hash_(getModuleHash(*module_)),
+      unoptimizedBitcode_(std::move(unoptimizedBitcode)),
+      baselineCosts_(baselineCosts ? *baselineCosts : getEmptyBaselineCosts()),
+      workingDirectory_(workingDirectory),
       name_(name),
       bitcodeSize_(bitcodeSize),
-      bitcodePath_(bitcodePath) {}
+      bitcodePath_(bitcodePath) {
+  if (hash) {
+    hash_ = *hash;
+  } else {
+    // The hash is computed by serializing the module, so keep the bitcode to
+    // compute baseline costs from.
+    unoptimizedBitcode_ = writeBitcodeWithHash(*module_, &hash_);
+  }
+}
 
 std::unique_ptr<Benchmark> Benchmark::clone(const fs::path& workingDirectory) const {
+  // NOTE(cummins): llvm::CloneModule() cannot be used here, as it copies a
+  // module within the same LLVMContext, and an LLVMContext cannot be used
+  // concurrently from multiple threads. Instead the module is serialized and
+  // parsed into a new context, but the hash is reused rather than computed by
+  // a second serialization of the module.
   Bitcode bitcode;
+  bitcode.reserve(bitcodeSize());
   llvm::raw_svector_ostream ostream(bitcode);
   llvm::WriteBitcodeToFile(module(), ostream);
 
-  return std::make_unique<Benchmark>(name(), bitcode, workingDirectory, bitcodePath(),
-                                     &baselineCosts());
+  auto context = std::make_unique<llvm::LLVMContext>();
+  auto module = makeModuleOrDie(*context, bitcode, name());
+  return std::make_unique<Benchmark>(name(), std::move(context), std::move(module), bitcodeSize(),
+                                     workingDirectory, bitcodePath(), &baselineCosts_, &hash_,
+                                     unoptimizedBitcode_);
+}
+
+double Benchmark::baselineCost(LlvmBaselinePolicy policy, LlvmCostFunction cost) const {
+  if (!hasBaselineCost(baselineCosts_, policy, cost)) {
+    readCachedBaselineCosts();
+  }
+  if (!hasBaselineCost(baselineCosts_, policy, cost)) {
+    computeBaselineCosts([&](const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts) {
+      setBaselineCost(unoptimizedModule, policy, cost, baselineCosts, workingDirectory_);
+    });
+  }
+  return getBaselineCost(baselineCosts_, policy, cost);
+}
+
+const BaselineCosts& Benchmark::baselineCosts() const {
+  const auto isMissing = [](double cost) { return std::isnan(cost); };
+  if (std::any_of(baselineCosts_.begin(), baselineCosts_.end(), isMissing)) {
+    readCachedBaselineCosts();
+  }
+  if (std::any_of(baselineCosts_.begin(), baselineCosts_.end(), isMissing)) {
+    computeBaselineCosts([&](const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts) {
+      setbaselineCosts(unoptimizedModule, baselineCosts, workingDirectory_);
+    });
+  }
+  return baselineCosts_;
+}
+
+const BaselineCosts& Benchmark::knownBaselineCosts() const {
+  const auto isMissing = [](double cost) { return std::isnan(cost); };
+  if (std::any_of(baselineCosts_.begin(), baselineCosts_.end(), isMissing)) {
+    readCachedBaselineCosts();
+  }
+  return baselineCosts_;
+}
+
+void Benchmark::readCachedBaselineCosts() const {
+  BaselineCosts cached;
+  if (BaselineCostsCache::instance().lookup(hash_, &cached)) {
+    mergeBaselineCosts(cached, &baselineCosts_);
+  }
+}
+
+void Benchmark::computeBaselineCosts(
+    std::function<void(const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts)>
+        compute) const {
+  CHECK(unoptimizedBitcode_) << "No unoptimized module to compute baseline costs of " << name();
+  // The unoptimized module is parsed into a throwaway context, so that the
+  // LLVMContext of this benchmark is not modified.
+  llvm::LLVMContext context;
+  auto unoptimizedModule = makeModuleOrDie(context, *unoptimizedBitcode_, name());
+  compute(*unoptimizedModule, &baselineCosts_);
+  BaselineCostsCache::instance().insert(hash_, baselineCosts_);
+}
+
+void Benchmark::replaceModule(std::unique_ptr<llvm::Module> module) {
+  DCHECK(&module->getContext() == context_.get()) << "Module belongs to a different LLVMContext";
+  module_ = std::move(module);
 }
 
 }  // namespace compiler_gym::llvm_service
@@ -6,6 +6,7 @@
 
 #include <grpcpp/grpcpp.h>
 
+#include <functional>
 #include <memory>
 #include <optional>
 
@@ -30,21 +31,28 @@ using Bitcode = llvm::SmallString<0>;
 std::unique_ptr<llvm::Module> makeModule(llvm::LLVMContext& context, const Bitcode& bitcode,
                                          const std::string& name, grpc::Status* status);
 
+// Compute the SHA1 hash of an LLVM module.
+BenchmarkHash getModuleHash(const llvm::Module& module);
+
 // A benchmark is an LLVM module and the LLVM context that owns it.
 class Benchmark {
  public:
   Benchmark(const std::string& name, const Bitcode& bitcode,
             const boost::filesystem::path& workingDirectory,
             std::optional<boost::filesystem::path> bitcodePath = std::nullopt,
-            const BaselineCosts* baselineCosts = nullptr);
+            const BaselineCosts* baselineCosts = nullptr, const BenchmarkHash* hash = nullptr,
+            std::shared_ptr<const Bitcode> unoptimizedBitcode = nullptr);
 
   Benchmark(const std::string& name, std::unique_ptr<llvm::LLVMContext> context,
             std::unique_ptr<llvm::Module> module, size_t bitcodeSize,
             const boost::filesystem::path& workingDirectory,
             std::optional<boost::filesystem::path> bitcodePath = std::nullopt,
-            const BaselineCosts* baselineCosts = nullptr);
+            const BaselineCosts* baselineCosts = nullptr, const BenchmarkHash* hash = nullptr,
+            std::shared_ptr<const Bitcode> unoptimizedBitcode = nullptr);
 
-  // Make a copy of the benchmark.
+  // Make a copy of the benchmark in a new LLVMContext. The copy has the same
+  // hash and baseline costs as this benchmark, which are not recomputed, and
+  // shares the unoptimized bitcode that baseline costs are computed from.
   std::unique_ptr<Benchmark> clone(const boost::filesystem::path& workingDirectory) const;
 
   inline const std::string& name() const { return name_; }
@@ -57,7 +65,26 @@ class Benchmark {
 
   inline const llvm::Module& module() const { return *module_; }
 
-  inline const BaselineCosts& baselineCosts() const { return baselineCosts_; }
+  // Return a baseline cost of the benchmark. Baseline costs are computed on
+  // first use, or read from the persistent BaselineCostsCache.
+  double baselineCost(LlvmBaselinePolicy policy, LlvmCostFunction cost) const;
+
+  // Return all of the baseline costs of the benchmark, computing any that have
+  // not yet been computed.
+  const BaselineCosts& baselineCosts() const;
+
+  // Return the baseline costs of the benchmark that have been computed or are
+  // in the persistent BaselineCostsCache, without computing any others. Costs
+  // that are not known are NaN.
+  const BaselineCosts& knownBaselineCosts() const;
+
+  // Return the bitcode of the module before it was modified, which baseline
+  // costs are computed from. This may be null if every baseline cost is known.
+  inline std::shared_ptr<const Bitcode> unoptimizedBitcode() const { return unoptimizedBitcode_; }
+
+  // Replace the LLVM module of this benchmark. The new module must belong to
+  // the LLVMContext of this benchmark.
+  void replaceModule(std::unique_ptr<llvm::Module> module);
 
   // Accessors for the underlying raw pointers. These should rarely be needed,
   // they are intended for testing. If you really must access the pointers,
@@ -69,13 +96,30 @@ class Benchmark {
   inline const BenchmarkHash hash() const { return hash_; }
 
  private:
+  // Add any baseline costs in the persistent cache to the baseline costs of
+  // this benchmark.
+  void readCachedBaselineCosts() const;
+
+  // Compute baseline costs from the unoptimized module, then write the costs
+  // to the persistent cache.
+  void computeBaselineCosts(
+      std::function<void(const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts)>
+          compute) const;
+
   // NOTE(cummins): Order here is important! The LLVMContext must be declared
   // before Module, as class members are destroyed in the reverse order they are
   // declared, and a module must never outlive its context.
   std::unique_ptr<llvm::LLVMContext> context_;
   std::unique_ptr<llvm::Module> module_;
-  const BaselineCosts baselineCosts_;
-  const BenchmarkHash hash_;
+  BenchmarkHash hash_;
+  // The bitcode of the module before it was modified, which baseline costs
+  // are computed from. This is null if the hash of the benchmark was provided
+  // to the constructor without the unoptimized bitcode, in which case every
+  // baseline cost must be provided or be in the persistent cache.
+  std::shared_ptr<const Bitcode> unoptimizedBitcode_;
+  // The baseline costs, which are NaN until computed.
+  mutable BaselineCosts baselineCosts_;
+  const boost::filesystem::path workingDirectory_;
   const std::string name_;
   // The length of the bitcode string for this benchmark.
   const size_t bitcodeSize_;
@@ -52,8 +52,23 @@ Status BenchmarkFactory::addBitcode(const std::string& uri, const Bitcode& bitco
   std::unique_ptr<llvm::Module> module = makeModule(*context, bitcode, uri, &status);
   RETURN_IF_ERROR(status);
   DCHECK(module);
+  Benchmark benchmark(uri, std::move(context), std::move(module), bitcode.size(), workingDirectory_,
+                      bitcodePath);
 
-  const size_t bitcodeSize = bitcode.size();
+  std::lock_guard<std::mutex> lock(mutex_);
+  insertBenchmark(uri, std::move(benchmark));
+  return Status::OK;
+}
+
+std::shared_ptr<BenchmarkFactory::LoadedBenchmark> BenchmarkFactory::insertBenchmark(
+    const std::string& uri, Benchmark benchmark) {
+  // The benchmark may have been loaded by a concurrent call.
+  auto existing = benchmarks_.find(uri);
+  if (existing != benchmarks_.end()) {
+    return existing->second;
+  }
+
+  const size_t bitcodeSize = benchmark.bitcodeSize();
   if (loadedBenchmarksSize_ + bitcodeSize > maxLoadedBenchmarkSize_) {
     VLOG(2) << "Adding new bitcode with size " << bitcodeSize
             << " exceeds maximum in-memory cache capacity " << maxLoadedBenchmarkSize_ << ", "
@@ -74,19 +89,20 @@ Status BenchmarkFactory::addBitcode(const std::string& uri, const Bitcode& bitco
       std::uniform_int_distribution<size_t> distribution(0, benchmarks_.size() - 1);
       size_t index = distribution(rand_);
       auto iterator = std::next(std::begin(benchmarks_), index);
+      const Benchmark& candidate = iterator->second->benchmark;
 
       // Check that the benchmark has an on-disk bitcode file which
       // can be loaded to re-cache this bitcode. If not, we cannot
       // evict it.
-      if (!iterator->second.bitcodePath().has_value()) {
+      if (!candidate.bitcodePath().has_value()) {
         continue;
       }
 
       // Evict the benchmark: add it to the pool of unloaded benchmarks and
       // delete it from the pool of loaded benchmarks.
       ++evicted;
-      loadedBenchmarksSize_ -= iterator->second.bitcodeSize();
-      unloadedBitcodePaths_.insert({iterator->first, *iterator->second.bitcodePath()});
+      loadedBenchmarksSize_ -= candidate.bitcodeSize();
+      unloadedBitcodePaths_.insert({iterator->first, *candidate.bitcodePath()});
       benchmarks_.erase(iterator);
     }
 
@@ -94,11 +110,10 @@ Status BenchmarkFactory::addBitcode(const std::string& uri, const Bitcode& bitco
             << loadedBenchmarksSize_ << ", " << benchmarks_.size() << " bitcodes";
   }
 
-  benchmarks_.insert({uri, Benchmark(uri, std::move(context), std::move(module), bitcodeSize,
-                                     workingDirectory_, bitcodePath)});
+  auto loaded = std::make_shared<LoadedBenchmark>(std::move(benchmark));
+  benchmarks_.insert({uri, loaded});
   loadedBenchmarksSize_ += bitcodeSize;
-
-  return Status::OK;
+  return loaded;
 }
 
 Status BenchmarkFactory::addBitcodeFile(const std::string& uri,
@@ -106,6 +121,7 @@ Status BenchmarkFactory::addBitcodeFile(const std::string& uri,
   if (!fs::exists(path)) {
     return Status(StatusCode::NOT_FOUND, fmt::format("File not found: \"{}\"", path.string()));
   }
+  std::lock_guard<std::mutex> lock(mutex_);
   unloadedBitcodePaths_[uri] = path;
   return Status::OK;
 }
@@ -190,32 +206,43 @@ Status BenchmarkFactory::addDirectoryOfBitcodes(const boost::filesystem::path& r
 }
 
 Status BenchmarkFactory::getBenchmark(std::unique_ptr<Benchmark>* benchmark) {
-  if (!benchmarks_.size() && !unloadedBitcodePaths_.size()) {
-    return Status(StatusCode::INTERNAL,
-                  fmt::format("No benchmarks registered. Site data directory: `{}`",
-                              kSiteBenchmarksDir.string()));
-  }
-
-  const size_t unloadedBenchmarkCount = unloadedBitcodePaths_.size();
-  const size_t loadedBenchmarkCount = benchmarks_.size();
-
-  const size_t benchmarkCount = unloadedBenchmarkCount + loadedBenchmarkCount;
-
-  std::uniform_int_distribution<size_t> distribution(0, benchmarkCount - 1);
-  size_t index = distribution(rand_);
+  std::shared_ptr<LoadedBenchmark> loaded;
+  std::string uri;
+  fs::path path;
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (!benchmarks_.size() && !unloadedBitcodePaths_.size()) {
+      return Status(StatusCode::INTERNAL,
+                    fmt::format("No benchmarks registered. Site data directory: `{}`",
+                                kSiteBenchmarksDir.string()));
+    }
 
-  if (index < unloadedBenchmarkCount) {
-    // Select a random unloaded benchmark to load and move to the loaded
-    // benchmark collection.
-    auto unloadedBenchmark = std::next(std::begin(unloadedBitcodePaths_), index);
-    CHECK(unloadedBenchmark != unloadedBitcodePaths_.end());
-    RETURN_IF_ERROR(loadBenchmark(unloadedBenchmark, benchmark));
-  } else {
-    auto loadedBenchmark = std::next(std::begin(benchmarks_), index - unloadedBenchmarkCount);
-    CHECK(loadedBenchmark != benchmarks_.end());
-    *benchmark = loadedBenchmark->second.clone(workingDirectory_);
+    const size_t unloadedBenchmarkCount = unloadedBitcodePaths_.size();
+    const size_t loadedBenchmarkCount = benchmarks_.size();
+
+    const size_t benchmarkCount = unloadedBenchmarkCount + loadedBenchmarkCount;
+
+    std::uniform_int_distribution<size_t> distribution(0, benchmarkCount - 1);
+    size_t index = distribution(rand_);
+
+    if (index < unloadedBenchmarkCount) {
+      // Select a random unloaded benchmark to load and move to the loaded
+      // benchmark collection.
+      auto unloadedBenchmark = std::next(std::begin(unloadedBitcodePaths_), index);
+      CHECK(unloadedBenchmark != unloadedBitcodePaths_.end());
+      uri = unloadedBenchmark->first;
+      path = unloadedBenchmark->second;
+    } else {
+      auto loadedBenchmark = std::next(std::begin(benchmarks_), index - unloadedBenchmarkCount);
+      CHECK(loadedBenchmark != benchmarks_.end());
+      loaded = loadedBenchmark->second;
+    }
   }
 
+  if (!loaded) {
+    RETURN_IF_ERROR(loadBenchmark(uri, path, &loaded));
+  }
+  *benchmark = cloneBenchmark(*loaded);
   return Status::OK;
 }
 
@@ -228,15 +255,26 @@ Status BenchmarkFactory::getBenchmark(const std::string& uri,
     resolvedUri = fmt::format("benchmark://{}", uri);
   }
 
-  auto loaded = benchmarks_.find(resolvedUri);
-  if (loaded != benchmarks_.end()) {
-    *benchmark = loaded->second.clone(workingDirectory_);
-    return Status::OK;
+  std::shared_ptr<LoadedBenchmark> loaded;
+  std::optional<fs::path> unloadedPath;
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto loadedBenchmark = benchmarks_.find(resolvedUri);
+    if (loadedBenchmark != benchmarks_.end()) {
+      loaded = loadedBenchmark->second;
+    } else {
+      auto unloaded = unloadedBitcodePaths_.find(resolvedUri);
+      if (unloaded != unloadedBitcodePaths_.end()) {
+        unloadedPath = unloaded->second;
+      }
+    }
   }
 
-  auto unloaded = unloadedBitcodePaths_.find(resolvedUri);
-  if (unloaded != unloadedBitcodePaths_.end()) {
-    RETURN_IF_ERROR(loadBenchmark(unloaded, benchmark));
+  if (unloadedPath.has_value()) {
+    RETURN_IF_ERROR(loadBenchmark(resolvedUri, *unloadedPath, &loaded));
+  }
+  if (loaded) {
+    *benchmark = cloneBenchmark(*loaded);
     return Status::OK;
   }
 
@@ -247,33 +285,41 @@ Status BenchmarkFactory::getBenchmark(const std::string& uri,
 Status BenchmarkFactory::getBenchmarkByUriPrefix(const std::string& uriPrefix,
                                                  const std::string& resolvedUriPrefix,
                                                  std::unique_ptr<Benchmark>* benchmark) {
-  // Make a list of all of the known benchmarks which match this prefix.
-  std::vector<const char*> candidateBenchmarks;
-  for (const auto& it : unloadedBitcodePaths_) {
-    const std::string& uri = it.first;
-    if (uri.rfind(resolvedUriPrefix, 0) == 0) {
-      candidateBenchmarks.push_back(uri.c_str());
+  std::string candidate;
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    // Make a list of all of the known benchmarks which match this prefix.
+    std::vector<const char*> candidateBenchmarks;
+    for (const auto& it : unloadedBitcodePaths_) {
+      const std::string& uri = it.first;
+      if (uri.rfind(resolvedUriPrefix, 0) == 0) {
+        candidateBenchmarks.push_back(uri.c_str());
+      }
     }
-  }
-  for (const auto& it : benchmarks_) {
-    const std::string& uri = it.first;
-    if (uri.rfind(resolvedUriPrefix, 0) == 0) {
-      candidateBenchmarks.push_back(uri.c_str());
+    for (const auto& it : benchmarks_) {
+      const std::string& uri = it.first;
+      if (uri.rfind(resolvedUriPrefix, 0) == 0) {
+        candidateBenchmarks.push_back(uri.c_str());
+      }
     }
-  }
 
-  const size_t candidatesCount = candidateBenchmarks.size();
-  if (!candidatesCount) {
-    return Status(StatusCode::INVALID_ARGUMENT, fmt::format("Unknown benchmark \"{}\"", uriPrefix));
-  }
+    const size_t candidatesCount = candidateBenchmarks.size();
+    if (!candidatesCount) {
+      return Status(StatusCode::INVALID_ARGUMENT,
+                    fmt::format("Unknown benchmark \"{}\"", uriPrefix));
+    }
 
-  // Select randomly from the list of candidates.
-  std::uniform_int_distribution<size_t> distribution(0, candidatesCount - 1);
-  size_t index = distribution(rand_);
-  return getBenchmark(candidateBenchmarks[index], benchmark);
+    // Select randomly from the list of candidates. The URI is copied, as the
+    // candidate may be evicted once the lock is released.
+    std::uniform_int_distribution<size_t> distribution(0, candidatesCount - 1);
+    size_t index = distribution(rand_);
+    candidate = candidateBenchmarks[index];
+  }
+  return getBenchmark(candidate, benchmark);
 }
 
 std::vector<std::string> BenchmarkFactory::getBenchmarkNames() const {
+  std::lock_guard<std::mutex> lock(mutex_);
   std::vector<std::string> names;
   names.reserve(unloadedBitcodePaths_.size() + benchmarks_.size());
   for (const auto& it : unloadedBitcodePaths_) {
@@ -285,43 +331,52 @@ std::vector<std::string> BenchmarkFactory::getBenchmarkNames() const {
   return names;
 }
 
-Status BenchmarkFactory::loadBenchmark(
-    std::unordered_map<std::string, boost::filesystem::path>::const_iterator iterator,
-    std::unique_ptr<Benchmark>* benchmark) {
-  const std::string uri = iterator->first;
-  const char* path = iterator->second.string().c_str();
-
-  VLOG(2) << "loadBenchmark(" << path << ")";
+Status BenchmarkFactory::loadBenchmark(const std::string& uri, const fs::path& path,
+                                       std::shared_ptr<LoadedBenchmark>* loaded) {
+  VLOG(2) << "loadBenchmark(" << path.string() << ")";
 
   Bitcode bitcode;
   std::ifstream ifs;
-  ifs.open(path);
+  ifs.open(path.string());
 
   ifs.seekg(0, std::ios::end);
   if (ifs.fail()) {
-    return Status(StatusCode::NOT_FOUND, fmt::format("Error reading file: \"{}\"", path));
+    return Status(StatusCode::NOT_FOUND, fmt::format("Error reading file: \"{}\"", path.string()));
   }
 
   std::streampos fileSize = ifs.tellg();
   if (!fileSize) {
-    return Status(StatusCode::INVALID_ARGUMENT, fmt::format("File is empty: \"{}\"", path));
+    return Status(StatusCode::INVALID_ARGUMENT,
+                  fmt::format("File is empty: \"{}\"", path.string()));
   }
 
   bitcode.resize(fileSize);
   ifs.seekg(0);
   ifs.read(&bitcode[0], bitcode.size());
   if (ifs.fail()) {
-    return Status(StatusCode::NOT_FOUND, fmt::format("Error reading file: \"{}\"", path));
+    return Status(StatusCode::NOT_FOUND, fmt::format("Error reading file: \"{}\"", path.string()));
   }
 
-  RETURN_IF_ERROR(addBitcode(uri, bitcode, fs::path(path)));
+  Status status;
+  auto context = std::make_unique<llvm::LLVMContext>();
+  auto module = makeModule(*context, bitcode, uri, &status);
+  RETURN_IF_ERROR(status);
+  Benchmark benchmark(uri, std::move(context), std::move(module), bitcode.size(), workingDirectory_,
+                      path);
 
-  unloadedBitcodePaths_.erase(iterator);
-  *benchmark = benchmarks_.find(uri)->second.clone(workingDirectory_);
+  std::lock_guard<std::mutex> lock(mutex_);
+  *loaded = insertBenchmark(uri, std::move(benchmark));
+  unloadedBitcodePaths_.erase(uri);
   return Status::OK;
 }
 
+std::unique_ptr<Benchmark> BenchmarkFactory::cloneBenchmark(LoadedBenchmark& loaded) const {
+  std::lock_guard<std::mutex> lock(loaded.mutex);
+  return loaded.benchmark.clone(workingDirectory_);
+}
+
 size_t BenchmarkFactory::numBenchmarks() const {
+  std::lock_guard<std::mutex> lock(mutex_);
   return benchmarks_.size() + unloadedBitcodePaths_.size();
 }
 
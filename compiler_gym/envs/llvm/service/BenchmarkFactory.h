@@ -7,6 +7,8 @@
 #include <grpcpp/grpcpp.h>
 
 #include <array>
+#include <memory>
+#include <mutex>
 #include <optional>
 #include <random>
 #include <string>
@@ -35,6 +37,11 @@ constexpr size_t kMaxLoadedBenchmarkSize = 512 * 1024 * 1024;
 //       auto benchmark = factory.getBenchmark();
 //       // ... do fun stuff
 //     }
+//
+// A factory may be used concurrently. The in-memory cache is guarded by a
+// mutex that is held only to look up or insert benchmarks, so benchmarks are
+// read from disk and parsed without holding it. Each loaded benchmark has its
+// own mutex which guards its LLVMContext while it is cloned.
 class BenchmarkFactory {
  public:
   // Construct a benchmark factory. rand is a random seed used to control the
@@ -97,9 +104,28 @@ class BenchmarkFactory {
   [[nodiscard]] grpc::Status addBitcodeFile(const std::string& uri,
                                             const boost::filesystem::path& path);
 
-  [[nodiscard]] grpc::Status loadBenchmark(
-      std::unordered_map<std::string, boost::filesystem::path>::const_iterator iterator,
-      std::unique_ptr<Benchmark>* benchmark);
+  // A benchmark which has been loaded into memory. The mutex guards the
+  // LLVMContext of the benchmark, which is used to clone it.
+  struct LoadedBenchmark {
+    explicit LoadedBenchmark(Benchmark benchmark) : benchmark(std::move(benchmark)) {}
+
+    std::mutex mutex;
+    Benchmark benchmark;
+  };
+
+  // Read and parse a bitcode file, then add it to the in-memory cache. The
+  // file is read without holding mutex_.
+  [[nodiscard]] grpc::Status loadBenchmark(const std::string& uri,
+                                           const boost::filesystem::path& path,
+                                           std::shared_ptr<LoadedBenchmark>* loaded);
+
+  // Add a benchmark to the in-memory cache, evicting benchmarks if the cache
+  // is full, and return the cached benchmark. If the URI is already cached,
+  // the existing benchmark is returned. mutex_ must be held by the caller.
+  std::shared_ptr<LoadedBenchmark> insertBenchmark(const std::string& uri, Benchmark benchmark);
+
+  // Make a copy of a loaded benchmark, holding only the lock of the benchmark.
+  std::unique_ptr<Benchmark> cloneBenchmark(LoadedBenchmark& loaded) const;
 
   // A map from benchmark name to the path of a bitcode file. This is used to
   // store the paths of benchmarks w
@@ -107,10 +133,15 @@ class BenchmarkFactory {
   // Once loaded, they are removed from this map and replaced by an entry in
   // benchmarks_.
   std::unordered_map<std::string, boost::filesystem::path> unloadedBitcodePaths_;
-  // A mapping from URI to benchmarks which have been loaded into memory.
-  std::unordered_map<std::string, Benchmark> benchmarks_;
+  // A mapping from URI to benchmarks which have been loaded into memory. A
+  // benchmark that is evicted while it is being cloned is kept alive by the
+  // shared pointer.
+  std::unordered_map<std::string, std::shared_ptr<LoadedBenchmark>> benchmarks_;
 
   const boost::filesystem::path workingDirectory_;
+  // Guards unloadedBitcodePaths_, benchmarks_, rand_, and
+  // loadedBenchmarksSize_.
+  mutable std::mutex mutex_;
   std::mt19937_64 rand_;
   // The current and maximum allowed sizes of the loaded benchmarks.
   size_t loadedBenchmarksSize_;
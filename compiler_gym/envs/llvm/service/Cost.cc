@@ -8,14 +8,26 @@
 #include <glog/logging.h>
 #include <grpcpp/grpcpp.h>
 
+#include <cmath>
+#include <limits>
+#include <mutex>
 #include <subprocess/subprocess.hpp>
 #include <system_error>
+#include <vector>
 
 #include "boost/filesystem.hpp"
 #include "compiler_gym/util/GrpcStatusMacros.h"
 #include "compiler_gym/util/RunfilesPath.h"
+#include "llvm/Analysis/TargetLibraryInfo.h"
 #include "llvm/IR/LegacyPassManager.h"
+#include "llvm/Object/ObjectFile.h"
+#include "llvm/Support/Host.h"
+#include "llvm/Support/TargetRegistry.h"
+#include "llvm/Support/TargetSelect.h"
+#include "llvm/Target/TargetMachine.h"
+#include "llvm/Target/TargetOptions.h"
 #include "llvm/Transforms/IPO.h"
+#include "llvm/Transforms/IPO/AlwaysInliner.h"
 #include "llvm/Transforms/IPO/PassManagerBuilder.h"
 #include "llvm/Transforms/Utils/Cloning.h"
 
@@ -52,6 +64,77 @@ bool applyBaselineOptimizations(llvm::Module* module, unsigned optLevel, unsigne
   return changed;
 }
 
+// Initialize the LLVM targets that are used to generate code.
+void initTargets() {
+  static std::once_flag flag;
+  std::call_once(flag, []() {
+    llvm::InitializeAllTargetInfos();
+    llvm::InitializeAllTargets();
+    llvm::InitializeAllTargetMCs();
+    llvm::InitializeAllAsmPrinters();
+  });
+}
+
+// Compute the total size of the executable sections of the object file of a
+// module. The object file is generated in memory in the same way as `clang -c`
+// at -O0: always-inline functions are inlined, and code generation is
+// unoptimized and relaxes all instructions. Only executable sections (e.g.
+// .text) are counted, so this is smaller than the "text" column reported by
+// llvm-size, which also includes read-only data and unwind tables.
+Status getObjectTextSizeInBytes(const llvm::Module& module, int64_t* value) {
+  initTargets();
+
+  std::string triple = module.getTargetTriple();
+  if (triple.empty()) {
+    triple = llvm::sys::getDefaultTargetTriple();
+  }
+  std::string error;
+  const llvm::Target* target = llvm::TargetRegistry::lookupTarget(triple, error);
+  if (!target) {
+    return Status(StatusCode::INTERNAL, fmt::format("Failed to find target: {}", error));
+  }
+  // The clang driver passes -mrelax-all at -O0.
+  llvm::TargetOptions options;
+  options.MCOptions.MCRelaxAll = true;
+  std::unique_ptr<llvm::TargetMachine> targetMachine(
+      target->createTargetMachine(triple, /*CPU=*/"", /*Features=*/"", options, /*RM=*/llvm::None,
+                                  /*CM=*/llvm::None, llvm::CodeGenOpt::None));
+
+  // Code generation modifies the module, so compile a copy of it.
+  std::unique_ptr<llvm::Module> copy = llvm::CloneModule(module);
+  copy->setTargetTriple(triple);
+  copy->setDataLayout(targetMachine->createDataLayout());
+
+  llvm::SmallVector<char, 0> object;
+  llvm::raw_svector_ostream ostream(object);
+  llvm::legacy::PassManager passManager;
+  passManager.add(new llvm::TargetLibraryInfoWrapperPass(llvm::Triple(triple)));
+  passManager.add(llvm::createAlwaysInlinerLegacyPass(/*InsertLifetime=*/false));
+  if (targetMachine->addPassesToEmitFile(passManager, ostream, /*DwoOut=*/nullptr,
+                                         llvm::CGFT_ObjectFile)) {
+    return Status(StatusCode::INTERNAL,
+                  fmt::format("Target cannot emit an object file: {}", triple));
+  }
+  passManager.run(*copy);
+
+  // Sum the sizes of the executable sections.
+  auto objectFile = llvm::object::ObjectFile::createObjectFile(
+      llvm::MemoryBufferRef(llvm::StringRef(object.data(), object.size()), "object"));
+  if (!objectFile) {
+    return Status(StatusCode::INTERNAL, fmt::format("Failed to read object file: {}",
+                                                    llvm::toString(objectFile.takeError())));
+  }
+  int64_t size = 0;
+  for (const auto& section : (*objectFile)->sections()) {
+    if (section.isText()) {
+      size += section.getSize();
+    }
+  }
+  *value = size;
+  return Status::OK;
+}
+
+#ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
 // Serialize the module to a string.
 std::string moduleToString(llvm::Module& module) {
   std::string str;
@@ -60,15 +143,11 @@ std::string moduleToString(llvm::Module& module) {
   return str;
 }
 
-// For the experimental binary .text size cost, getTextSizeInBytes() is extended
-// to support a list of additional args to pass to clang.
-#ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
+// Compute the .text size of a module by compiling it using clang with the
+// given additional args, and reading the size of the output using llvm-size.
 Status getTextSizeInBytes(llvm::Module& module, int64_t* value,
                           const std::vector<std::string>& clangArgs,
                           const fs::path& workingDirectory) {
-#else
-Status getTextSizeInBytes(llvm::Module& module, int64_t* value, const fs::path& workingDirectory) {
-#endif
   const auto clangPath = util::getRunfilesPath("compiler_gym/third_party/llvm/clang");
   const auto llvmSizePath = util::getRunfilesPath("compiler_gym/third_party/llvm/llvm-size");
   DCHECK(fs::exists(clangPath)) << "File not found: " << clangPath.string();
@@ -80,18 +159,11 @@ Status getTextSizeInBytes(llvm::Module& module, int64_t* value, const fs::path&
 
   const auto tmpFile = fs::unique_path(workingDirectory / "obj-%%%%");
 
-#ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
   std::vector<std::string> clangCmd{clangPath.string(), "-xir", "-", "-o", tmpFile.string()};
   clangCmd.insert(clangCmd.end(), clangArgs.begin(), clangArgs.end());
   auto clang =
       subprocess::Popen(clangCmd, subprocess::input{subprocess::PIPE},
                         subprocess::output{subprocess::PIPE}, subprocess::error{subprocess::PIPE});
-#else
-  auto clang =
-      subprocess::Popen({clangPath.string(), "-xir", "-", "-o", tmpFile.string(), "-c"},
-                        subprocess::input{subprocess::PIPE}, subprocess::output{subprocess::PIPE},
-                        subprocess::error{subprocess::PIPE});
-#endif
   const auto clangOutput = clang.communicate(ir.c_str(), ir.size());
   if (clang.retcode()) {
     fs::remove(tmpFile);
@@ -131,6 +203,7 @@ Status getTextSizeInBytes(llvm::Module& module, int64_t* value, const fs::path&
   }
   return Status::OK;
 }
+#endif
 
 inline size_t getBaselineCostIndex(LlvmBaselinePolicy policy, LlvmCostFunction cost) {
   return static_cast<size_t>(magic_enum::enum_count<LlvmCostFunction>()) *
@@ -138,6 +211,29 @@ inline size_t getBaselineCostIndex(LlvmBaselinePolicy policy, LlvmCostFunction c
          static_cast<size_t>(cost);
 }
 
+// Apply the optimizations of a baseline policy to a copy of the unoptimized
+// module, then compute the given costs of it.
+void setBaselineCostsForPolicy(const llvm::Module& unoptimizedModule, LlvmBaselinePolicy policy,
+                               const std::vector<LlvmCostFunction>& costs,
+                               BaselineCosts* baselineCosts, const fs::path& workingDirectory) {
+  std::unique_ptr<llvm::Module> baselineModule = llvm::CloneModule(unoptimizedModule);
+  switch (policy) {
+    case LlvmBaselinePolicy::O0:
+      break;
+    case LlvmBaselinePolicy::O3:
+      applyBaselineOptimizations(baselineModule.get(), /*optLevel=*/3, /*sizeLevel=*/0);
+      break;
+    case LlvmBaselinePolicy::Oz:
+      applyBaselineOptimizations(baselineModule.get(), /*optLevel=*/2, /*sizeLevel=*/2);
+      break;
+  }
+
+  for (const auto cost : costs) {
+    (*baselineCosts)[getBaselineCostIndex(policy, cost)] =
+        getCost(cost, *baselineModule, workingDirectory);
+  }
+}
+
 }  // anonymous namespace
 
 double getCost(const LlvmCostFunction& cost, llvm::Module& module,
@@ -147,11 +243,7 @@ double getCost(const LlvmCostFunction& cost, llvm::Module& module,
       return static_cast<double>(module.getInstructionCount());
     case LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES: {
       int64_t size;
-#ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
-      const auto status = getTextSizeInBytes(module, &size, {"-c"}, workingDirectory);
-#else
-      const auto status = getTextSizeInBytes(module, &size, workingDirectory);
-#endif
+      const auto status = getObjectTextSizeInBytes(module, &size);
       CHECK(status.ok()) << status.error_message();
       return static_cast<double>(size);
     }
@@ -179,39 +271,43 @@ double getBaselineCost(const BaselineCosts& baselineCosts, LlvmBaselinePolicy po
   return baselineCosts[getBaselineCostIndex(policy, cost)];
 }
 
-void setbaselineCosts(const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts,
-                      const fs::path& workingDirectory) {
-  // Create a copy of the unoptimized module and apply the default set of LLVM
-  // optimizations.
-  std::unique_ptr<llvm::Module> moduleO0 = llvm::CloneModule(unoptimizedModule);
+BaselineCosts getEmptyBaselineCosts() {
+  BaselineCosts baselineCosts;
+  baselineCosts.fill(std::numeric_limits<double>::quiet_NaN());
+  return baselineCosts;
+}
 
-  std::unique_ptr<llvm::Module> moduleOz = llvm::CloneModule(unoptimizedModule);
-  applyBaselineOptimizations(moduleOz.get(), /*optLevel=*/2, /*sizeLevel=*/2);
+bool hasBaselineCost(const BaselineCosts& baselineCosts, LlvmBaselinePolicy policy,
+                     LlvmCostFunction cost) {
+  return !std::isnan(baselineCosts[getBaselineCostIndex(policy, cost)]);
+}
 
-  std::unique_ptr<llvm::Module> moduleO3 = llvm::CloneModule(unoptimizedModule);
-  applyBaselineOptimizations(moduleO3.get(), /*optLevel=*/3, /*sizeLevel=*/0);
+void setBaselineCost(const llvm::Module& unoptimizedModule, LlvmBaselinePolicy policy,
+                     LlvmCostFunction cost, BaselineCosts* baselineCosts,
+                     const fs::path& workingDirectory) {
+  setBaselineCostsForPolicy(unoptimizedModule, policy, {cost}, baselineCosts, workingDirectory);
+}
 
+void setbaselineCosts(const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts,
+                      const fs::path& workingDirectory) {
+  // The optimizations of each policy are applied at most once.
   for (const auto policy : magic_enum::enum_values<LlvmBaselinePolicy>()) {
-    // Set the baseline module.
-    llvm::Module* baselineModule{nullptr};
-    switch (policy) {
-      case LlvmBaselinePolicy::O0:
-        baselineModule = moduleO0.get();
-        break;
-      case LlvmBaselinePolicy::O3:
-        baselineModule = moduleO3.get();
-        break;
-      case LlvmBaselinePolicy::Oz:
-        baselineModule = moduleOz.get();
-        break;
+    std::vector<LlvmCostFunction> costs;
+    for (const auto cost : magic_enum::enum_values<LlvmCostFunction>()) {
+      if (!hasBaselineCost(*baselineCosts, policy, cost)) {
+        costs.push_back(cost);
+      }
+    }
+    if (costs.size()) {
+      setBaselineCostsForPolicy(unoptimizedModule, policy, costs, baselineCosts, workingDirectory);
     }
-    DCHECK(baselineModule);
+  }
+}
 
-    // Compute and set the baseline costs.
-    for (const auto cost : magic_enum::enum_values<LlvmCostFunction>()) {
-      const auto idx = getBaselineCostIndex(policy, cost);
-      const auto cc = getCost(cost, *baselineModule, workingDirectory);
-      (*baselineCosts)[idx] = cc;
+void mergeBaselineCosts(const BaselineCosts& from, BaselineCosts* to) {
+  for (size_t i = 0; i < from.size(); ++i) {
+    if (!std::isnan(from[i])) {
+      (*to)[i] = from[i];
     }
   }
 }
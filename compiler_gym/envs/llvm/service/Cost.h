@@ -37,6 +37,17 @@ constexpr size_t numBaselineCosts = magic_enum::enum_count<LlvmBaselinePolicy>()
 using BaselineCosts = std::array<double, numBaselineCosts>;
 using PreviousCosts = std::array<std::optional<double>, numCosts>;
 
+// The version of the cost functions. Costs that are stored on disk are reused
+// only by services with the same version, so this must be incremented whenever
+// a change to a cost function changes the values that it computes.
+//
+// Version history:
+//   1: OBJECT_TEXT_SIZE_BYTES is the "text" column of llvm-size for the object
+//      file generated by `clang -c`.
+//   2: OBJECT_TEXT_SIZE_BYTES is the size of the executable sections of an
+//      object file that is generated in-process.
+constexpr int costFunctionsVersion = 2;
+
 // TODO(cummins): Refactor cost calculation to allow graceful error handling
 // by returning a grpc::Status.
 
@@ -44,14 +55,32 @@ using PreviousCosts = std::array<std::optional<double>, numCosts>;
 double getCost(const LlvmCostFunction& cost, llvm::Module& module,
                const boost::filesystem::path& workingDirectory);
 
+// Baseline costs are computed on demand. A baseline cost that has not been
+// computed is NaN.
+
+// Return baseline costs in which no cost has been computed.
+BaselineCosts getEmptyBaselineCosts();
+
+// Return whether a baseline cost has been computed.
+bool hasBaselineCost(const BaselineCosts& baselineCosts, LlvmBaselinePolicy policy,
+                     LlvmCostFunction cost);
+
 // Return a baseline cost.
 double getBaselineCost(const BaselineCosts& baselineCosts, LlvmBaselinePolicy policy,
                        LlvmCostFunction cost);
 
-// Compute the costs of baseline policies.
+// Compute a single baseline cost.
+void setBaselineCost(const llvm::Module& unoptimizedModule, LlvmBaselinePolicy policy,
+                     LlvmCostFunction cost, BaselineCosts* baselineCosts,
+                     const boost::filesystem::path& workingDirectory);
+
+// Compute the costs of baseline policies which have not been computed.
 void setbaselineCosts(const llvm::Module& unoptimizedModule, BaselineCosts* baselineCosts,
                       const boost::filesystem::path& workingDirectory);
 
+// Copy the computed costs from one set of baseline costs to another.
+void mergeBaselineCosts(const BaselineCosts& from, BaselineCosts* to);
+
 // Translate from reward space to a cost function.
 LlvmCostFunction getCostFunction(LlvmRewardSpace space);
 
@@ -0,0 +1,64 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include "compiler_gym/envs/llvm/service/CostCache.h"
+
+namespace compiler_gym::llvm_service {
+
+CostCache::CostCache(size_t maxSize, CostDatabase* database)
+    : maxSize_(maxSize), database_(database) {}
+
+bool CostCache::lookup(const llvm::ModuleHash& hash, LlvmCostFunction cost, double* value) {
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto it = index_.find({hash, cost});
+    if (it != index_.end()) {
+      // Move the entry to the front of the list.
+      entries_.splice(entries_.begin(), entries_, it->second);
+      *value = it->second->second;
+      return true;
+    }
+  }
+  // The database has its own lock, so that reading it does not block other
+  // users of the in-memory cache.
+  if (!database_ || !database_->lookup(hash, cost, value)) {
+    return false;
+  }
+  std::lock_guard<std::mutex> lock(mutex_);
+  insertEntry({hash, cost}, *value);
+  return true;
+}
+
+void CostCache::insert(const llvm::ModuleHash& hash, LlvmCostFunction cost, double value) {
+  if (database_) {
+    database_->insert(hash, cost, value);
+  }
+  std::lock_guard<std::mutex> lock(mutex_);
+  insertEntry({hash, cost}, value);
+}
+
+size_t CostCache::size() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return entries_.size();
+}
+
+void CostCache::insertEntry(const Key& key, double value) {
+  if (!maxSize_) {
+    return;
+  }
+  auto it = index_.find(key);
+  if (it != index_.end()) {
+    it->second->second = value;
+    entries_.splice(entries_.begin(), entries_, it->second);
+    return;
+  }
+  entries_.emplace_front(key, value);
+  index_.emplace(key, entries_.begin());
+  if (entries_.size() > maxSize_) {
+    index_.erase(entries_.back().first);
+    entries_.pop_back();
+  }
+}
+
+}  // namespace compiler_gym::llvm_service
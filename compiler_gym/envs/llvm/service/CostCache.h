@@ -0,0 +1,60 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#pragma once
+
+#include <list>
+#include <map>
+#include <mutex>
+#include <utility>
+
+#include "compiler_gym/envs/llvm/service/Cost.h"
+#include "compiler_gym/envs/llvm/service/CostDatabase.h"
+#include "llvm/IR/ModuleSummaryIndex.h"
+
+namespace compiler_gym::llvm_service {
+
+// An in-memory cache of the costs of modules, keyed by the hash of the module
+// and the cost function. Different sessions often reach identical modules,
+// e.g. by running the same passes on the same benchmark, so a cache that is
+// shared by every session of a service avoids computing the same costs again.
+//
+// The cache holds at most maxSize entries. When it is full, the least recently
+// used entry is evicted. A maxSize of zero disables the in-memory cache.
+//
+// If a database is given, costs that are not in memory are looked up in the
+// database, and new costs are added to it. The database must outlive the
+// cache.
+//
+// This class is thread safe.
+class CostCache {
+ public:
+  explicit CostCache(size_t maxSize, CostDatabase* database = nullptr);
+
+  // Look up the cost of a module. Returns false if the cost is not cached.
+  [[nodiscard]] bool lookup(const llvm::ModuleHash& hash, LlvmCostFunction cost, double* value);
+
+  // Add the cost of a module to the cache, and to the database.
+  void insert(const llvm::ModuleHash& hash, LlvmCostFunction cost, double value);
+
+  size_t size() const;
+
+  inline size_t maxSize() const { return maxSize_; }
+
+ private:
+  using Key = std::pair<llvm::ModuleHash, LlvmCostFunction>;
+  using Entry = std::pair<Key, double>;
+
+  // Add an entry to the in-memory cache. Must be called with the mutex held.
+  void insertEntry(const Key& key, double value);
+
+  const size_t maxSize_;
+  CostDatabase* const database_;
+  mutable std::mutex mutex_;
+  // The entries in most-recently-used order.
+  std::list<Entry> entries_;
+  std::map<Key, std::list<Entry>::iterator> index_;
+};
+
+}  // namespace compiler_gym::llvm_service
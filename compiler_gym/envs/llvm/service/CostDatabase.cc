@@ -0,0 +1,181 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include "compiler_gym/envs/llvm/service/CostDatabase.h"
+
+#include <fcntl.h>
+#include <fmt/format.h>
+#include <glog/logging.h>
+#include <sys/file.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <algorithm>
+#include <array>
+#include <boost/crc.hpp>
+#include <cstring>
+#include <optional>
+
+#include "compiler_gym/util/RunfilesPath.h"
+#include "llvm/ADT/Triple.h"
+#include "llvm/Config/llvm-config.h"
+
+namespace fs = boost::filesystem;
+
+namespace compiler_gym::llvm_service {
+
+namespace {
+
+// A slot is a marker, followed by the cost function, followed by a module
+// hash, followed by the cost, followed by a checksum of the preceding bytes.
+// An empty slot is all zeros, so it has no marker.
+constexpr uint32_t kSlotMarker = 0x44434743;  // "CGCD"
+constexpr size_t kMarkerSize = sizeof(kSlotMarker);
+constexpr size_t kCostFunctionSize = sizeof(uint32_t);
+constexpr size_t kHashSize = sizeof(llvm::ModuleHash);
+constexpr size_t kChecksumSize = sizeof(uint32_t);
+constexpr size_t kCostFunctionOffset = kMarkerSize;
+constexpr size_t kHashOffset = kCostFunctionOffset + kCostFunctionSize;
+constexpr size_t kValueOffset = kHashOffset + kHashSize;
+constexpr size_t kChecksumOffset = kValueOffset + sizeof(double);
+constexpr size_t kSlotSize = kChecksumOffset + kChecksumSize;
+
+// The number of consecutive slots in which a key may be stored.
+constexpr size_t kMaxProbes = 8;
+
+using Slot = std::array<char, kSlotSize>;
+
+uint32_t getChecksum(const Slot& slot) {
+  boost::crc_32_type crc;
+  crc.process_bytes(slot.data(), kChecksumOffset);
+  return crc.checksum();
+}
+
+bool isValidSlot(const Slot& slot) {
+  uint32_t marker;
+  uint32_t checksum;
+  std::memcpy(&marker, slot.data(), kMarkerSize);
+  std::memcpy(&checksum, slot.data() + kChecksumOffset, kChecksumSize);
+  return marker == kSlotMarker && checksum == getChecksum(slot);
+}
+
+bool slotHasKey(const Slot& slot, const llvm::ModuleHash& hash, LlvmCostFunction cost) {
+  uint32_t costFunction;
+  std::memcpy(&costFunction, slot.data() + kCostFunctionOffset, kCostFunctionSize);
+  return costFunction == static_cast<uint32_t>(cost) &&
+         !std::memcmp(slot.data() + kHashOffset, hash.data(), kHashSize);
+}
+
+// Read a slot. Returns false if the slot cannot be read.
+bool readSlot(int fd, size_t index, Slot* slot) {
+  return pread(fd, slot->data(), kSlotSize, index * kSlotSize) == static_cast<ssize_t>(kSlotSize);
+}
+
+}  // anonymous namespace
+
+CostDatabase::CostDatabase(const fs::path& path, size_t numSlots)
+    : path_(path), numSlots_(std::max(numSlots, static_cast<size_t>(1))), fd_(-1) {
+  boost::system::error_code ec;
+  fs::create_directories(path_.parent_path(), ec);
+  fd_ = open(path_.c_str(), O_RDWR | O_CREAT, 0644);
+  if (fd_ == -1) {
+    LOG(WARNING) << "Failed to open cost database " << path_.string() << ": "
+                 << std::strerror(errno);
+    return;
+  }
+
+  // Allocate the slots of a new file. The file is sparse, so slots use no disk
+  // space until they are written.
+  flock(fd_, LOCK_EX);
+  struct stat st;
+  if (fstat(fd_, &st) == 0 && st.st_size >= static_cast<off_t>(kSlotSize) &&
+      st.st_size % kSlotSize == 0) {
+    numSlots_ = st.st_size / kSlotSize;
+  } else if (ftruncate(fd_, numSlots_ * kSlotSize)) {
+    LOG(WARNING) << "Failed to allocate cost database " << path_.string() << ": "
+                 << std::strerror(errno);
+  }
+  flock(fd_, LOCK_UN);
+}
+
+CostDatabase::~CostDatabase() {
+  if (fd_ != -1) {
+    close(fd_);
+  }
+}
+
+fs::path CostDatabase::defaultPath() {
+  return util::getCachePath(fmt::format("llvm/costs-v{}-{}-{}.bin", costFunctionsVersion,
+                                        LLVM_VERSION_STRING,
+                                        llvm::Triple::normalize(LLVM_DEFAULT_TARGET_TRIPLE)));
+}
+
+size_t CostDatabase::getFirstSlot(const llvm::ModuleHash& hash, LlvmCostFunction cost) const {
+  // The module hash is a SHA1 hash, so any of its bits are uniformly
+  // distributed.
+  uint64_t index;
+  std::memcpy(&index, hash.data(), sizeof(index));
+  index ^= static_cast<uint64_t>(cost) * 0x9e3779b97f4a7c15ULL;
+  return index % numSlots_;
+}
+
+bool CostDatabase::lookup(const llvm::ModuleHash& hash, LlvmCostFunction cost, double* value) {
+  if (fd_ == -1) {
+    return false;
+  }
+  const size_t first = getFirstSlot(hash, cost);
+  Slot slot;
+  for (size_t i = 0; i < std::min(kMaxProbes, numSlots_); ++i) {
+    if (readSlot(fd_, (first + i) % numSlots_, &slot) && isValidSlot(slot) &&
+        slotHasKey(slot, hash, cost)) {
+      std::memcpy(value, slot.data() + kValueOffset, sizeof(double));
+      return true;
+    }
+  }
+  return false;
+}
+
+void CostDatabase::insert(const llvm::ModuleHash& hash, LlvmCostFunction cost, double value) {
+  if (fd_ == -1) {
+    return;
+  }
+  std::lock_guard<std::mutex> lock(mutex_);
+  flock(fd_, LOCK_EX);
+
+  // Use the slot that holds the key, else the first empty or invalid slot, else
+  // overwrite a slot that is chosen by the hash.
+  const size_t first = getFirstSlot(hash, cost);
+  const size_t numProbes = std::min(kMaxProbes, numSlots_);
+  std::optional<size_t> index;
+  Slot slot;
+  for (size_t i = 0; i < numProbes; ++i) {
+    const size_t probe = (first + i) % numSlots_;
+    if (!readSlot(fd_, probe, &slot) || !isValidSlot(slot)) {
+      if (!index.has_value()) {
+        index = probe;
+      }
+    } else if (slotHasKey(slot, hash, cost)) {
+      index = probe;
+      break;
+    }
+  }
+  if (!index.has_value()) {
+    index = (first + static_cast<uint8_t>(hash[1]) % numProbes) % numSlots_;
+  }
+
+  const uint32_t costFunction = static_cast<uint32_t>(cost);
+  std::memcpy(slot.data(), &kSlotMarker, kMarkerSize);
+  std::memcpy(slot.data() + kCostFunctionOffset, &costFunction, kCostFunctionSize);
+  std::memcpy(slot.data() + kHashOffset, hash.data(), kHashSize);
+  std::memcpy(slot.data() + kValueOffset, &value, sizeof(double));
+  const uint32_t checksum = getChecksum(slot);
+  std::memcpy(slot.data() + kChecksumOffset, &checksum, kChecksumSize);
+  if (pwrite(fd_, slot.data(), kSlotSize, *index * kSlotSize) != static_cast<ssize_t>(kSlotSize)) {
+    LOG(WARNING) << "Failed to write to cost database " << path_.string();
+  }
+
+  flock(fd_, LOCK_UN);
+}
+
+}  // namespace compiler_gym::llvm_service
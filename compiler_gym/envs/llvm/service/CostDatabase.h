@@ -0,0 +1,73 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#pragma once
+
+#include <mutex>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/Cost.h"
+#include "llvm/IR/ModuleSummaryIndex.h"
+
+namespace compiler_gym::llvm_service {
+
+// A persistent database of the costs of modules, keyed by the hash of the
+// module and the cost function. The database is a file that can be shared by
+// every service on the machine, so that the cost of a module is computed only
+// once, even across processes.
+//
+// The file is a hash table of fixed-size slots, so its size is bounded and a
+// lookup reads only a few slots of the file. A key may be stored in any of a
+// small number of consecutive slots. When all of them are used, an insert
+// overwrites one of them, so the database behaves as a cache. Writers lock the
+// file while choosing and writing a slot. Readers do not lock the file, so
+// every slot ends with a checksum, and readers ignore slots that are invalid,
+// e.g. because a write is in progress. Errors reading or writing the file are
+// logged and otherwise ignored, since the costs can always be recomputed.
+//
+// This class is thread safe.
+class CostDatabase {
+ public:
+  // Open or create a database. The number of slots is used only when the file
+  // is created. An existing file keeps its number of slots.
+  explicit CostDatabase(const boost::filesystem::path& path, size_t numSlots = kDefaultNumSlots);
+
+  ~CostDatabase();
+
+  CostDatabase(const CostDatabase&) = delete;
+  CostDatabase& operator=(const CostDatabase&) = delete;
+
+  // The path of the database in the CompilerGym cache directory. Costs depend
+  // on the compiler and on the version of the cost functions, so the name of
+  // the file includes both, and the default target triple.
+  static boost::filesystem::path defaultPath();
+
+  // Look up the cost of a module. Returns false if the cost is not in the
+  // database.
+  [[nodiscard]] bool lookup(const llvm::ModuleHash& hash, LlvmCostFunction cost, double* value);
+
+  // Add the cost of a module to the database.
+  void insert(const llvm::ModuleHash& hash, LlvmCostFunction cost, double value);
+
+  inline const boost::filesystem::path& path() const { return path_; }
+
+  inline size_t numSlots() const { return numSlots_; }
+
+  // 2^20 slots, which is 40 MiB.
+  static constexpr size_t kDefaultNumSlots = 1 << 20;
+
+ private:
+  // The index of the first slot that may hold a key.
+  size_t getFirstSlot(const llvm::ModuleHash& hash, LlvmCostFunction cost) const;
+
+  const boost::filesystem::path path_;
+  size_t numSlots_;
+  // The file descriptor of the database, or -1 if it could not be opened.
+  int fd_;
+  // Guards writes to the file by the threads of this process. Writes by other
+  // processes are guarded by locking the file.
+  std::mutex mutex_;
+};
+
+}  // namespace compiler_gym::llvm_service
@@ -8,6 +8,10 @@
 #include <fmt/format.h>
 #include <glog/logging.h>
 
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <fstream>
 #include <optional>
 
 #include "boost/filesystem.hpp"
@@ -29,6 +33,7 @@
 #include "llvm/Pass.h"
 #include "llvm/Support/TargetSelect.h"
 #include "llvm/Support/raw_ostream.h"
+#include "llvm/Transforms/Utils/Cloning.h"
 #include "nlohmann/json.hpp"
 #include "programl/graph/format/node_link_graph.h"
 #include "programl/ir/llvm/llvm.h"
@@ -105,15 +110,22 @@ void initLlvm() {
 }  // anonymous namespace
 
 LlvmEnvironment::LlvmEnvironment(std::unique_ptr<Benchmark> benchmark, LlvmActionSpace actionSpace,
-                                 std::optional<LlvmObservationSpace> eagerObservationSpace,
-                                 std::optional<LlvmRewardSpace> eagerRewardSpace,
-                                 const boost::filesystem::path& workingDirectory)
+                                 const std::vector<LlvmObservationSpace>& eagerObservationSpaces,
+                                 const std::vector<LlvmRewardSpace>& eagerRewardSpaces,
+                                 bool eagerSpaceLists, int64_t sharedMemoryObservationThreshold,
+                                 const boost::filesystem::path& workingDirectory,
+                                 const boost::filesystem::path& sharedMemoryRoot,
+                                 CostCache* costCache)
     : workingDirectory_(workingDirectory),
+      sharedMemoryRoot_(sharedMemoryRoot),
       benchmark_(std::move(benchmark)),
       actionSpace_(actionSpace),
-      eagerObservationSpace_(eagerObservationSpace),
-      eagerRewardSpace_(eagerRewardSpace),
+      eagerObservationSpaces_(eagerObservationSpaces),
+      eagerRewardSpaces_(eagerRewardSpaces),
+      eagerSpaceLists_(eagerSpaceLists),
+      sharedMemoryObservationThreshold_(sharedMemoryObservationThreshold),
       tlii_(getTargetLibraryInfo(benchmark_->module())),
+      costCache_(costCache),
       actionCount_(0) {
   // Initialize LLVM.
   initLlvm();
@@ -133,66 +145,346 @@ LlvmEnvironment::LlvmEnvironment(std::unique_ptr<Benchmark> benchmark, LlvmActio
   // Verify the module now to catch any problems early.
   CHECK(verifyModuleStatus(benchmark_->module()).ok());
 
-  // Compute initial eager observation and reward if required.
+  // Compute initial eager observations and rewards if required.
   // TODO(cummins): Defer these so that we can replace CHECKs with status codes.
-  if (eagerObservationSpace_.has_value()) {
-    CHECK(getObservation(eagerObservationSpace_.value(), &eagerObservation_).ok());
+  for (const auto space : eagerObservationSpaces_) {
+    CHECK(getObservation(space, &eagerObservations_.emplace_back()).ok());
   }
-  if (eagerRewardSpace_.has_value()) {
-    CHECK(getReward(eagerRewardSpace_.value(), &eagerReward_).ok());
+  CHECK(getRewards(eagerRewardSpaces_, &eagerRewards_).ok());
+
+  // Keep a copy of the initial state so that reset() does not need to
+  // re-create the benchmark.
+  initialModule_ = llvm::CloneModule(benchmark_->module());
+  initialEagerObservations_ = eagerObservations_;
+  initialEagerRewards_ = eagerRewards_;
+  initialPreviousCosts_ = previousCosts_;
+}
+
+LlvmEnvironment::LlvmEnvironment(const LlvmEnvironment& other, std::unique_ptr<Benchmark> benchmark)
+    : workingDirectory_(other.workingDirectory_),
+      sharedMemoryRoot_(other.sharedMemoryRoot_),
+      benchmark_(std::move(benchmark)),
+      actionSpace_(other.actionSpace_),
+      eagerObservationSpaces_(other.eagerObservationSpaces_),
+      eagerRewardSpaces_(other.eagerRewardSpaces_),
+      eagerSpaceLists_(other.eagerSpaceLists_),
+      sharedMemoryObservationThreshold_(other.sharedMemoryObservationThreshold_),
+      tlii_(getTargetLibraryInfo(benchmark_->module())),
+      costCache_(other.costCache_),
+      actionCount_(other.actionCount_),
+      eagerObservations_(other.eagerObservations_),
+      eagerRewards_(other.eagerRewards_),
+      previousCosts_(other.previousCosts_) {}
+
+LlvmEnvironment::~LlvmEnvironment() {
+  if (!sharedMemoryDirectory_.empty()) {
+    boost::system::error_code ec;
+    fs::remove_all(sharedMemoryDirectory_, ec);
+  }
+}
+
+Status LlvmEnvironment::fork(std::unique_ptr<LlvmEnvironment>* environment) const {
+  // The module is copied into a new LLVMContext so that the two environments
+  // can be used concurrently.
+  environment->reset(new LlvmEnvironment(*this, benchmark().clone(workingDirectory_)));
+  return Status::OK;
+}
+
+Status LlvmEnvironment::snapshot(std::string* state) const {
+  // The state is a length-prefixed JSON header, followed by the unoptimized
+  // bitcode of the benchmark if it is needed to compute baseline costs, and
+  // then the bitcode of the module.
+  //
+  // Only the baseline costs that are already known are included, so that a
+  // snapshot does not compile the benchmark at every baseline policy.
+  const BaselineCosts& knownCosts = benchmark().knownBaselineCosts();
+  json baselineCosts = json::array();
+  bool hasMissingBaselineCosts = false;
+  for (const auto cost : knownCosts) {
+    hasMissingBaselineCosts |= std::isnan(cost);
+    baselineCosts.push_back(std::isnan(cost) ? json(nullptr) : json(cost));
+  }
+  // Missing baseline costs are computed on demand by the restored benchmark,
+  // which requires the unoptimized bitcode.
+  std::shared_ptr<const Bitcode> unoptimizedBitcode;
+  if (hasMissingBaselineCosts) {
+    unoptimizedBitcode = benchmark().unoptimizedBitcode();
+  }
+  json previousCosts = json::array();
+  for (const auto& cost : previousCosts_) {
+    previousCosts.push_back(cost.has_value() ? json(*cost) : json(nullptr));
+  }
+  const json header = {
+      {"benchmark", benchmark().name()},
+      {"actionCount", actionCount_},
+      {"baselineCosts", baselineCosts},
+      {"hash", benchmark().hash()},
+      {"previousCosts", previousCosts},
+      {"unoptimizedBitcodeSize", unoptimizedBitcode ? unoptimizedBitcode->size() : 0},
+  };
+  const std::string headerString = header.dump();
+  const uint64_t headerSize = headerString.size();
+
+  Bitcode bitcode;
+  llvm::raw_svector_ostream ostream(bitcode);
+  llvm::WriteBitcodeToFile(benchmark().module(), ostream);
+
+  state->clear();
+  state->reserve(sizeof(headerSize) + headerString.size() +
+                 (unoptimizedBitcode ? unoptimizedBitcode->size() : 0) + bitcode.size());
+  state->append(reinterpret_cast<const char*>(&headerSize), sizeof(headerSize));
+  state->append(headerString);
+  if (unoptimizedBitcode) {
+    state->append(unoptimizedBitcode->data(), unoptimizedBitcode->size());
+  }
+  state->append(bitcode.data(), bitcode.size());
+  return Status::OK;
+}
+
+Status LlvmEnvironment::restore(const std::string& state,
+                                std::unique_ptr<LlvmEnvironment>* environment) const {
+  uint64_t headerSize;
+  if (state.size() < sizeof(headerSize)) {
+    return Status(StatusCode::INVALID_ARGUMENT, "Invalid session state");
+  }
+  std::memcpy(&headerSize, state.data(), sizeof(headerSize));
+  if (state.size() - sizeof(headerSize) < headerSize) {
+    return Status(StatusCode::INVALID_ARGUMENT, "Invalid session state");
+  }
+  const size_t unoptimizedBitcodeOffset = sizeof(headerSize) + headerSize;
+
+  std::string name;
+  int actionCount;
+  BaselineCosts baselineCosts;
+  PreviousCosts previousCosts;
+  BenchmarkHash hash;
+  size_t unoptimizedBitcodeSize;
+  try {
+    const json header =
+        json::parse(state.begin() + sizeof(headerSize), state.begin() + unoptimizedBitcodeOffset);
+    name = header.at("benchmark").get<std::string>();
+    actionCount = header.at("actionCount").get<int>();
+    const auto& baseline = header.at("baselineCosts");
+    const auto& previous = header.at("previousCosts");
+    hash = header.at("hash").get<BenchmarkHash>();
+    unoptimizedBitcodeSize = header.at("unoptimizedBitcodeSize").get<size_t>();
+    if (baseline.size() != baselineCosts.size() || previous.size() != previousCosts.size()) {
+      return Status(StatusCode::INVALID_ARGUMENT, "Invalid session state");
+    }
+    for (size_t i = 0; i < baselineCosts.size(); ++i) {
+      baselineCosts[i] = baseline[i].is_null() ? std::nan("") : baseline[i].get<double>();
+    }
+    for (size_t i = 0; i < previousCosts.size(); ++i) {
+      if (!previous[i].is_null()) {
+        previousCosts[i] = previous[i].get<double>();
+      }
+    }
+  } catch (const json::exception& e) {
+    return Status(StatusCode::INVALID_ARGUMENT, fmt::format("Invalid session state: {}", e.what()));
+  }
+  if (state.size() - unoptimizedBitcodeOffset < unoptimizedBitcodeSize) {
+    return Status(StatusCode::INVALID_ARGUMENT, "Invalid session state");
+  }
+  const size_t bitcodeOffset = unoptimizedBitcodeOffset + unoptimizedBitcodeSize;
+
+  std::shared_ptr<const Bitcode> unoptimizedBitcode;
+  if (unoptimizedBitcodeSize) {
+    unoptimizedBitcode = std::make_shared<const Bitcode>(
+        llvm::StringRef(state.data() + unoptimizedBitcodeOffset, unoptimizedBitcodeSize));
+  }
+  const Bitcode bitcode(
+      llvm::StringRef(state.data() + bitcodeOffset, state.size() - bitcodeOffset));
+  auto context = std::make_unique<llvm::LLVMContext>();
+  Status status;
+  auto module = makeModule(*context, bitcode, name, &status);
+  RETURN_IF_ERROR(status);
+  auto benchmark = std::make_unique<Benchmark>(name, std::move(context), std::move(module),
+                                               bitcode.size(), workingDirectory_, std::nullopt,
+                                               &baselineCosts, &hash, unoptimizedBitcode);
+
+  // Baseline costs that are not in the snapshot are read from the persistent
+  // cache. Any that remain can only be computed from the unoptimized bitcode.
+  const BaselineCosts& knownCosts = benchmark->knownBaselineCosts();
+  const auto isMissing = [](double cost) { return std::isnan(cost); };
+  if (!unoptimizedBitcode && std::any_of(knownCosts.begin(), knownCosts.end(), isMissing)) {
+    return Status(StatusCode::INVALID_ARGUMENT,
+                  "Invalid session state: missing baseline costs and unoptimized bitcode");
+  }
+
+  auto restored =
+      std::unique_ptr<LlvmEnvironment>(new LlvmEnvironment(*this, std::move(benchmark)));
+  restored->actionCount_ = actionCount;
+  restored->previousCosts_ = previousCosts;
+  // The eager observations of this environment do not describe the restored
+  // module.
+  restored->eagerObservations_.clear();
+  for (const auto space : restored->eagerObservationSpaces()) {
+    RETURN_IF_ERROR(restored->getObservation(space, &restored->eagerObservations_.emplace_back()));
+  }
+
+  *environment = std::move(restored);
+  return Status::OK;
+}
+
+Status LlvmEnvironment::reset() {
+  if (!initialModule_) {
+    return Status(StatusCode::FAILED_PRECONDITION, "Session cannot be reset in place");
+  }
+  benchmark().replaceModule(llvm::CloneModule(*initialModule_));
+  autophaseFunctionFeatures_.clear();
+  actionCount_ = 0;
+  previousCosts_ = initialPreviousCosts_;
+  eagerRewards_ = initialEagerRewards_;
+  eagerObservations_.clear();
+  for (size_t i = 0; i < eagerObservationSpaces().size(); ++i) {
+    // Observations in shared memory are deleted by the client once read, so
+    // they must be computed again.
+    if (initialEagerObservations_[i].has_shared_memory()) {
+      RETURN_IF_ERROR(
+          getObservation(eagerObservationSpaces()[i], &eagerObservations_.emplace_back()));
+    } else {
+      eagerObservations_.push_back(initialEagerObservations_[i]);
+    }
   }
+  return Status::OK;
 }
 
 Status LlvmEnvironment::takeAction(const ActionRequest& request, ActionReply* reply) {
   actionCount_ += request.action_size();
+  // A sequence of actions has no effect only if every action in the sequence
+  // has no effect.
+  reply->set_action_had_no_effect(true);
+  // When computing per-action rewards, the eager rewards are the sums of the
+  // rewards of each action.
+  std::vector<double> perActionRewardSums(eagerRewardSpaces().size(), 0);
   switch (actionSpace()) {
     case LlvmActionSpace::PASSES_ALL:
       for (int i = 0; i < request.action_size(); ++i) {
         LlvmAction action;
         RETURN_IF_ERROR(util::intToEnum(request.action(i), &action));
+        bool changed = false;
 // Use the generated HANDLE_PASS() switch statement to dispatch to runPass().
-#define HANDLE_PASS(pass) runPass(pass, reply);
+#define HANDLE_PASS(pass) changed = runPass(pass);
         HANDLE_ACTION(action, HANDLE_PASS)
 #undef HANDLE_PASS
+        if (changed) {
+          reply->set_action_had_no_effect(false);
+        }
+
+        if (request.per_action_feedback()) {
+          reply->add_per_action_had_no_effect(!changed);
+          if (eagerRewardSpaces().size()) {
+            std::vector<Reward> rewards(eagerRewardSpaces().size());
+            if (changed || !rewardsAreZeroIfUnchanged(eagerRewardSpaces())) {
+              RETURN_IF_ERROR(getRewards(eagerRewardSpaces(), &rewards));
+            }
+            // Per-action rewards are reported for the first eager reward space.
+            reply->add_per_action_reward(rewards[0].reward());
+            for (size_t j = 0; j < rewards.size(); ++j) {
+              perActionRewardSums[j] += rewards[j].reward();
+            }
+          }
+        }
       }
   }
 
   // Fail now if we have broken something.
   RETURN_IF_ERROR(verifyModuleStatus(benchmark().module()));
 
-  if (eagerObservationSpace().has_value()) {
-    eagerObservation_ = {};
-    RETURN_IF_ERROR(getObservation(eagerObservationSpace().value(), &eagerObservation_));
-    *reply->mutable_observation() = eagerObservation_;
+  // Most actions have no effect on most modules. When no action changed the
+  // module, the observations and costs from the previous step still describe
+  // it, so they are reused rather than computed again.
+  const bool moduleIsUnchanged = reply->action_had_no_effect();
+  RETURN_IF_ERROR(updateEagerObservations(moduleIsUnchanged));
+
+  if (request.per_action_feedback()) {
+    // The rewards have already been computed after each action.
+    for (size_t i = 0; i < eagerRewards_.size(); ++i) {
+      eagerRewards_[i].set_reward(perActionRewardSums[i]);
+    }
+  } else if (moduleIsUnchanged && rewardsAreZeroIfUnchanged(eagerRewardSpaces())) {
+    for (auto& reward : eagerRewards_) {
+      reward.set_reward(0);
+    }
+  } else {
+    RETURN_IF_ERROR(getRewards(eagerRewardSpaces(), &eagerRewards_));
   }
 
-  if (eagerRewardSpace().has_value()) {
-    eagerReward_ = {};
-    RETURN_IF_ERROR(getReward(eagerRewardSpace().value(), &eagerReward_));
-    *reply->mutable_reward() = eagerReward_;
+  if (eagerSpaceLists_) {
+    *reply->mutable_observation_list() = {eagerObservations_.begin(), eagerObservations_.end()};
+    *reply->mutable_reward_list() = {eagerRewards_.begin(), eagerRewards_.end()};
+  } else {
+    if (eagerObservations_.size()) {
+      *reply->mutable_observation() = eagerObservations_[0];
+    }
+    if (eagerRewards_.size()) {
+      *reply->mutable_reward() = eagerRewards_[0];
+    }
   }
 
   return Status::OK;
 }
 
-void LlvmEnvironment::runPass(llvm::Pass* pass, ActionReply* reply) {
+Status LlvmEnvironment::updateEagerObservations(bool moduleIsUnchanged) {
+  std::vector<Observation> observations;
+  observations.reserve(eagerObservationSpaces().size());
+  for (size_t i = 0; i < eagerObservationSpaces().size(); ++i) {
+    const auto space = eagerObservationSpaces()[i];
+    // Observations in shared memory are deleted by the client once read, so
+    // they must be computed again.
+    if (moduleIsUnchanged && isDeterministic(space) && i < eagerObservations_.size() &&
+        !eagerObservations_[i].has_shared_memory()) {
+      observations.push_back(std::move(eagerObservations_[i]));
+    } else {
+      RETURN_IF_ERROR(getObservation(space, &observations.emplace_back()));
+    }
+  }
+  eagerObservations_ = std::move(observations);
+  return Status::OK;
+}
+
+bool LlvmEnvironment::rewardsAreZeroIfUnchanged(const std::vector<LlvmRewardSpace>& spaces) const {
+  // A reward is the change in cost relative to the previous cost, so it is
+  // zero only if the previous cost was computed for the current module.
+  for (const auto space : spaces) {
+    const auto costIdx = static_cast<size_t>(getCostFunction(space));
+    if (!isDeterministic(space) || !previousCosts_[costIdx].has_value()) {
+      return false;
+    }
+  }
+  return true;
+}
+
+bool LlvmEnvironment::runPass(llvm::Pass* pass) {
   llvm::legacy::PassManager passManager;
   setupPassManager(&passManager, pass);
 
   const bool changed = passManager.run(benchmark().module());
-  reply->set_action_had_no_effect(!changed);
+  if (changed) {
+    // A module pass may change any function, or add and remove functions.
+    autophaseFunctionFeatures_.clear();
+  }
+  return changed;
 }
 
-void LlvmEnvironment::runPass(llvm::FunctionPass* pass, ActionReply* reply) {
+bool LlvmEnvironment::runPass(llvm::FunctionPass* pass) {
   llvm::legacy::FunctionPassManager passManager(&benchmark().module());
   setupPassManager(&passManager, pass);
 
-  bool changed = passManager.doInitialization();
+  // Initialization and finalization may change any part of the module.
+  bool moduleChanged = passManager.doInitialization();
+  bool changed = false;
   for (auto& function : benchmark().module()) {
-    changed |= (passManager.run(function) ? 1 : 0);
+    if (passManager.run(function)) {
+      changed = true;
+      autophaseFunctionFeatures_.erase(&function);
+    }
+  }
+  moduleChanged |= passManager.doFinalization();
+  if (moduleChanged) {
+    autophaseFunctionFeatures_.clear();
   }
-  changed |= (passManager.doFinalization() ? 1 : 0);
-  reply->set_action_had_no_effect(!changed);
+  return changed || moduleChanged;
 }
 
 Status LlvmEnvironment::getObservation(LlvmObservationSpace space, Observation* reply) {
@@ -220,7 +512,7 @@ Status LlvmEnvironment::getObservation(LlvmObservationSpace space, Observation*
       break;
     }
     case LlvmObservationSpace::AUTOPHASE: {
-      const auto features = autophase::InstCount::getFeatureVector(benchmark().module());
+      const auto features = getAutophaseFeatures();
       *reply->mutable_int64_list()->mutable_value() = {features.begin(), features.end()};
       break;
     }
@@ -268,97 +560,247 @@ Status LlvmEnvironment::getObservation(LlvmObservationSpace space, Observation*
       break;
     }
     case LlvmObservationSpace::IR_INSTRUCTION_COUNT: {
-      const auto cost =
-          getCost(LlvmCostFunction::IR_INSTRUCTION_COUNT, benchmark().module(), workingDirectory_);
+      const auto cost = getCurrentCost(LlvmCostFunction::IR_INSTRUCTION_COUNT);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::IR_INSTRUCTION_COUNT_O0: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O0,
-                                        LlvmCostFunction::IR_INSTRUCTION_COUNT);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::O0, LlvmCostFunction::IR_INSTRUCTION_COUNT);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::IR_INSTRUCTION_COUNT_O3: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O3,
-                                        LlvmCostFunction::IR_INSTRUCTION_COUNT);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::O3, LlvmCostFunction::IR_INSTRUCTION_COUNT);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::IR_INSTRUCTION_COUNT_OZ: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::Oz,
-                                        LlvmCostFunction::IR_INSTRUCTION_COUNT);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::Oz, LlvmCostFunction::IR_INSTRUCTION_COUNT);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::OBJECT_TEXT_SIZE_BYTES: {
-      const auto cost = getCost(LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, benchmark().module(),
-                                workingDirectory_);
+      const auto cost = getCurrentCost(LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::OBJECT_TEXT_SIZE_O0: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O0,
-                                        LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
+      const auto cost = benchmark().baselineCost(LlvmBaselinePolicy::O0,
+                                                 LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::OBJECT_TEXT_SIZE_O3: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O3,
-                                        LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
+      const auto cost = benchmark().baselineCost(LlvmBaselinePolicy::O3,
+                                                 LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::OBJECT_TEXT_SIZE_OZ: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::Oz,
-                                        LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
+      const auto cost = benchmark().baselineCost(LlvmBaselinePolicy::Oz,
+                                                 LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
+    case LlvmObservationSpace::MODULE_HASH: {
+      const BenchmarkHash hash = getModuleHash(benchmark().module());
+      reply->set_binary_value(reinterpret_cast<const char*>(hash.data()), sizeof(hash));
+      break;
+    }
 #ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
     case LlvmObservationSpace::TEXT_SIZE_BYTES: {
-      const auto cost =
-          getCost(LlvmCostFunction::TEXT_SIZE_BYTES, benchmark().module(), workingDirectory_);
+      const auto cost = getCurrentCost(LlvmCostFunction::TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::TEXT_SIZE_O0: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O0,
-                                        LlvmCostFunction::TEXT_SIZE_BYTES);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::O0, LlvmCostFunction::TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::TEXT_SIZE_O3: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O3,
-                                        LlvmCostFunction::TEXT_SIZE_BYTES);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::O3, LlvmCostFunction::TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
     case LlvmObservationSpace::TEXT_SIZE_OZ: {
-      const auto cost = getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::Oz,
-                                        LlvmCostFunction::TEXT_SIZE_BYTES);
+      const auto cost =
+          benchmark().baselineCost(LlvmBaselinePolicy::Oz, LlvmCostFunction::TEXT_SIZE_BYTES);
       reply->mutable_int64_list()->add_value(static_cast<int64_t>(cost));
       break;
     }
 #endif
   }
 
+  return moveObservationToSharedMemory(reply);
+}
+
+Status LlvmEnvironment::moveObservationToSharedMemory(Observation* observation) {
+  if (sharedMemoryObservationThreshold_ <= 0) {
+    return Status::OK;
+  }
+
+  const std::string* value;
+  switch (observation->value_case()) {
+    case Observation::kStringValue:
+      value = &observation->string_value();
+      break;
+    case Observation::kBinaryValue:
+      value = &observation->binary_value();
+      break;
+    default:
+      return Status::OK;
+  }
+  const int64_t size = static_cast<int64_t>(value->size());
+  if (size < sharedMemoryObservationThreshold_) {
+    return Status::OK;
+  }
+
+  // Create the session's shared memory directory on first use. The root
+  // directory is owned by the client, so it is removed when the service is
+  // closed, even if the service is killed before this environment is
+  // destroyed.
+  if (sharedMemoryDirectory_.empty()) {
+    const fs::path directory = fs::unique_path(sharedMemoryRoot_ / "session-%%%%%%%%%%%%%%%%");
+    boost::system::error_code ec;
+    fs::create_directories(directory, ec);
+    if (ec) {
+      return Status(
+          StatusCode::INTERNAL,
+          fmt::format("Failed to create shared memory directory: {}", directory.string()));
+    }
+    sharedMemoryDirectory_ = directory;
+  }
+
+  const std::string path =
+      fs::unique_path(sharedMemoryDirectory_ / "observation-%%%%%%%%%%%%%%%%").string();
+  std::ofstream out(path, std::ios::binary);
+  out.write(value->data(), size);
+  out.close();
+  if (!out) {
+    return Status(StatusCode::INTERNAL,
+                  fmt::format("Failed to write shared memory observation: {}", path));
+  }
+
+  // Setting the shared memory field clears the string or binary value.
+  SharedMemoryBuffer* buffer = observation->mutable_shared_memory();
+  buffer->set_path(path);
+  buffer->set_size(size);
+  return Status::OK;
+}
+
+Status LlvmEnvironment::getObservations(const std::vector<LlvmObservationSpace>& spaces,
+                                        GetObservationsReply* reply) {
+  // A map from observation space to the index of its first observation in the
+  // reply, used to reuse the observations of repeated spaces.
+  std::unordered_map<LlvmObservationSpace, int> computed;
+  for (const auto space : spaces) {
+    Observation* observation = reply->add_observation();
+    auto it = computed.find(space);
+    // Shared memory files are deleted by the client once read, so they cannot
+    // be shared between observations.
+    if (it != computed.end() && !reply->observation(it->second).has_shared_memory()) {
+      *observation = reply->observation(it->second);
+      continue;
+    }
+    RETURN_IF_ERROR(getObservation(space, observation));
+    computed[space] = reply->observation_size() - 1;
+  }
   return Status::OK;
 }
 
 Status LlvmEnvironment::getReward(LlvmRewardSpace space, Reward* reply) {
   const LlvmCostFunction cost = getCostFunction(space);
+
+  // Compute a new cost.
+  const double currentCost = getCurrentCost(cost);
+
+  reply->set_reward(computeReward(space, currentCost));
+
+  // Update the cached costs.
+  previousCosts_[static_cast<size_t>(cost)] = currentCost;
+
+  return Status::OK;
+}
+
+Status LlvmEnvironment::getRewards(const std::vector<LlvmRewardSpace>& spaces,
+                                   std::vector<Reward>* rewards) {
+  // Compute each cost function once. All rewards are computed before the
+  // cached costs are updated so that reward spaces which share a cost function
+  // are computed relative to the same previous cost.
+  std::unordered_map<LlvmCostFunction, double> currentCosts;
+  rewards->clear();
+  for (const auto space : spaces) {
+    const LlvmCostFunction cost = getCostFunction(space);
+    auto it = currentCosts.find(cost);
+    if (it == currentCosts.end()) {
+      it = currentCosts.emplace(cost, getCurrentCost(cost)).first;
+    }
+    rewards->emplace_back().set_reward(computeReward(space, it->second));
+  }
+
+  // Update the cached costs.
+  for (const auto& [cost, currentCost] : currentCosts) {
+    previousCosts_[static_cast<size_t>(cost)] = currentCost;
+  }
+
+  return Status::OK;
+}
+
+std::vector<int64_t> LlvmEnvironment::getAutophaseFeatures() {
+  // The features of a module are the sum of the features of its functions, so
+  // only the functions that have changed since the last call are visited.
+  std::vector<int64_t> features(autophase::kAutophaseFeatureDimensionality, 0);
+  std::unordered_map<const llvm::Function*, std::vector<int64_t>> functionFeatures;
+  functionFeatures.reserve(benchmark().module().size());
+  for (auto& function : benchmark().module()) {
+    auto it = autophaseFunctionFeatures_.find(&function);
+    auto& value = functionFeatures[&function];
+    if (it == autophaseFunctionFeatures_.end()) {
+      value = autophase::InstCount::getFeatureVector(function);
+    } else {
+      value = std::move(it->second);
+    }
+    for (size_t i = 0; i < features.size(); ++i) {
+      features[i] += value[i];
+    }
+  }
+  // Functions that are no longer in the module are dropped.
+  autophaseFunctionFeatures_ = std::move(functionFeatures);
+  return features;
+}
+
+double LlvmEnvironment::getCurrentCost(LlvmCostFunction cost) {
+  // Counting instructions is cheaper than hashing the module.
+  if (!costCache_ || cost == LlvmCostFunction::IR_INSTRUCTION_COUNT) {
+    return llvm_service::getCost(cost, benchmark().module(), workingDirectory_);
+  }
+  const BenchmarkHash hash = getModuleHash(benchmark().module());
+  double value;
+  if (!costCache_->lookup(hash, cost, &value)) {
+    value = llvm_service::getCost(cost, benchmark().module(), workingDirectory_);
+    costCache_->insert(hash, cost, value);
+  }
+  return value;
+}
+
+double LlvmEnvironment::computeReward(LlvmRewardSpace space, double currentCost) const {
+  const LlvmCostFunction cost = getCostFunction(space);
   const auto costIdx = static_cast<size_t>(cost);
   const std::optional<LlvmBaselinePolicy> baselinePolicy = getBaselinePolicy(space);
 
-  // Fetch the cached costs.
-  const double unoptimizedCost =
-      getBaselineCost(benchmark().baselineCosts(), LlvmBaselinePolicy::O0, cost);
+  // Fetch the cached costs. Baseline costs are only computed when they are
+  // needed.
+  const auto unoptimizedCost = [&]() {
+    return benchmark().baselineCost(LlvmBaselinePolicy::O0, cost);
+  };
   const double previousCost =
-      previousCosts_[costIdx].has_value() ? *previousCosts_[costIdx] : unoptimizedCost;
-
-  // Compute a new cost.
-  const double currentCost = getCost(cost, benchmark().module(), workingDirectory_);
+      previousCosts_[costIdx].has_value() ? *previousCosts_[costIdx] : unoptimizedCost();
 
   // Reward is reduction in cost.
   double reward = previousCost - currentCost;
@@ -370,24 +812,19 @@ Status LlvmEnvironment::getReward(LlvmRewardSpace space, Reward* reply) {
   //   - For a baseline policy of -O3 or -Oz, reward is scaled by the reduction
   //     in cost achieved by that baseline.
   if (baselinePolicy.has_value()) {
-    const double baselineCost = getBaselineCost(benchmark().baselineCosts(), *baselinePolicy, cost);
+    const double baselineCost = benchmark().baselineCost(*baselinePolicy, cost);
     if (baselinePolicy == LlvmBaselinePolicy::O0) {
       if (baselineCost) {
         reward /= baselineCost;
       }
     } else {
-      const double baselineImprovement = unoptimizedCost - baselineCost;
+      const double baselineImprovement = unoptimizedCost() - baselineCost;
       if (baselineImprovement) {
         reward /= baselineImprovement;
       }
     }
   }
-  reply->set_reward(reward);
-
-  // Update the cached costs.
-  previousCosts_[costIdx] = currentCost;
-
-  return Status::OK;
+  return reward;
 }
 
 }  // namespace compiler_gym::llvm_service
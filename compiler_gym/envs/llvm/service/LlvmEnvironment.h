@@ -9,10 +9,13 @@
 #include <magic_enum.hpp>
 #include <memory>
 #include <optional>
+#include <unordered_map>
+#include <vector>
 
 #include "compiler_gym/envs/llvm/service/ActionSpace.h"
 #include "compiler_gym/envs/llvm/service/Benchmark.h"
 #include "compiler_gym/envs/llvm/service/Cost.h"
+#include "compiler_gym/envs/llvm/service/CostCache.h"
 #include "compiler_gym/envs/llvm/service/ObservationSpaces.h"
 #include "compiler_gym/envs/llvm/service/RewardSpaces.h"
 #include "compiler_gym/service/proto/compiler_gym_service.grpc.pb.h"
@@ -34,13 +37,46 @@ namespace compiler_gym::llvm_service {
 class LlvmEnvironment {
  public:
   // Construct an environment by taking ownership of a benchmark. Eager
-  // observations and reward can be disabled by passing std::nullopt.
-  // Throws std::invalid_argument if the benchmark's LLVM module fails
-  // verification.
+  // observations and rewards are computed for each of the given spaces after
+  // every action, and can be disabled by passing empty lists. If
+  // eagerSpaceLists is set, the eager observations and rewards are returned
+  // using the ActionReply.observation_list and ActionReply.reward_list fields,
+  // else the first eager observation and reward are returned using the
+  // ActionReply.observation and ActionReply.reward fields. If
+  // sharedMemoryObservationThreshold is greater than zero, string and binary
+  // observations of at least that many bytes are written to files in a
+  // per-session subdirectory of sharedMemoryRoot.
+  // If a cost cache is given, costs are looked up in and added to the cache,
+  // which must outlive the environment. Throws std::invalid_argument if the
+  // benchmark's LLVM module fails verification.
   LlvmEnvironment(std::unique_ptr<Benchmark> benchmark, LlvmActionSpace actionSpace,
-                  std::optional<LlvmObservationSpace> eagerObservationSpace,
-                  std::optional<LlvmRewardSpace> eagerRewardSpace,
-                  const boost::filesystem::path& workingDirectory);
+                  const std::vector<LlvmObservationSpace>& eagerObservationSpaces,
+                  const std::vector<LlvmRewardSpace>& eagerRewardSpaces, bool eagerSpaceLists,
+                  int64_t sharedMemoryObservationThreshold,
+                  const boost::filesystem::path& workingDirectory,
+                  const boost::filesystem::path& sharedMemoryRoot, CostCache* costCache = nullptr);
+
+  // Removes any shared memory files that have not been deleted by the client.
+  ~LlvmEnvironment();
+
+  // Make an independent copy of this environment, including its current LLVM
+  // module, action count, and previous costs.
+  [[nodiscard]] grpc::Status fork(std::unique_ptr<LlvmEnvironment>* environment) const;
+
+  // Serialize the current LLVM module and reward state of this environment.
+  [[nodiscard]] grpc::Status snapshot(std::string* state) const;
+
+  // Make a copy of this environment with the LLVM module and reward state from
+  // a snapshot. The action space and eager spaces of this environment are
+  // retained. Returns INVALID_ARGUMENT if the state cannot be parsed.
+  [[nodiscard]] grpc::Status restore(const std::string& state,
+                                     std::unique_ptr<LlvmEnvironment>* environment) const;
+
+  // Restore the LLVM module and reward state of this environment to the start
+  // of the episode, without re-creating the benchmark. Returns
+  // FAILED_PRECONDITION if the environment has no copy of its initial module,
+  // which is the case for environments created by fork() or restore().
+  [[nodiscard]] grpc::Status reset();
 
   // Run the requested action(s), then compute eager observation and reward, if
   // required.
@@ -49,33 +85,73 @@ class LlvmEnvironment {
   // Compute the requested observation.
   [[nodiscard]] grpc::Status getObservation(LlvmObservationSpace space, Observation* reply);
 
+  // Compute observations from several observation spaces. The observations
+  // are returned in the order that they are requested. Observation spaces
+  // that are requested more than once are computed only once.
+  [[nodiscard]] grpc::Status getObservations(const std::vector<LlvmObservationSpace>& spaces,
+                                             GetObservationsReply* reply);
+
   // Calculate a reward.
   [[nodiscard]] grpc::Status getReward(LlvmRewardSpace space, Reward* reply);
 
+  // Calculate rewards for several reward spaces. Each cost function is
+  // computed once, and reward spaces which share a cost function are computed
+  // relative to the same previous cost.
+  [[nodiscard]] grpc::Status getRewards(const std::vector<LlvmRewardSpace>& spaces,
+                                        std::vector<Reward>* rewards);
+
   inline const Benchmark& benchmark() const { return *benchmark_; }
 
   int actionCount() const { return actionCount_; }
 
  protected:
-  // Run the given pass, possibly modifying the underlying LLVM module.
-  void runPass(llvm::Pass* pass, ActionReply* reply);
-  void runPass(llvm::FunctionPass* pass, ActionReply* reply);
+  // Construct a copy of another environment, which uses the given copy of its
+  // benchmark.
+  LlvmEnvironment(const LlvmEnvironment& other, std::unique_ptr<Benchmark> benchmark);
+
+  // Run the given pass, possibly modifying the underlying LLVM module. Returns
+  // whether the module was changed.
+  bool runPass(llvm::Pass* pass);
+  bool runPass(llvm::FunctionPass* pass);
 
   inline Benchmark& benchmark() { return *benchmark_; }
 
   inline const LlvmActionSpace actionSpace() const { return actionSpace_; }
 
-  inline const std::optional<LlvmObservationSpace>& eagerObservationSpace() const {
-    return eagerObservationSpace_;
+  inline const std::vector<LlvmObservationSpace>& eagerObservationSpaces() const {
+    return eagerObservationSpaces_;
   }
 
-  inline const std::optional<LlvmRewardSpace>& eagerRewardSpace() const {
-    return eagerRewardSpace_;
+  inline const std::vector<LlvmRewardSpace>& eagerRewardSpaces() const {
+    return eagerRewardSpaces_;
   }
 
   inline const llvm::TargetLibraryInfoImpl& tlii() const { return tlii_; }
 
  private:
+  // If the observation is a string or byte array that is larger than the
+  // shared memory threshold, move it to a file in shared memory and replace the
+  // value with a handle to it.
+  [[nodiscard]] grpc::Status moveObservationToSharedMemory(Observation* observation);
+
+  // Compute the Autophase features of the current module, reusing the cached
+  // features of functions that have not changed.
+  std::vector<int64_t> getAutophaseFeatures();
+
+  // Compute a cost of the current module, using the cost cache if possible.
+  double getCurrentCost(LlvmCostFunction cost);
+
+  // Compute the reward for the given cost, relative to the previous cost.
+  double computeReward(LlvmRewardSpace space, double currentCost) const;
+
+  // Return whether the rewards of the given spaces are known to be zero if the
+  // module has not changed since the costs were last computed.
+  bool rewardsAreZeroIfUnchanged(const std::vector<LlvmRewardSpace>& spaces) const;
+
+  // Compute the eager observations. If the module is unchanged, deterministic
+  // observations are reused rather than computed again.
+  [[nodiscard]] grpc::Status updateEagerObservations(bool moduleIsUnchanged);
+
   // Setup pass manager with depdendent passes and the specified pass.
   template <typename PassManager, typename Pass>
   inline void setupPassManager(PassManager* passManager, Pass* pass) {
@@ -86,20 +162,38 @@ class LlvmEnvironment {
   }
 
   const boost::filesystem::path workingDirectory_;
+  const boost::filesystem::path sharedMemoryRoot_;
   const std::unique_ptr<Benchmark> benchmark_;
   const LlvmActionSpace actionSpace_;
-  const std::optional<LlvmObservationSpace> eagerObservationSpace_;
-  const std::optional<LlvmRewardSpace> eagerRewardSpace_;
+  const std::vector<LlvmObservationSpace> eagerObservationSpaces_;
+  const std::vector<LlvmRewardSpace> eagerRewardSpaces_;
+  const bool eagerSpaceLists_;
+  const int64_t sharedMemoryObservationThreshold_;
   const llvm::TargetLibraryInfoImpl tlii_;
   const programl::ProgramGraphOptions programlOptions_;
+  CostCache* const costCache_;
 
   int actionCount_;
   // When eagerly computing observations or rewards, store the values so that
   // we can reuse them when actions have no effect.
-  Observation eagerObservation_;
-  Reward eagerReward_;
+  std::vector<Observation> eagerObservations_;
+  std::vector<Reward> eagerRewards_;
   // The previous costs. Used to compute incremental returns.
   PreviousCosts previousCosts_;
+  // The Autophase features of each function of the module, computed on
+  // demand. A function pass invalidates the functions that it changes, and any
+  // other change to the module invalidates all functions.
+  std::unordered_map<const llvm::Function*, std::vector<int64_t>> autophaseFunctionFeatures_;
+  // A per-session subdirectory of sharedMemoryRoot_ for shared memory
+  // observations, created on first use.
+  boost::filesystem::path sharedMemoryDirectory_;
+  // The state at the start of the episode, used by reset(). The initial module
+  // is a copy of the stripped and verified module of the benchmark, in the same
+  // LLVMContext.
+  std::unique_ptr<llvm::Module> initialModule_;
+  std::vector<Observation> initialEagerObservations_;
+  std::vector<Reward> initialEagerRewards_;
+  PreviousCosts initialPreviousCosts_;
 };
 
 }  // namespace compiler_gym::llvm_service
@@ -4,6 +4,7 @@
 // LICENSE file in the root directory of this source tree.
 #include "compiler_gym/envs/llvm/service/LlvmService.h"
 
+#include <gflags/gflags.h>
 #include <glog/logging.h>
 
 #include <optional>
@@ -15,10 +16,18 @@
 #include "compiler_gym/service/proto/compiler_gym_service.pb.h"
 #include "compiler_gym/util/EnumUtil.h"
 #include "compiler_gym/util/GrpcStatusMacros.h"
+#include "compiler_gym/util/RunService.h"
 #include "compiler_gym/util/Version.h"
 #include "llvm/ADT/Triple.h"
 #include "llvm/Config/llvm-config.h"
 
+DEFINE_uint64(cost_cache_size, 100000,
+              "The maximum number of module costs that are cached by the service. "
+              "Set to zero to disable the cache.");
+DEFINE_bool(cost_database, false,
+            "Store the costs of modules in a fixed-size database in the CompilerGym cache "
+            "directory that is shared by every service on the machine.");
+
 namespace compiler_gym::llvm_service {
 
 using grpc::ServerContext;
@@ -27,7 +36,15 @@ using grpc::StatusCode;
 namespace fs = boost::filesystem;
 
 LlvmService::LlvmService(const fs::path& workingDirectory)
-    : workingDirectory_(workingDirectory), benchmarkFactory_(workingDirectory), nextSessionId_(0) {}
+    : workingDirectory_(workingDirectory),
+      sharedMemoryDirectory_(FLAGS_shared_memory_dir.empty() ? workingDirectory
+                                                             : fs::path(FLAGS_shared_memory_dir)),
+      benchmarkFactory_(workingDirectory),
+      nextSessionId_(0),
+      costDatabase_(FLAGS_cost_database
+                        ? std::make_unique<CostDatabase>(CostDatabase::defaultPath())
+                        : nullptr),
+      costCache_(FLAGS_cost_cache_size, costDatabase_.get()) {}
 
 Status LlvmService::GetVersion(ServerContext* /* unused */, const GetVersionRequest* /* unused */,
                                GetVersionReply* reply) {
@@ -54,6 +71,8 @@ Status LlvmService::GetSpaces(ServerContext* /* unused */, const GetSpacesReques
 
 Status LlvmService::StartEpisode(ServerContext* /* unused */, const StartEpisodeRequest* request,
                                  StartEpisodeReply* reply) {
+  // The benchmark factory has its own locks, so that benchmarks are loaded
+  // and cloned without blocking the other sessions of the service.
   std::unique_ptr<Benchmark> benchmark;
   if (request->benchmark().size()) {
     RETURN_IF_ERROR(benchmarkFactory_.getBenchmark(request->benchmark(), &benchmark));
@@ -67,28 +86,42 @@ Status LlvmService::StartEpisode(ServerContext* /* unused */, const StartEpisode
   LlvmActionSpace actionSpace;
   RETURN_IF_ERROR(util::intToEnum(request->action_space(), &actionSpace));
 
-  // Set the eager observation space.
-  std::optional<LlvmObservationSpace> eagerObservation = std::nullopt;
-  if (request->use_eager_observation_space()) {
-    const int32_t index = request->eager_observation_space();
-    LlvmObservationSpace space;
-    RETURN_IF_ERROR(util::intToEnum<LlvmObservationSpace>(index, &space));
-    eagerObservation = space;
+  // Set the eager observation and reward spaces. If the list fields are used,
+  // the single space fields are ignored.
+  const bool eagerSpaceLists =
+      request->eager_observation_space_list_size() || request->eager_reward_space_list_size();
+
+  std::vector<LlvmObservationSpace> eagerObservations;
+  if (eagerSpaceLists) {
+    for (int i = 0; i < request->eager_observation_space_list_size(); ++i) {
+      RETURN_IF_ERROR(util::intToEnum<LlvmObservationSpace>(
+          request->eager_observation_space_list(i), &eagerObservations.emplace_back()));
+    }
+  } else if (request->use_eager_observation_space()) {
+    RETURN_IF_ERROR(util::intToEnum<LlvmObservationSpace>(request->eager_observation_space(),
+                                                          &eagerObservations.emplace_back()));
   }
 
-  // Set the eager reward space.
-  std::optional<LlvmRewardSpace> eagerReward = std::nullopt;
-  if (request->use_eager_reward_space()) {
-    const int32_t index = request->eager_reward_space();
-    LlvmRewardSpace space;
-    RETURN_IF_ERROR(util::intToEnum<LlvmRewardSpace>(index, &space));
-    eagerReward = space;
+  std::vector<LlvmRewardSpace> eagerRewards;
+  if (eagerSpaceLists) {
+    for (int i = 0; i < request->eager_reward_space_list_size(); ++i) {
+      RETURN_IF_ERROR(util::intToEnum<LlvmRewardSpace>(request->eager_reward_space_list(i),
+                                                       &eagerRewards.emplace_back()));
+    }
+  } else if (request->use_eager_reward_space()) {
+    RETURN_IF_ERROR(util::intToEnum<LlvmRewardSpace>(request->eager_reward_space(),
+                                                     &eagerRewards.emplace_back()));
   }
 
   // Construct the environment.
+  auto environment = std::make_unique<LlvmEnvironment>(
+      std::move(benchmark), actionSpace, eagerObservations, eagerRewards, eagerSpaceLists,
+      request->shared_memory_observation_threshold(), workingDirectory_, sharedMemoryDirectory_,
+      &costCache_);
+
+  std::lock_guard<std::mutex> lock(mutex_);
   reply->set_session_id(nextSessionId_);
-  sessions_[nextSessionId_] = std::make_unique<LlvmEnvironment>(
-      std::move(benchmark), actionSpace, eagerObservation, eagerReward, workingDirectory_);
+  sessions_[nextSessionId_] = std::move(environment);
   ++nextSessionId_;
   return Status::OK;
 }
@@ -97,30 +130,102 @@ Status LlvmService::EndEpisode(grpc::ServerContext* /* unused */, const EndEpiso
                                EndEpisodeReply* /* unused */) {
   // Note that unlike the other methods, no error is thrown if the requested
   // episode does not exist.
-  if (sessions_.find(request->session_id()) != sessions_.end()) {
-    const LlvmEnvironment* environment;
-    RETURN_IF_ERROR(session(request->session_id(), &environment));
-    VLOG(1) << "Step " << environment->actionCount() << " EndEpisode("
-            << environment->benchmark().name() << ")";
+  std::unique_ptr<LlvmEnvironment> environment;
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    auto it = sessions_.find(request->session_id());
+    if (it == sessions_.end()) {
+      return Status::OK;
+    }
+    environment = std::move(it->second);
+    sessions_.erase(it);
+  }
+
+  // The environment is destroyed outside of the lock.
+  VLOG(1) << "Step " << environment->actionCount() << " EndEpisode("
+          << environment->benchmark().name() << ")";
+  return Status::OK;
+}
+
+Status LlvmService::ForkSession(ServerContext* /* unused */, const ForkSessionRequest* request,
+                                ForkSessionReply* reply) {
+  const LlvmEnvironment* environment;
+  RETURN_IF_ERROR(session(request->session_id(), &environment));
+  VLOG(1) << "Step " << environment->actionCount() << " ForkSession("
+          << environment->benchmark().name() << ")";
+
+  std::unique_ptr<LlvmEnvironment> fork;
+  RETURN_IF_ERROR(environment->fork(&fork));
+
+  std::lock_guard<std::mutex> lock(mutex_);
+  reply->set_session_id(nextSessionId_);
+  sessions_[nextSessionId_] = std::move(fork);
+  ++nextSessionId_;
+  return Status::OK;
+}
+
+Status LlvmService::SnapshotSession(ServerContext* /* unused */,
+                                    const SnapshotSessionRequest* request,
+                                    SnapshotSessionReply* reply) {
+  const LlvmEnvironment* environment;
+  RETURN_IF_ERROR(session(request->session_id(), &environment));
+  VLOG(1) << "Step " << environment->actionCount() << " SnapshotSession()";
 
-    sessions_.erase(request->session_id());
+  return environment->snapshot(reply->mutable_state());
+}
+
+Status LlvmService::RestoreSession(ServerContext* /* unused */,
+                                   const RestoreSessionRequest* request,
+                                   RestoreSessionReply* /* unused */) {
+  const LlvmEnvironment* environment;
+  RETURN_IF_ERROR(session(request->session_id(), &environment));
+  VLOG(1) << "Step " << environment->actionCount() << " RestoreSession()";
+
+  std::unique_ptr<LlvmEnvironment> restored;
+  RETURN_IF_ERROR(environment->restore(request->state(), &restored));
+
+  // The replaced environment is destroyed outside of the lock.
+  std::unique_ptr<LlvmEnvironment> replaced = std::move(restored);
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    // The session may have been ended while it was being restored.
+    auto it = sessions_.find(request->session_id());
+    if (it == sessions_.end()) {
+      return Status(StatusCode::NOT_FOUND,
+                    fmt::format("Session not found: {}", request->session_id()));
+    }
+    it->second.swap(replaced);
   }
   return Status::OK;
 }
 
-Status LlvmService::TakeAction(ServerContext* /* unused */, const ActionRequest* request,
-                               ActionReply* reply) {
+Status LlvmService::ResetSession(ServerContext* /* unused */, const ResetSessionRequest* request,
+                                 ResetSessionReply* /* unused */) {
   LlvmEnvironment* environment;
   RETURN_IF_ERROR(session(request->session_id(), &environment));
+  VLOG(1) << "Step " << environment->actionCount() << " ResetSession("
+          << environment->benchmark().name() << ")";
 
-  // Nothing was requested.
-  if (!request->action_size()) {
-    VLOG(2) << "Step " << environment->actionCount() << " TakeAction()";
-    return Status::OK;
-  }
+  return environment->reset();
+}
 
-  VLOG(2) << "Step " << environment->actionCount() << " TakeAction(" << request->action(0) << ")";
-  return environment->takeAction(*request, reply);
+Status LlvmService::TakeAction(ServerContext* /* unused */, const ActionRequest* request,
+                               ActionReply* reply) {
+  return takeAction(*request, reply);
+}
+
+Status LlvmService::StepStream(ServerContext* /* unused */,
+                               grpc::ServerReaderWriter<ActionReply, ActionRequest>* stream) {
+  VLOG(2) << "StepStream()";
+  ActionRequest request;
+  while (stream->Read(&request)) {
+    ActionReply reply;
+    RETURN_IF_ERROR(takeAction(request, &reply));
+    if (!stream->Write(reply)) {
+      break;
+    }
+  }
+  return Status::OK;
 }
 
 Status LlvmService::GetObservation(ServerContext* /* unused */, const ObservationRequest* request,
@@ -136,6 +241,22 @@ Status LlvmService::GetObservation(ServerContext* /* unused */, const Observatio
   return environment->getObservation(space, reply);
 }
 
+Status LlvmService::GetObservations(ServerContext* /* unused */,
+                                    const GetObservationsRequest* request,
+                                    GetObservationsReply* reply) {
+  LlvmEnvironment* environment;
+  RETURN_IF_ERROR(session(request->session_id(), &environment));
+
+  VLOG(2) << "Step " << environment->actionCount() << " GetObservations(<"
+          << request->observation_space_size() << " spaces>)";
+
+  std::vector<LlvmObservationSpace> spaces(request->observation_space_size());
+  for (int i = 0; i < request->observation_space_size(); ++i) {
+    RETURN_IF_ERROR(util::intToEnum(request->observation_space(i), &spaces[i]));
+  }
+  return environment->getObservations(spaces, reply);
+}
+
 Status LlvmService::GetReward(ServerContext* /* unused */, const RewardRequest* request,
                               Reward* reply) {
   LlvmEnvironment* environment;
@@ -187,6 +308,25 @@ Status LlvmService::addBenchmark(const ::compiler_gym::Benchmark& request) {
   return Status::OK;
 }
 
+Status LlvmService::takeAction(const ActionRequest& request, ActionReply* reply) {
+  LlvmEnvironment* environment;
+  RETURN_IF_ERROR(session(request.session_id(), &environment));
+
+  // Nothing was requested.
+  if (!request.action_size()) {
+    VLOG(2) << "Step " << environment->actionCount() << " TakeAction()";
+    return Status::OK;
+  }
+
+  if (request.action_size() == 1) {
+    VLOG(2) << "Step " << environment->actionCount() << " TakeAction(" << request.action(0) << ")";
+  } else {
+    VLOG(2) << "Step " << environment->actionCount() << " TakeAction(<" << request.action_size()
+            << " actions>)";
+  }
+  return environment->takeAction(request, reply);
+}
+
 Status LlvmService::GetBenchmarks(ServerContext* /* unused */,
                                   const GetBenchmarksRequest* /* unused */,
                                   GetBenchmarksReply* reply) {
@@ -198,6 +338,7 @@ Status LlvmService::GetBenchmarks(ServerContext* /* unused */,
 }
 
 Status LlvmService::session(uint64_t id, LlvmEnvironment** environment) {
+  std::lock_guard<std::mutex> lock(mutex_);
   auto it = sessions_.find(id);
   if (it == sessions_.end()) {
     return Status(StatusCode::INVALID_ARGUMENT, fmt::format("Session not found: {}", id));
@@ -208,6 +349,7 @@ Status LlvmService::session(uint64_t id, LlvmEnvironment** environment) {
 }
 
 Status LlvmService::session(uint64_t id, const LlvmEnvironment** environment) const {
+  std::lock_guard<std::mutex> lock(mutex_);
   auto it = sessions_.find(id);
   if (it == sessions_.end()) {
     return Status(StatusCode::INVALID_ARGUMENT, fmt::format("Session not found: {}", id));
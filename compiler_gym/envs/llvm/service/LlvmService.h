@@ -7,10 +7,13 @@
 #include <grpcpp/grpcpp.h>
 
 #include <memory>
+#include <mutex>
 
 #include "boost/filesystem.hpp"
 #include "compiler_gym/envs/llvm/service/Benchmark.h"
 #include "compiler_gym/envs/llvm/service/BenchmarkFactory.h"
+#include "compiler_gym/envs/llvm/service/CostCache.h"
+#include "compiler_gym/envs/llvm/service/CostDatabase.h"
 #include "compiler_gym/envs/llvm/service/LlvmEnvironment.h"
 #include "compiler_gym/service/proto/compiler_gym_service.grpc.pb.h"
 #include "compiler_gym/service/proto/compiler_gym_service.pb.h"
@@ -18,6 +21,15 @@
 namespace compiler_gym::llvm_service {
 
 // RPC service for LLVM.
+//
+// A single service may be shared by many clients, each with their own
+// sessions. RPCs are handled concurrently, so access to the sessions map is
+// guarded by a mutex, and the benchmark factory has its own locks. The
+// sessions themselves need no locking, as each session is used by only one
+// client and owns its own LLVMContext. The costs of modules are cached across
+// sessions, in a cache with at most --cost_cache_size entries. If
+// --cost_database is set, costs are also stored in a database that is shared
+// by every service on the machine.
 class LlvmService final : public CompilerGymService::Service {
  public:
   explicit LlvmService(const boost::filesystem::path& workingDirectory);
@@ -35,12 +47,31 @@ class LlvmService final : public CompilerGymService::Service {
   grpc::Status EndEpisode(grpc::ServerContext* context, const EndEpisodeRequest* request,
                           EndEpisodeReply* reply) final override;
 
+  grpc::Status ForkSession(grpc::ServerContext* context, const ForkSessionRequest* request,
+                           ForkSessionReply* reply) final override;
+
+  grpc::Status SnapshotSession(grpc::ServerContext* context, const SnapshotSessionRequest* request,
+                               SnapshotSessionReply* reply) final override;
+
+  grpc::Status RestoreSession(grpc::ServerContext* context, const RestoreSessionRequest* request,
+                              RestoreSessionReply* reply) final override;
+
+  grpc::Status ResetSession(grpc::ServerContext* context, const ResetSessionRequest* request,
+                            ResetSessionReply* reply) final override;
+
   grpc::Status TakeAction(grpc::ServerContext* context, const ActionRequest* request,
                           ActionReply* reply) final override;
 
+  grpc::Status StepStream(
+      grpc::ServerContext* context,
+      grpc::ServerReaderWriter<ActionReply, ActionRequest>* stream) final override;
+
   grpc::Status GetObservation(grpc::ServerContext* context, const ObservationRequest* request,
                               Observation* reply) final override;
 
+  grpc::Status GetObservations(grpc::ServerContext* context, const GetObservationsRequest* request,
+                               GetObservationsReply* reply) final override;
+
   grpc::Status GetReward(grpc::ServerContext* context, const RewardRequest* request,
                          Reward* reply) final override;
 
@@ -56,11 +87,20 @@ class LlvmService final : public CompilerGymService::Service {
 
   grpc::Status addBenchmark(const ::compiler_gym::Benchmark& request);
 
+  grpc::Status takeAction(const ActionRequest& request, ActionReply* reply);
+
  private:
   const boost::filesystem::path workingDirectory_;
+  // The directory for shared memory observations, set by --shared_memory_dir.
+  const boost::filesystem::path sharedMemoryDirectory_;
+  // Guards sessions_ and nextSessionId_.
+  mutable std::mutex mutex_;
   std::unordered_map<uint64_t, std::unique_ptr<LlvmEnvironment>> sessions_;
   BenchmarkFactory benchmarkFactory_;
   uint64_t nextSessionId_;
+  // Shared by all sessions. The cache and the database have their own locks.
+  std::unique_ptr<CostDatabase> costDatabase_;
+  CostCache costCache_;
 };
 
 }  // namespace compiler_gym::llvm_service
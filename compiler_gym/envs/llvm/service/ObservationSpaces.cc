@@ -21,6 +21,8 @@ namespace compiler_gym::llvm_service {
 static constexpr size_t kAutophaseFeatureDim = 56;
 // 4096 is the maximum path length for most filesystems.
 static constexpr size_t kMaximumPathLength = 4096;
+// The size of a 160-bit SHA1 module hash, in bytes.
+static constexpr size_t kModuleHashSize = 20;
 
 std::vector<ObservationSpace> getLlvmObservationSpaceList() {
   std::vector<ObservationSpace> spaces;
@@ -112,6 +114,14 @@ std::vector<ObservationSpace> getLlvmObservationSpaceList() {
         space.mutable_default_value()->mutable_int64_list()->add_value(0);
         break;
       }
+      case LlvmObservationSpace::MODULE_HASH: {
+        space.mutable_binary_size_range()->mutable_min()->set_value(kModuleHashSize);
+        space.mutable_binary_size_range()->mutable_max()->set_value(kModuleHashSize);
+        space.set_deterministic(true);
+        space.set_platform_dependent(false);
+        *space.mutable_default_value()->mutable_binary_value() = std::string(kModuleHashSize, '\0');
+        break;
+      }
 #ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
       case LlvmObservationSpace::TEXT_SIZE_BYTES:
       case LlvmObservationSpace::TEXT_SIZE_O0:
@@ -130,4 +140,9 @@ std::vector<ObservationSpace> getLlvmObservationSpaceList() {
   return spaces;
 }
 
+bool isDeterministic(LlvmObservationSpace space) {
+  static const std::vector<ObservationSpace> spaces = getLlvmObservationSpaceList();
+  return spaces[magic_enum::enum_index(space).value()].deterministic();
+}
+
 }  // namespace compiler_gym::llvm_service
@@ -50,6 +50,10 @@ enum class LlvmObservationSpace {
   OBJECT_TEXT_SIZE_O0,
   OBJECT_TEXT_SIZE_O3,
   OBJECT_TEXT_SIZE_OZ,
+  // A 160-bit SHA1 digest of the current module, as 20 bytes. Identical
+  // modules have identical digests, making this a cheap way to detect
+  // duplicate states.
+  MODULE_HASH,
 #ifdef COMPILER_GYM_EXPERIMENTAL_TEXT_SIZE_COST
   // The size of the .text section of the compiled binary. Platform dependent.
   TEXT_SIZE_BYTES,
@@ -62,4 +66,8 @@ enum class LlvmObservationSpace {
 // Return the list of available observation spaces.
 std::vector<ObservationSpace> getLlvmObservationSpaceList();
 
+// Return whether an observation space is deterministic, i.e. whether computing
+// it twice for the same module produces the same value.
+bool isDeterministic(LlvmObservationSpace space);
+
 }  // namespace compiler_gym::llvm_service
@@ -95,4 +95,9 @@ std::vector<RewardSpace> getLlvmRewardSpaceList() {
   return spaces;
 }
 
+bool isDeterministic(LlvmRewardSpace space) {
+  static const std::vector<RewardSpace> spaces = getLlvmRewardSpaceList();
+  return spaces[magic_enum::enum_index(space).value()].deterministic();
+}
+
 }  // namespace compiler_gym::llvm_service
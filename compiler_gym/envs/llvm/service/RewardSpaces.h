@@ -40,4 +40,8 @@ enum class LlvmRewardSpace {
 // Get the list of available reward spaces.
 std::vector<RewardSpace> getLlvmRewardSpaceList();
 
+// Return whether a reward space is deterministic, i.e. whether computing it
+// twice for the same module produces the same value.
+bool isDeterministic(LlvmRewardSpace space);
+
 }  // namespace compiler_gym::llvm_service
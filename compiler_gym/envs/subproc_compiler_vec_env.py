@@ -0,0 +1,343 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""This module defines a vectorized interface to CompilerGym environments
+that run in worker processes."""
+import multiprocessing
+import sys
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from compiler_gym.envs.compiler_env import CompilerEnv
+from compiler_gym.envs.compiler_vec_env import _per_env_benchmarks, _stack, vec_step_t
+from compiler_gym.service.proto import Benchmark
+
+if sys.version_info >= (3, 8, 0):
+    from multiprocessing.shared_memory import SharedMemory
+
+# The alignment of the observation buffer of each environment, in bytes.
+_BUFFER_ALIGNMENT = 64
+
+
+class _SharedArray(NamedTuple):
+    """A placeholder for an observation that was written to the observation
+    buffer of an environment."""
+
+    shape: Tuple[int, ...]
+    dtype: str
+    # The offset of the array in the buffer of the environment.
+    offset: int
+
+
+class _ObservationList(list):
+    """The observations of a list of eager observation spaces."""
+
+
+def _picklable(observation: Any) -> Any:
+    """Copy shared memory views of an observation into bytes."""
+    if isinstance(observation, memoryview):
+        return bytes(observation)
+    if isinstance(observation, list):
+        return [_picklable(o) for o in observation]
+    return observation
+
+
+def _worker(
+    make_env: Callable[[], CompilerEnv],
+    conn: Connection,
+    shm_name: str,
+    offset: int,
+    buffer_size: int,
+    auto_reset: bool,
+) -> None:
+    """The main loop of a worker process, which runs a single environment."""
+    # The parent process owns the shared memory and is responsible for
+    # unlinking it.
+    shm = SharedMemory(name=shm_name)
+
+    def write(observation: Any, position: int) -> Tuple[Any, int]:
+        """Write an observation to the buffer at the given position, if
+        possible, and return the next free position."""
+        end = position + getattr(observation, "nbytes", 0)
+        if isinstance(observation, np.ndarray) and end <= buffer_size:
+            buffer = np.ndarray(
+                observation.shape,
+                observation.dtype,
+                buffer=shm.buf,
+                offset=offset + position,
+            )
+            buffer[...] = observation
+            # Keep the next array aligned.
+            end = -(-end // _BUFFER_ALIGNMENT) * _BUFFER_ALIGNMENT
+            return _SharedArray(observation.shape, observation.dtype.str, position), end
+        # Other observations are sent through the pipe.
+        return _picklable(observation), position
+
+    def write_observation(observation: Any) -> Any:
+        if env._eager_observation_is_list:
+            observations, position = _ObservationList(), 0
+            for o in observation:
+                o, position = write(o, position)
+                observations.append(o)
+            return observations
+        return write(observation, 0)[0]
+
+    env = None
+    try:
+        env = make_env()
+        while True:
+            command, arg = conn.recv()
+            try:
+                if command == "reset":
+                    result = write_observation(env.reset(benchmark=arg))
+                elif command == "step":
+                    observation, reward, done, info = env.step(arg)
+                    if done and auto_reset:
+                        info["terminal_observation"] = _picklable(observation)
+                        observation = env.reset()
+                    result = (write_observation(observation), reward, done, info)
+                elif command == "getattr":
+                    result = getattr(env, arg)
+                elif command == "close":
+                    conn.send((True, None))
+                    return
+                else:
+                    raise ValueError(f"Unknown command: {command}")
+            except Exception as e:
+                try:
+                    conn.send((False, e))
+                except Exception:
+                    # The error could not be pickled.
+                    conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+            else:
+                conn.send((True, result))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        if env:
+            env.close()
+        shm.close()
+
+
+class SubprocCompilerVecEnv(object):
+    """A vector of :class:`CompilerEnv <compiler_gym.envs.CompilerEnv>`
+    environments that each run in a worker process.
+
+    This is the multiprocess counterpart to :class:`CompilerVecEnv
+    <compiler_gym.envs.CompilerVecEnv>`, for observation spaces that are
+    computed in Python, such as :code:`Inst2vec`, where threads are limited by
+    the global interpreter lock:
+
+    >>> make_env = functools.partial(
+    ...     gym.make, "llvm-v0", observation_space="Inst2vecEmbeddingIndices"
+    ... )
+    >>> vec_env = SubprocCompilerVecEnv(make_env, num_envs=16)
+    >>> observations = vec_env.reset(benchmark="cBench-v0/crc32")
+    >>> observations, rewards, dones, infos = vec_env.step([0] * 16)
+
+    Array observations are not sent through a pipe. Instead, each worker writes
+    its observation into a preallocated :code:`multiprocessing.shared_memory`
+    buffer, and the returned observations are views of these buffers. If the
+    observations of every environment have the same shape, they are returned
+    as a single stacked array without copying, else a list of arrays is
+    returned. Observations which are not arrays, and arrays which are larger
+    than :code:`observation_buffer_size`, are pickled through a pipe.
+
+    .. warning::
+        The returned arrays are overwritten by the next call to :meth:`step()`
+        or :meth:`reset()`. Copy them to keep them.
+
+    Requires Python 3.8 or later.
+
+    :ivar auto_reset: Whether environments are reset at the end of an episode.
+    :vartype auto_reset: bool
+    """
+
+    def __init__(
+        self,
+        make_env: Callable[[], CompilerEnv],
+        num_envs: int,
+        auto_reset: bool = True,
+        observation_buffer_size: int = 64 * 1024 * 1024,
+        context: str = "spawn",
+    ):
+        """Constructor.
+
+        :param make_env: A callable that creates an environment. It is called
+            in each worker process, so it must be picklable.
+        :param num_envs: The number of environments.
+        :param auto_reset: Whether to reset environments that reach the end of
+            an episode.
+        :param observation_buffer_size: The size of the shared memory buffer
+            for the observation of each environment, in bytes.
+        :param context: The :code:`multiprocessing` start method used to create
+            workers. The default, :code:`spawn`, does not inherit the gRPC
+            state of the parent process.
+        :raises ValueError: If :code:`num_envs` is not positive.
+        :raises NotImplementedError: If the Python version is older than 3.8.
+        """
+        if sys.version_info < (3, 8, 0):
+            raise NotImplementedError("SubprocCompilerVecEnv requires Python >= 3.8")
+        if num_envs < 1:
+            raise ValueError(f"num_envs must be positive, not: {num_envs}")
+        self.auto_reset = auto_reset
+        self._conns: List[Connection] = []
+        self._processes = []
+        # Round the buffer of each environment up to a multiple of the
+        # alignment, so that every buffer is aligned for any dtype.
+        self._buffer_size = -(-observation_buffer_size // _BUFFER_ALIGNMENT) * (
+            _BUFFER_ALIGNMENT
+        )
+        self._shm = SharedMemory(create=True, size=self._buffer_size * num_envs)
+        self._closed = False
+
+        ctx = multiprocessing.get_context(context)
+        for i in range(num_envs):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    make_env,
+                    child_conn,
+                    self._shm.name,
+                    i * self._buffer_size,
+                    observation_buffer_size,
+                    auto_reset,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    @property
+    def num_envs(self) -> int:
+        """The number of environments."""
+        return len(self._conns)
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def _call(self, command: str, args: List[Any]) -> List[Any]:
+        """Send a command to every worker, then wait for the results."""
+        for conn, arg in zip(self._conns, args):
+            conn.send((command, arg))
+        results = [conn.recv() for conn in self._conns]
+        for ok, result in results:
+            if not ok:
+                raise result
+        return [result for _, result in results]
+
+    def _read(self, index: int, observation: Any) -> Any:
+        """Return a view of an observation in the buffer of an environment."""
+        if isinstance(observation, _SharedArray):
+            return np.ndarray(
+                observation.shape,
+                np.dtype(observation.dtype),
+                buffer=self._shm.buf,
+                offset=index * self._buffer_size + observation.offset,
+            )
+        return observation
+
+    def _stack_shared(self, observations: List[Any]) -> Any:
+        """Stack the observations of every environment. Observations in the
+        buffers are stacked without copying if they have the same shape and
+        position."""
+        if all(isinstance(o, _SharedArray) for o in observations) and (
+            len(set(observations)) == 1
+        ):
+            first = self._read(0, observations[0])
+            # Each row of the stacked array is in the buffer of one environment.
+            return np.ndarray(
+                (self.num_envs,) + first.shape,
+                first.dtype,
+                buffer=self._shm.buf,
+                offset=observations[0].offset,
+                strides=(self._buffer_size,) + first.strides,
+            )
+        return _stack([self._read(i, o) for i, o in enumerate(observations)])
+
+    def _stack_observations(self, observations: List[Any]) -> Any:
+        if all(isinstance(o, _ObservationList) for o in observations):
+            # Stack each of a list of eager observation spaces separately.
+            return [self._stack_shared(list(values)) for values in zip(*observations)]
+        return self._stack_shared(observations)
+
+    def reset(self, benchmark: Optional[Union[str, Benchmark, List]] = None) -> Any:
+        """Reset all of the environments.
+
+        :param benchmark: The benchmark to use for every environment, or a list
+            of benchmarks, one for each environment. If not provided, each
+            environment uses its own benchmark.
+        :return: The batched initial observations.
+        :raises ValueError: If a list of benchmarks of the wrong length is
+            provided.
+        """
+        return self._stack_observations(
+            self._call("reset", _per_env_benchmarks(benchmark, self.num_envs))
+        )
+
+    def step(self, actions: Iterable[int]) -> vec_step_t:
+        """Take one step in every environment.
+
+        :param actions: An action for each environment.
+        :return: A tuple of the batched observations, an array of rewards, an
+            array of done flags, and a list of info dicts, one for each
+            environment.
+        :raises ValueError: If the number of actions does not match the number
+            of environments.
+        """
+        actions = list(actions)
+        if len(actions) != self.num_envs:
+            raise ValueError(
+                f"Expected {self.num_envs} actions, received {len(actions)}"
+            )
+        observations, rewards, dones, infos = zip(*self._call("step", actions))
+        return (
+            self._stack_observations(list(observations)),
+            np.array(rewards, dtype=np.float64),
+            np.array(dones, dtype=bool),
+            list(infos),
+        )
+
+    def close(self) -> None:
+        """Close all of the environments and stop the worker processes."""
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+                conn.recv()
+            except (BrokenPipeError, EOFError):
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join()
+        try:
+            self._shm.close()
+        except BufferError:
+            # Observations that were returned to the caller still reference the
+            # buffers. The memory is released once they are deleted.
+            pass
+        self._shm.unlink()
+
+    def __del__(self):
+        # Don't let the workers be orphaned if the user forgot to close(). The
+        # conditional guard is because this may be called in case of early
+        # error.
+        if hasattr(self, "_closed"):
+            self.close()
+
+    def __enter__(self) -> "SubprocCompilerVecEnv":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"SubprocCompilerVecEnv(num_envs={self.num_envs})"
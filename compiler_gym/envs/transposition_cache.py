@@ -0,0 +1,276 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""This module defines a client-side cache of the results of steps."""
+import sys
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+# The estimated size of a cache entry, excluding the size of its values.
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def _sizeof(value: Any) -> int:
+    """Estimate the size of a value in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def _copy(value: Any) -> Any:
+    """Return a deep copy of a step result. Shared memory views are copied into
+    bytes, since the shared memory is released by the caller."""
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy(v) for v in value)
+    return deepcopy(value)
+
+
+class TranspositionCacheNode(object):
+    """A node in the trie of a :class:`TranspositionCache`.
+
+    The path from the root of the trie to a node is the sequence of actions
+    that leads to it from the start of an episode.
+    """
+
+    __slots__ = [
+        "key",
+        "parent",
+        "action",
+        "depth",
+        "children",
+        "step_result",
+        "episode_reward",
+        "state",
+        "size",
+        "detached",
+    ]
+
+    def __init__(
+        self,
+        parent: Optional["TranspositionCacheNode"] = None,
+        action: Optional[int] = None,
+        key: Optional[Hashable] = None,
+    ):
+        # The key of a root node.
+        self.key = key
+        self.parent = parent
+        self.action = action
+        # The number of actions from the root to this node.
+        self.depth = parent.depth + 1 if parent else 0
+        self.children: Dict[int, "TranspositionCacheNode"] = {}
+        # The (observation, reward, done, info) tuple returned by the step that
+        # led to this node, and the cumulative reward of the episode after it.
+        self.step_result = None
+        self.episode_reward = None
+        # The serialized state of the service session after the step, if any.
+        self.state: Optional[bytes] = None
+        self.size = 0
+        # A detached node has been evicted from the cache.
+        self.detached = False
+
+
+class TranspositionCache(object):
+    """A client-side cache that maps (benchmark, action prefix) pairs to the
+    result of the final step of the prefix.
+
+    Search algorithms often re-execute the same sequences of actions across
+    many episodes. When a cache is passed to an environment, :func:`step()
+    <compiler_gym.envs.CompilerEnv.step>` serves the steps of any previously
+    seen prefix from the cache without contacting the compiler service. When
+    the episode leaves the cached prefix, the service is brought up to date by
+    executing the cached actions in a single request before the new action is
+    executed:
+
+    >>> cache = TranspositionCache(max_bytes=256 * 1024 * 1024)
+    >>> env = gym.make("llvm-autophase-ic-v0", transposition_cache=cache)
+    >>> env.reset(benchmark="cBench-v0/crc32")
+    >>> env.step(0)  # Executed by the service.
+    >>> env.reset(benchmark="cBench-v0/crc32")
+    >>> env.step(0)  # Served from the cache.
+    >>> env.step(1)  # Executes [0, 1] in the service.
+
+    Optionally, the cache also stores a snapshot of the service state every
+    :code:`snapshot_interval` steps, so that returning to a deep cached prefix
+    replays at most :code:`snapshot_interval - 1` actions.
+
+    Entries are evicted in least-recently-used order when the estimated size of
+    the cache exceeds :code:`max_bytes`. Cached entries are keyed by the
+    benchmark, the action space, and the eager observation and reward spaces
+    of the environment. The cache assumes that these spaces are deterministic.
+    A cache may be shared between environments.
+
+    :ivar max_bytes: The maximum estimated size of the cache.
+    :vartype max_bytes: int
+    :ivar snapshot_interval: Store a snapshot of the service state every this
+        many steps. If zero, no snapshots are stored.
+    :vartype snapshot_interval: int
+    :ivar hit_count: The number of steps that were served from the cache.
+    :vartype hit_count: int
+    :ivar miss_count: The number of steps that were not in the cache.
+    :vartype miss_count: int
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, snapshot_interval: int = 0):
+        """Constructor.
+
+        :param max_bytes: The maximum estimated size of the cache.
+        :param snapshot_interval: Store a snapshot of the service state every
+            this many steps. If zero, no snapshots are stored.
+        :raises ValueError: If either argument is negative.
+        """
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must be non-negative, not: {max_bytes}")
+        if snapshot_interval < 0:
+            raise ValueError(
+                f"snapshot_interval must be non-negative, not: {snapshot_interval}"
+            )
+        self.max_bytes = max_bytes
+        self.snapshot_interval = snapshot_interval
+        self.hit_count = 0
+        self.miss_count = 0
+
+        self._roots: Dict[Hashable, TranspositionCacheNode] = {}
+        # The non-root nodes of the trie in least-recently-used order. A node is
+        # always used more recently than its descendants, so the least recently
+        # used node is always a leaf.
+        self._lru: "OrderedDict[TranspositionCacheNode, None]" = OrderedDict()
+        self._size = 0
+
+    @property
+    def size_bytes(self) -> int:
+        """The estimated size of the cache in bytes."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def root(self, key: Hashable) -> TranspositionCacheNode:
+        """Return the root node for the start of an episode.
+
+        :param key: The benchmark and spaces of the episode.
+        :return: A node.
+        """
+        if key not in self._roots:
+            self._roots[key] = TranspositionCacheNode(key=key)
+        return self._roots[key]
+
+    def lookup(
+        self, node: TranspositionCacheNode, action: int
+    ) -> Optional[TranspositionCacheNode]:
+        """Look up the result of taking an action from a node.
+
+        :param node: The current node.
+        :param action: The action to take.
+        :return: The child node for the action, or :code:`None` if it is not
+            cached.
+        """
+        child = node.children.get(action)
+        if child is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        self._touch(child)
+        return child
+
+    def insert(
+        self,
+        node: TranspositionCacheNode,
+        action: int,
+        step_result,
+        episode_reward,
+        state: Optional[bytes] = None,
+    ) -> Optional[TranspositionCacheNode]:
+        """Record the result of taking an action from a node.
+
+        The values are copied, so that later changes to them by the caller do
+        not affect the cache.
+
+        :param node: The current node.
+        :param action: The action that was taken.
+        :param step_result: The (observation, reward, done, info) tuple returned
+            by the step.
+        :param episode_reward: The cumulative reward of the episode after the
+            step.
+        :param state: An optional snapshot of the service state after the step.
+        :return: The new child node, or :code:`None` if the node has been
+            evicted from the cache.
+        """
+        if node.detached:
+            return None
+        child = TranspositionCacheNode(parent=node, action=action)
+        child.step_result = _copy(step_result)
+        child.episode_reward = _copy(episode_reward)
+        child.state = state
+        child.size = (
+            _ENTRY_OVERHEAD_BYTES
+            + _sizeof(child.step_result)
+            + _sizeof(child.episode_reward)
+            + (len(state) if state else 0)
+        )
+        if action in node.children:
+            self._remove(node.children[action])
+        node.children[action] = child
+        self._size += child.size
+        self._touch(child)
+        self._evict()
+        return None if child.detached else child
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        for root in list(self._roots.values()):
+            for child in list(root.children.values()):
+                self._remove(child)
+            root.detached = True
+        self._roots = {}
+
+    def _touch(self, node: TranspositionCacheNode) -> None:
+        # Mark a node and all of its ancestors as most recently used, ancestors
+        # last.
+        while node.parent is not None:
+            self._lru[node] = None
+            self._lru.move_to_end(node)
+            node = node.parent
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._lru:
+            node = next(iter(self._lru))
+            self._remove(node)
+
+    def _remove(self, node: TranspositionCacheNode) -> None:
+        """Remove a node and its descendants from the cache."""
+        parent = node.parent
+        if parent.children.get(node.action) is node:
+            del parent.children[node.action]
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack += node.children.values()
+            node.children = {}
+            self._lru.pop(node, None)
+            self._size -= node.size
+            node.size = 0
+            node.step_result = None
+            node.episode_reward = None
+            node.state = None
+            node.detached = True
+        # Drop the root of an episode once it has no more entries.
+        if parent.parent is None and not parent.children:
+            if self._roots.get(parent.key) is parent:
+                del self._roots[parent.key]
+            parent.detached = True
+
+    def __repr__(self):
+        return (
+            f"TranspositionCache(entries={len(self)}, size_bytes={self.size_bytes}, "
+            f"max_bytes={self.max_bytes})"
+        )
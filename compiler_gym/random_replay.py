@@ -22,18 +22,24 @@ def replay_actions(env: CompilerEnv, action_names: List[str], outdir: Path):
     if isinstance(env, LlvmEnv):
         env.write_bitcode(outdir / "unoptimized.bc")
 
+    # Replay the entire action sequence in a single request to the service.
+    actions = [env.action_space.names.index(action) for action in action_names]
+    _, _, done, info = env.multistep(actions, per_action_feedback=True)
+    assert not done
+    runtime = time() - start_time
+
     with open(str(logs_path), "w") as f:
         ep_reward = 0
-        for i, action in enumerate(action_names, start=1):
-            _, reward, done, _ = env.step(env.action_space.names.index(action))
-            assert not done
+        for i, (action, reward) in enumerate(
+            zip(action_names, info["per_action_reward"]), start=1
+        ):
             ep_reward += reward
             print(
                 f"Step [{i:03d} / {len(action_names):03d}]: reward={reward:.4f}   \t"
                 f"episode={ep_reward:.4f}   \taction={action}"
             )
             progress = logs.ProgressLogEntry(
-                runtime_seconds=time() - start_time,
+                runtime_seconds=runtime,
                 total_episode_count=1,
                 total_step_count=i,
                 num_passes=i,
@@ -39,7 +39,6 @@ class RandomAgentWorker(Thread):
         self.total_step_count = 0
         self.best_returns = -float("inf")
         self.best_actions: List[int] = []
-        self.best_commandline: List[int] = []
         self.best_found_at_time = time()
 
         self.alive = True  # Set this to False to signal the thread to stop.
@@ -68,27 +67,31 @@ class RandomAgentWorker(Thread):
         :param env: An environment.
         :return: True if the episode ended gracefully, else False.
         """
-        observation = env.reset()
+        env.reset()
         actions: List[int] = []
         patience = self._patience
         total_returns = 0
         while patience >= 0:
-            patience -= 1
-            self.total_step_count += 1
             # === Your agent here! ===
-            action_index = env.action_space.sample()
+            # Sample enough actions to exhaust the remaining patience, and run
+            # them in a single request to the service.
+            batch = [env.action_space.sample() for _ in range(patience + 1)]
             # === End of agent. ===
-            actions.append(action_index)
-            observation, reward, done, _ = env.step(action_index)
+            _, _, done, info = env.multistep(batch, per_action_feedback=True)
             if done:
                 return False
-            total_returns += reward
-            if total_returns > self.best_returns:
-                patience = self._patience
-                self.best_returns = total_returns
-                self.best_actions = actions.copy()
-                self.best_commandline = env.commandline()
-                self.best_found_at_time = time()
+            rewards = info["per_action_reward"]
+            assert len(rewards) == len(batch), "Per-action rewards not returned"
+            for action_index, reward in zip(batch, rewards):
+                patience -= 1
+                self.total_step_count += 1
+                actions.append(action_index)
+                total_returns += reward
+                if total_returns > self.best_returns:
+                    patience = self._patience
+                    self.best_returns = total_returns
+                    self.best_actions = actions.copy()
+                    self.best_found_at_time = time()
 
         return True
 
@@ -152,7 +155,6 @@ def random_search(
         worker.start()
 
     best_actions = []
-    best_commandline = ""
     started = time()
     last_best_returns = -float("inf")
 
@@ -195,7 +197,6 @@ def random_search(
                 best_worker = max(workers, key=lambda worker: worker.best_returns)
                 best_returns = best_worker.best_returns
                 best_actions = best_worker.best_actions
-                best_commandline = best_worker.best_commandline
                 runtime = time() - started
                 print(
                     "\r\033[1A"
@@ -233,8 +234,6 @@ def random_search(
     with open(str(best_actions_path), "w") as f:
         f.write("\n".join(best_action_names))
         f.write("\n")
-    with open(str(best_commandline_path), "w") as f:
-        print(best_commandline, file=f)
     print(f"\n", flush=True)
 
     print("Ending worker threads ... ", end="", flush=True)
@@ -248,6 +247,10 @@ def random_search(
     env = make_env()
     env.reset()
     replay_actions(env, best_action_names, outdir)
+    # The workers batch their actions, so the commandline of the best solution
+    # is recovered from the replayed environment.
+    with open(str(best_commandline_path), "w") as f:
+        print(env.commandline(), file=f)
     env.close()
 
     return best_returns, best_actions
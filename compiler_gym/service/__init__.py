@@ -1,4 +1,5 @@
 from compiler_gym.service.connection import (
+    AsyncConnection,
     CompilerGymServiceConnection,
     ConnectionOpts,
     ServiceError,
@@ -7,14 +8,17 @@ from compiler_gym.service.connection import (
     ServiceTransportError,
 )
 from compiler_gym.service.proto2py import observation_t, scalar_range2tuple
+from compiler_gym.service.service_pool import ServicePool
 
 __all__ = [
     "ServiceError",
     "ServiceInitError",
     "ServiceIsClosed",
     "ServiceTransportError",
+    "AsyncConnection",
     "CompilerGymServiceConnection",
     "ConnectionOpts",
+    "ServicePool",
     "scalar_range2tuple",
     "observation_t",
 ]
@@ -11,6 +11,8 @@ import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Lock, Thread
 from time import sleep, time
 from typing import List, NamedTuple, Optional, TypeVar, Union
 
@@ -60,6 +62,28 @@ class ConnectionOpts(NamedTuple):
     rpc_init_max_seconds: float = 3
     """The maximum number of seconds to wait for an RPC connection to establish."""
 
+    shared_memory_observation_threshold: int = 0
+    """If greater than zero, string and binary observations of at least this
+    many bytes are passed from the service through shared memory rather than
+    copied over RPC. Binary observations are then returned as read-only
+    :code:`memoryview` objects. This is used only for services that are
+    managed by this process, since the client and service must run on the same
+    machine.
+    """
+
+    local_service_use_unix_socket: bool = True
+    """Whether to connect to a local service using a unix domain socket in the
+    service working directory, rather than a TCP port. The TCP port is used as
+    a fallback if the unix socket cannot be used.
+    """
+
+    use_step_stream: bool = False
+    """Whether environments send their actions over a single bidirectional
+    streaming RPC for each episode, rather than making a separate RPC call for
+    every step. This reduces the overhead of each step. Environments fall back
+    to separate calls if the service does not support streaming.
+    """
+
 
 class ServiceError(Exception):
     """Error raised from the service."""
@@ -139,31 +163,194 @@ class Connection(object):
             # We raise "from None" to discard the gRPC stack trace, with the
             # remaining stack trace correctly pointing to the CompilerGym
             # calling code.
-            if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
-                raise ValueError(e.details()) from None
-            elif e.code() == grpc.StatusCode.UNIMPLEMENTED:
-                raise NotImplementedError(e.details()) from None
-            elif e.code() == grpc.StatusCode.NOT_FOUND:
-                raise FileNotFoundError(e.details()) from None
-            elif e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
-                raise OSError(e.details()) from None
-            elif e.code() == grpc.StatusCode.FAILED_PRECONDITION:
-                raise TypeError(str(e.details())) from None
-            elif e.code() == grpc.StatusCode.UNAVAILABLE:
-                raise ServiceTransportError(f"{self.url} {e.details()}") from None
-            elif (
-                e.code() == grpc.StatusCode.INTERNAL
-                and e.details() == "Exception serializing request!"
-            ):
-                raise TypeError(
-                    f"{e.details()} Request type: {type(request).__name__}"
-                ) from None
-            elif e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
-                raise TimeoutError(f"{e.details()} ({timeout:.1f} seconds)") from None
-            else:
-                raise ServiceError(
-                    f"RPC call returned status code {e.code()} and error `{e.details()}`"
-                ) from None
+            raise _translate_rpc_error(e, self.url, request, timeout) from None
+
+
+def _translate_rpc_error(
+    e: grpc.RpcError, url: str, request: Request, timeout: float
+) -> Exception:
+    """Translate the status code of a failed RPC into a python exception."""
+    if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+        return ValueError(e.details())
+    elif e.code() == grpc.StatusCode.UNIMPLEMENTED:
+        return NotImplementedError(e.details())
+    elif e.code() == grpc.StatusCode.NOT_FOUND:
+        return FileNotFoundError(e.details())
+    elif e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+        return OSError(e.details())
+    elif e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+        return TypeError(str(e.details()))
+    elif e.code() == grpc.StatusCode.UNAVAILABLE:
+        return ServiceTransportError(f"{url} {e.details()}")
+    elif (
+        e.code() == grpc.StatusCode.INTERNAL
+        and e.details() == "Exception serializing request!"
+    ):
+        return TypeError(f"{e.details()} Request type: {type(request).__name__}")
+    elif e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+        return TimeoutError(f"{e.details()} ({timeout:.1f} seconds)")
+    else:
+        return ServiceError(
+            f"RPC call returned status code {e.code()} and error `{e.details()}`"
+        )
+
+
+class RequestStream(object):
+    """A bidirectional streaming RPC that is used one request at a time.
+
+    Requests are written to the stream by calling this object, which blocks
+    until the reply to that request is received. The stream is kept open
+    between calls, so there is no per-call setup cost:
+
+    >>> stream = RequestStream(connection.stub.StepStream, connection.url)
+    >>> reply = stream(ActionRequest(session_id=session_id, action=[0]))
+    >>> stream.close()
+
+    The service must write exactly one reply for every request, in order. Each
+    call waits at most :code:`timeout` seconds for its reply, after which the
+    stream is cancelled.
+    """
+
+    def __init__(self, stub_method: StubMethod, url: str, timeout: float = 300):
+        """Constructor.
+
+        :param stub_method: A bidirectional streaming RPC method attribute on
+            :code:`CompilerGymServiceStub`.
+        :param url: The URL of the service, used for error messages.
+        :param timeout: The maximum number of seconds to wait for the reply to
+            a request.
+        """
+        self.url = url
+        self.timeout = timeout
+        self._requests = Queue()
+        # The request iterator blocks on the queue, and ends when None is put
+        # in the queue.
+        self._call = stub_method(iter(self._requests.get, None))
+        # Replies are read by a background thread, so that each call can wait
+        # for its reply with a deadline. Each item is a (reply, error) tuple.
+        # A (None, None) tuple marks the end of the stream.
+        self._replies = Queue()
+        self._reader = Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+        self.closed = False
+
+    def _read_replies(self) -> None:
+        try:
+            for reply in self._call:
+                self._replies.put((reply, None))
+            self._replies.put((None, None))
+        except grpc.RpcError as e:
+            self._replies.put((None, e))
+
+    def __call__(self, request: Request) -> Reply:
+        """Write a request to the stream and return the reply.
+
+        :param request: A request message.
+        :return: A reply message.
+        :raises ServiceIsClosed: If the stream is closed.
+        :raises TimeoutError: If the reply is not received within
+            :code:`timeout` seconds. The stream is closed.
+        """
+        if self.closed:
+            raise ServiceIsClosed(f"Stream to {self.url} is closed")
+        self._requests.put(request)
+        try:
+            reply, error = self._replies.get(timeout=self.timeout)
+        except Empty:
+            self.close()
+            raise TimeoutError(
+                f"{self.url} Stream reply not received ({self.timeout:.1f} seconds)"
+            ) from None
+        if error is not None:
+            self.close()
+            raise _translate_rpc_error(error, self.url, request, self.timeout) from None
+        if reply is None:
+            self.close()
+            raise ServiceTransportError(f"{self.url} Stream ended")
+        return reply
+
+    def close(self):
+        """End the stream."""
+        if self.closed:
+            return
+        self.closed = True
+        self._requests.put(None)
+        self._call.cancel()
+
+
+class AsyncConnection(object):
+    """An asyncio connection to a running compiler gym service.
+
+    This is the asynchronous counterpart to :class:`Connection`, built on a
+    :code:`grpc.aio` channel. It does not manage the lifetime of the service,
+    so the service must be started by other means, e.g. by a
+    :class:`CompilerGymServiceConnection`. RPC failures are translated to the
+    same exception types as :meth:`CompilerGymServiceConnection.__call__()
+    <compiler_gym.service.CompilerGymServiceConnection.__call__>`.
+
+    The channel is created lazily on the first call so that it is bound to
+    the running event loop.
+    """
+
+    def __init__(self, url: str, rpc_call_max_seconds: float = 300):
+        """Constructor.
+
+        :param url: The URL of the RPC service.
+        :param rpc_call_max_seconds: The default maximum number of seconds to
+            await a reply.
+        """
+        self.url = url
+        self.rpc_call_max_seconds = rpc_call_max_seconds
+        self.channel = None
+        self._stub = None
+        self.closed = False
+
+    @property
+    def stub(self) -> CompilerGymServiceStub:
+        """A CompilerGymServiceStub that can be used as the first argument to
+        :py:meth:`__call__()` to specify an RPC method to call.
+
+        :raises ServiceIsClosed: If the connection has been closed.
+        """
+        if self.closed:
+            raise ServiceIsClosed(f"Connection to {self.url} is closed")
+        if self._stub is None:
+            self.channel = grpc.aio.insecure_channel(
+                self.url, options=GRPC_CHANNEL_OPTIONS
+            )
+            self._stub = CompilerGymServiceStub(self.channel)
+        return self._stub
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+        self.channel = None
+        self._stub = None
+        self.closed = True
+
+    async def __call__(
+        self,
+        stub_method: StubMethod,
+        request: Request,
+        timeout: Optional[float] = None,
+    ) -> Reply:
+        """Invoke an RPC method on the service and await its response.
+
+        :param stub_method: An RPC method attribute on :code:`stub`.
+        :param request: A request message.
+        :param timeout: The maximum number of seconds to await a reply. If not
+            provided, :code:`rpc_call_max_seconds` is used.
+        """
+        timeout = self.rpc_call_max_seconds if timeout is None else timeout
+        try:
+            return await stub_method(request, timeout=timeout)
+        except grpc.RpcError as e:
+            raise _translate_rpc_error(e, self.url, request, timeout) from None
+
+
+# The maximum length of a unix domain socket path, including the terminating
+# null byte. This is the size of sockaddr_un.sun_path on Linux.
+_UNIX_SOCKET_PATH_MAX_LENGTH = 108
 
 
 def make_working_dir():
@@ -178,6 +365,21 @@ def make_working_dir():
     return working_dir
 
 
+def make_shared_memory_dir(working_dir: Path) -> Path:
+    """Make a directory for the shared memory observations of a service. The
+    directory is in :code:`/dev/shm` if possible, else it is a subdirectory of
+    the working directory. The calling code is responsible for removing this
+    directory when done.
+    """
+    try:
+        shared_memory_dir = Path("/dev/shm") / f"compiler_gym-{working_dir.name}"
+        shared_memory_dir.mkdir(exist_ok=False)
+    except OSError:
+        shared_memory_dir = working_dir / "shared_memory"
+        shared_memory_dir.mkdir(exist_ok=False)
+    return shared_memory_dir
+
+
 class ManagedConnection(Connection):
     """A connection to a service using a managed subprocess."""
 
@@ -187,10 +389,14 @@ class ManagedConnection(Connection):
         port_init_max_seconds: float,
         rpc_init_max_seconds: float,
         process_exit_max_seconds: float,
+        use_unix_socket: bool = True,
     ):
         """Constructor.
 
         :param local_service_binary: The path of the service binary.
+        :param use_unix_socket: Whether to connect to the service using a unix
+            domain socket in the working directory. If the connection over the
+            unix socket fails, the service's TCP port is used instead.
         :raises TimeoutError: If fails to establish connection within a specified time limit.
         """
         self.process_exit_max_seconds = process_exit_max_seconds
@@ -198,6 +404,15 @@ class ManagedConnection(Connection):
         if not Path(local_service_binary).is_file():
             raise FileNotFoundError(f"File not found: {local_service_binary}")
         self.working_dir = make_working_dir()
+        # The service may be killed before it can clean up, so the directory
+        # for shared memory observations is owned by this connection.
+        self.shared_memory_dir = make_shared_memory_dir(self.working_dir)
+
+        # Paths to unix domain sockets have a fixed maximum length.
+        unix_socket_path = self.working_dir / "service.sock"
+        if len(str(unix_socket_path)) >= _UNIX_SOCKET_PATH_MAX_LENGTH:
+            logging.debug(f"Unix socket path is too long: {unix_socket_path}")
+            use_unix_socket = False
 
         # Set environment variable COMPILER_GYM_SERVICE_ARGS to pass
         # additional arguments to the service.
@@ -207,8 +422,11 @@ class ManagedConnection(Connection):
             f"--port=0",
             f"--log_dir={self.working_dir}/logs",
             f"--working_dir={self.working_dir}",
+            f"--shared_memory_dir={self.shared_memory_dir}",
             args,
         ]
+        if use_unix_socket:
+            cmd.append(f"--unix_socket={unix_socket_path}")
 
         # Set the root of the runfiles directory.
         env = os.environ.copy()
@@ -234,7 +452,7 @@ class ManagedConnection(Connection):
         while time() < end_time:
             returncode = self.process.poll()
             if returncode is not None:
-                shutil.rmtree(self.working_dir)
+                self._remove_dirs()
                 raise ServiceError(f"Service terminated with returncode: {returncode}")
             if port_path.is_file():
                 with open(port_path) as f:
@@ -245,18 +463,25 @@ class ManagedConnection(Connection):
         else:
             self.process.kill()
             self.process.communicate(timeout=rpc_init_max_seconds)
-            shutil.rmtree(self.working_dir)
+            self._remove_dirs()
             raise TimeoutError(
                 "Service failed to produce port file after "
                 f"{port_init_max_seconds:.1f} seconds"
             )
 
-        url = f"localhost:{self.port}"
+        tcp_url = f"localhost:{self.port}"
+        # The service creates the unix socket before writing the port file, so
+        # the first connection attempt is made using the unix socket. If that
+        # fails, fall back to TCP.
+        url = f"unix:{unix_socket_path}" if use_unix_socket else tcp_url
 
         wait_secs = 0.1
         attempts = 0
         end_time = time() + rpc_init_max_seconds
         while time() < end_time:
+            if attempts and url != tcp_url:
+                logging.debug(f"Falling back to TCP connection to {tcp_url}")
+                url = tcp_url
             try:
                 channel = grpc.insecure_channel(
                     url,
@@ -272,7 +497,7 @@ class ManagedConnection(Connection):
         else:
             self.process.kill()
             self.process.communicate(timeout=process_exit_max_seconds)
-            shutil.rmtree(self.working_dir)
+            self._remove_dirs()
             raise TimeoutError(
                 "Failed to connect to RPC service after "
                 f"{process_exit_max_seconds:.1f} seconds"
@@ -285,9 +510,15 @@ class ManagedConnection(Connection):
         """Terminate a local subprocess and close the connection."""
         self.process.kill()
         self.process.communicate(timeout=self.process_exit_max_seconds)
-        shutil.rmtree(self.working_dir, ignore_errors=True)
+        self._remove_dirs()
         super().close()
 
+    def _remove_dirs(self):
+        """Remove the working directory and the shared memory directory of the
+        service."""
+        shutil.rmtree(self.shared_memory_dir, ignore_errors=True)
+        shutil.rmtree(self.working_dir, ignore_errors=True)
+
     def __repr__(self):
         return f"{self.url} running on PID={self.process.pid}"
 
@@ -396,6 +627,9 @@ class CompilerGymServiceConnection(object):
         self.opts = opts or ConnectionOpts()
         self.connection = None
         self.stub = None
+        # The number of users of this connection. See share().
+        self._refcount = 1
+        self._refcount_lock = Lock()
         self._establish_connection()
 
         self.action_spaces: List[ActionSpace] = list(
@@ -445,6 +679,7 @@ class CompilerGymServiceConnection(object):
                         process_exit_max_seconds=opts.local_service_exit_max_seconds,
                         rpc_init_max_seconds=opts.rpc_init_max_seconds,
                         port_init_max_seconds=opts.local_service_port_init_max_seconds,
+                        use_unix_socket=opts.local_service_use_unix_socket,
                     )
                 else:
                     return UnmanagedConnection(
@@ -475,16 +710,47 @@ class CompilerGymServiceConnection(object):
         """Whether the connection is closed."""
         return self.connection is None
 
+    @property
+    def refcount(self) -> int:
+        """The number of users of this connection."""
+        return self._refcount
+
+    def share(self) -> "CompilerGymServiceConnection":
+        """Add a user to this connection.
+
+        A connection may be shared by many users, e.g. environments, each of
+        which have their own sessions with the service. Every call to
+        :code:`share()` must be matched by a call to :meth:`close()`, and the
+        connection is closed only when the last user closes it.
+
+        :return: This connection.
+        :raises ServiceIsClosed: If the connection is closed.
+        """
+        with self._refcount_lock:
+            if self.closed:
+                raise ServiceIsClosed(f"Cannot share closed connection to {self}")
+            self._refcount += 1
+        return self
+
     def close(self):
-        if self.closed:
-            return
+        """Remove a user from this connection, and close the connection if
+        there are no users remaining.
+        """
+        with self._refcount_lock:
+            if self.closed:
+                return
+            self._refcount -= 1
+            if self._refcount > 0:
+                return
         self.connection.close()
         self.connection = None
 
     def __del__(self):
         # Don't let the subprocess be orphaned if user forgot to close(), or
         # if an exception was thrown.
-        self.close()
+        if not self.closed:
+            self._refcount = 1
+            self.close()
 
     def restart(self):
         """Restart a connection a service. If the service is managed by this
@@ -9,8 +9,12 @@ from compiler_gym.service.proto.compiler_gym_service_pb2 import (
     EndEpisodeReply,
     EndEpisodeRequest,
     File,
+    ForkSessionReply,
+    ForkSessionRequest,
     GetBenchmarksReply,
     GetBenchmarksRequest,
+    GetObservationsReply,
+    GetObservationsRequest,
     GetSpacesReply,
     GetSpacesRequest,
     GetVersionReply,
@@ -19,12 +23,19 @@ from compiler_gym.service.proto.compiler_gym_service_pb2 import (
     Observation,
     ObservationRequest,
     ObservationSpace,
+    ResetSessionReply,
+    ResetSessionRequest,
+    RestoreSessionReply,
+    RestoreSessionRequest,
     Reward,
     RewardRequest,
     RewardSpace,
     ScalarLimit,
     ScalarRange,
     ScalarRangeList,
+    SharedMemoryBuffer,
+    SnapshotSessionReply,
+    SnapshotSessionRequest,
     StartEpisodeReply,
     StartEpisodeRequest,
 )
@@ -48,12 +59,23 @@ __all__ = [
     "ScalarLimit",
     "ScalarRangeList",
     "ObservationSpace",
+    "SharedMemoryBuffer",
     "ObservationRequest",
+    "GetObservationsRequest",
+    "GetObservationsReply",
     "RewardSpace",
     "RewardRequest",
     "Reward",
     "EndEpisodeRequest",
     "EndEpisodeReply",
+    "ForkSessionRequest",
+    "ForkSessionReply",
+    "SnapshotSessionRequest",
+    "SnapshotSessionReply",
+    "RestoreSessionRequest",
+    "RestoreSessionReply",
+    "ResetSessionRequest",
+    "ResetSessionReply",
     "GetSpacesRequest",
     "GetSpacesReply",
     "GetBenchmarksRequest",
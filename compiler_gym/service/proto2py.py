@@ -3,15 +3,17 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 """Converters from protocol buffers to python-friendly types."""
+import mmap
+import os
 from typing import Any, Dict, List, Union
 
 import networkx as nx
 import numpy as np
 
-from compiler_gym.service.proto import ScalarRange
+from compiler_gym.service.proto import Observation, ScalarRange
 
 json_t = Union[List[Any], Dict[str, Any]]
-observation_t = Union[np.ndarray, str, bytes, json_t, nx.DiGraph]
+observation_t = Union[np.ndarray, str, bytes, memoryview, json_t, nx.DiGraph]
 
 
 def scalar_range2tuple(sr: ScalarRange, defaults=(-np.inf, np.inf)):
@@ -20,3 +22,41 @@ def scalar_range2tuple(sr: ScalarRange, defaults=(-np.inf, np.inf)):
         sr.min.value if sr.HasField("min") else defaults[0],
         sr.max.value if sr.HasField("max") else defaults[1],
     )
+
+
+def _map_shared_memory(observation: Observation) -> Union[mmap.mmap, bytes]:
+    """Map the shared memory file of an observation into memory. The file is
+    deleted once mapped, so its memory is released when the mapping is
+    closed."""
+    path = observation.shared_memory.path
+    try:
+        if not observation.shared_memory.size:
+            return b""
+        with open(path, "rb") as f:
+            return mmap.mmap(
+                f.fileno(), observation.shared_memory.size, access=mmap.ACCESS_READ
+            )
+    finally:
+        os.unlink(path)
+
+
+def observation_string_value(observation: Observation) -> str:
+    """Return the string value of an observation, reading it from shared memory
+    if required."""
+    if observation.HasField("shared_memory"):
+        buffer = _map_shared_memory(observation)
+        try:
+            return str(buffer, "utf-8")
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+    return observation.string_value
+
+
+def observation_binary_value(observation: Observation) -> Union[bytes, memoryview]:
+    """Return the binary value of an observation. If the observation was
+    written to shared memory, this returns a read-only :code:`memoryview` of
+    the shared memory without copying it."""
+    if observation.HasField("shared_memory"):
+        return memoryview(_map_shared_memory(observation))
+    return observation.binary_value
@@ -0,0 +1,156 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""This module defines a pool of pre-started compiler services."""
+import atexit
+import logging
+from collections import deque
+from pathlib import Path
+from threading import Condition, Thread
+from typing import Deque, Optional
+
+from compiler_gym.service.connection import (
+    CompilerGymServiceConnection,
+    ConnectionOpts,
+    ServiceError,
+)
+
+
+class ServicePool(object):
+    """A pool of idle service processes that are started in the background.
+
+    Starting a local service binary takes hundreds of milliseconds, which
+    dominates the cost of creating short-lived environments. A service pool
+    keeps a number of services running and ready, so that a new environment
+    can take one without waiting:
+
+    >>> pool = ServicePool(compiler_gym.envs.llvm.LLVM_SERVICE_BINARY, size=4)
+    >>> env = gym.make("llvm-v0", service=pool)
+
+    Every service that is taken from the pool is owned by the environment that
+    took it, and is terminated when the environment is closed. A background
+    thread starts a replacement for each service that is taken. If the pool is
+    empty, :meth:`acquire()` starts a service in the calling thread.
+
+    :ivar endpoint: The path of the service binary.
+    :vartype endpoint: Path
+    :ivar size: The number of idle services to keep running.
+    :vartype size: int
+    :ivar opts: The connection options used to start services.
+    :vartype opts: ConnectionOpts
+    """
+
+    def __init__(self, endpoint: Path, size: int = 2, opts: ConnectionOpts = None):
+        """Constructor.
+
+        :param endpoint: The path of a local service binary.
+        :param size: The number of idle services to keep running.
+        :param opts: The connection options used to start services.
+        :raises TypeError: If the endpoint is not the path of a service binary.
+        :raises ValueError: If the size is not positive.
+        """
+        if not isinstance(endpoint, Path):
+            raise TypeError(
+                f"Service pools require the path of a service binary, not: {endpoint}"
+            )
+        if size < 1:
+            raise ValueError(f"Service pool size must be positive, not: {size}")
+        self.endpoint = endpoint
+        self.size = size
+        self.opts = opts or ConnectionOpts()
+
+        self._idle: Deque[CompilerGymServiceConnection] = deque()
+        self._condition = Condition()
+        self._closed = False
+        self._thread = Thread(target=self._fill, daemon=True)
+        self._thread.start()
+        # Don't let the idle services be orphaned if the user forgets to
+        # close() the pool.
+        atexit.register(self.close)
+
+    def _fill(self) -> None:
+        """Start services until the pool is full, then wait for one to be
+        taken or for the pool to close."""
+        wait_secs = 0.1
+        while True:
+            with self._condition:
+                while not self._closed and len(self._idle) >= self.size:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            try:
+                connection = CompilerGymServiceConnection(self.endpoint, self.opts)
+                wait_secs = 0.1
+            except (OSError, ServiceError) as e:
+                logging.warning(f"Failed to start pooled service: {e}")
+                # Back off before the next attempt.
+                with self._condition:
+                    self._condition.wait(timeout=wait_secs)
+                wait_secs = min(wait_secs * 2, 10)
+                continue
+            with self._condition:
+                if self._closed:
+                    connection.close()
+                    return
+                self._idle.append(connection)
+                self._condition.notify_all()
+
+    @property
+    def idle_count(self) -> int:
+        """The number of idle services in the pool."""
+        with self._condition:
+            return len(self._idle)
+
+    @property
+    def closed(self) -> bool:
+        """Whether the pool is closed."""
+        return self._closed
+
+    def acquire(self) -> CompilerGymServiceConnection:
+        """Take a service from the pool.
+
+        The caller owns the returned connection and is responsible for closing
+        it.
+
+        :return: A connection to a running service.
+        :raises ServiceError: If the pool is closed.
+        """
+        connection: Optional[CompilerGymServiceConnection] = None
+        with self._condition:
+            if self._closed:
+                raise ServiceError("Service pool is closed")
+            while self._idle:
+                connection = self._idle.popleft()
+                # Discard any service that has died while idle.
+                if connection.connection.process.poll() is None:
+                    break
+                connection.close()
+                connection = None
+            self._condition.notify_all()
+        return connection or CompilerGymServiceConnection(self.endpoint, self.opts)
+
+    def close(self) -> None:
+        """Stop starting services and terminate the idle services.
+
+        Services which have been taken from the pool are not affected.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._condition.notify_all()
+        atexit.unregister(self.close)
+        for connection in idle:
+            connection.close()
+        self._thread.join()
+
+    def __enter__(self) -> "ServicePool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"ServicePool({self.endpoint}, size={self.size})"
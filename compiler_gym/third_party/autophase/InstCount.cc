@@ -179,65 +179,74 @@ std::vector<int64_t> InstCount::getFeatureVector(Module& module) {
   for (auto& function : module) {
     pass.runOnFunction(function);
   }
+  return pass.getCounters();
+}
+
+std::vector<int64_t> InstCount::getFeatureVector(Function& function) {
+  InstCount pass;
+  pass.runOnFunction(function);
+  return pass.getCounters();
+}
 
+std::vector<int64_t> InstCount::getCounters() const {
   std::vector<int64_t> features;
   features.reserve(kAutophaseFeatureDimensionality);
-  features.push_back(pass.get_BBNumArgsHi());
-  features.push_back(pass.get_BBNumArgsLo());
-  features.push_back(pass.get_onePred());
-  features.push_back(pass.get_onePredOneSuc());
-  features.push_back(pass.get_onePredTwoSuc());
-  features.push_back(pass.get_oneSuccessor());
-  features.push_back(pass.get_twoPred());
-  features.push_back(pass.get_twoPredOneSuc());
-  features.push_back(pass.get_twoEach());
-  features.push_back(pass.get_twoSuccessor());
-  features.push_back(pass.get_morePreds());
-  features.push_back(pass.get_BB03Phi());
-  features.push_back(pass.get_BBHiPhi());
-  features.push_back(pass.get_BBNoPhi());
-  features.push_back(pass.get_BeginPhi());
-  features.push_back(pass.get_BranchCount());
-  features.push_back(pass.get_returnInt());
-  features.push_back(pass.get_CriticalCount());
-  features.push_back(pass.get_NumEdges());
-  features.push_back(pass.get_const32Bit());
-  features.push_back(pass.get_const64Bit());
-  features.push_back(pass.get_numConstZeroes());
-  features.push_back(pass.get_numConstOnes());
-  features.push_back(pass.get_UncondBranches());
-  features.push_back(pass.get_binaryConstArg());
-  features.push_back(pass.get_NumAShrInst());
-  features.push_back(pass.get_NumAddInst());
-  features.push_back(pass.get_NumAllocaInst());
-  features.push_back(pass.get_NumAndInst());
-  features.push_back(pass.get_BlockMid());
-  features.push_back(pass.get_BlockLow());
-  features.push_back(pass.get_NumBitCastInst());
-  features.push_back(pass.get_NumBrInst());
-  features.push_back(pass.get_NumCallInst());
-  features.push_back(pass.get_NumGetElementPtrInst());
-  features.push_back(pass.get_NumICmpInst());
-  features.push_back(pass.get_NumLShrInst());
-  features.push_back(pass.get_NumLoadInst());
-  features.push_back(pass.get_NumMulInst());
-  features.push_back(pass.get_NumOrInst());
-  features.push_back(pass.get_NumPHIInst());
-  features.push_back(pass.get_NumRetInst());
-  features.push_back(pass.get_NumSExtInst());
-  features.push_back(pass.get_NumSelectInst());
-  features.push_back(pass.get_NumShlInst());
-  features.push_back(pass.get_NumStoreInst());
-  features.push_back(pass.get_NumSubInst());
-  features.push_back(pass.get_NumTruncInst());
-  features.push_back(pass.get_NumXorInst());
-  features.push_back(pass.get_NumZExtInst());
-  features.push_back(pass.get_TotalBlocks());
-  features.push_back(pass.get_TotalInsts());
-  features.push_back(pass.get_TotalMemInst());
-  features.push_back(pass.get_TotalFuncs());
-  features.push_back(pass.get_ArgsPhi());
-  features.push_back(pass.get_testUnary());
+  features.push_back(get_BBNumArgsHi());
+  features.push_back(get_BBNumArgsLo());
+  features.push_back(get_onePred());
+  features.push_back(get_onePredOneSuc());
+  features.push_back(get_onePredTwoSuc());
+  features.push_back(get_oneSuccessor());
+  features.push_back(get_twoPred());
+  features.push_back(get_twoPredOneSuc());
+  features.push_back(get_twoEach());
+  features.push_back(get_twoSuccessor());
+  features.push_back(get_morePreds());
+  features.push_back(get_BB03Phi());
+  features.push_back(get_BBHiPhi());
+  features.push_back(get_BBNoPhi());
+  features.push_back(get_BeginPhi());
+  features.push_back(get_BranchCount());
+  features.push_back(get_returnInt());
+  features.push_back(get_CriticalCount());
+  features.push_back(get_NumEdges());
+  features.push_back(get_const32Bit());
+  features.push_back(get_const64Bit());
+  features.push_back(get_numConstZeroes());
+  features.push_back(get_numConstOnes());
+  features.push_back(get_UncondBranches());
+  features.push_back(get_binaryConstArg());
+  features.push_back(get_NumAShrInst());
+  features.push_back(get_NumAddInst());
+  features.push_back(get_NumAllocaInst());
+  features.push_back(get_NumAndInst());
+  features.push_back(get_BlockMid());
+  features.push_back(get_BlockLow());
+  features.push_back(get_NumBitCastInst());
+  features.push_back(get_NumBrInst());
+  features.push_back(get_NumCallInst());
+  features.push_back(get_NumGetElementPtrInst());
+  features.push_back(get_NumICmpInst());
+  features.push_back(get_NumLShrInst());
+  features.push_back(get_NumLoadInst());
+  features.push_back(get_NumMulInst());
+  features.push_back(get_NumOrInst());
+  features.push_back(get_NumPHIInst());
+  features.push_back(get_NumRetInst());
+  features.push_back(get_NumSExtInst());
+  features.push_back(get_NumSelectInst());
+  features.push_back(get_NumShlInst());
+  features.push_back(get_NumStoreInst());
+  features.push_back(get_NumSubInst());
+  features.push_back(get_NumTruncInst());
+  features.push_back(get_NumXorInst());
+  features.push_back(get_NumZExtInst());
+  features.push_back(get_TotalBlocks());
+  features.push_back(get_TotalInsts());
+  features.push_back(get_TotalMemInst());
+  features.push_back(get_TotalFuncs());
+  features.push_back(get_ArgsPhi());
+  features.push_back(get_testUnary());
   return features;
 }
 
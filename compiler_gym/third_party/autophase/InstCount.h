@@ -27,8 +27,16 @@ class InstCount : public FunctionPass, public InstVisitor<InstCount> {
   // Get the counter values as a vector of integers.
   static std::vector<int64_t> getFeatureVector(llvm::Module&);
 
+  // Get the counter values of a single function. Every counter is a sum over
+  // the functions of a module, so the feature vector of a module is the
+  // element-wise sum of the feature vectors of its functions.
+  static std::vector<int64_t> getFeatureVector(llvm::Function&);
+
  private:
   InstCount() : FunctionPass(ID) {}
+
+  // Get the current counter values as a vector of integers.
+  std::vector<int64_t> getCounters() const;
   friend class InstVisitor<InstCount>;
 
   bool runOnFunction(Function& F) override;
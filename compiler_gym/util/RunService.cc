@@ -10,3 +10,10 @@ DEFINE_string(
 DEFINE_string(port, "0",
               "The port to listen on. If 0, an unused port will be selected. The selected port is "
               "written to <working_dir>/port.txt.");
+DEFINE_string(shared_memory_dir, "",
+              "The directory in which to write observations that are passed to the client through "
+              "shared memory. The directory is owned by the client, which removes it when the "
+              "service is closed. If not set, the working directory is used.");
+DEFINE_string(unix_socket, "",
+              "If set, also listen on a unix domain socket at this path. Local clients can use "
+              "this to avoid the overhead of TCP.");
@@ -14,11 +14,13 @@
 
 DECLARE_string(port);
 DECLARE_string(working_dir);
+DECLARE_string(shared_memory_dir);
+DECLARE_string(unix_socket);
 
 namespace compiler_gym::util {
 
-// Create a service, configured using --port and --working_dir flags, and
-// run it. This function never returns.
+// Create a service, configured using --port, --working_dir, and --unix_socket
+// flags, and run it. This function never returns.
 //
 // Service must be a subclass of CompilerGymService::Service that implements all
 // RPC endpoints and takes a single-argument working directory constructor:
@@ -42,7 +44,7 @@ int runService(int* argc, char*** argv, const char* usage) {
   CHECK(!FLAGS_working_dir.empty()) << "--working_dir flag not set";
   CHECK(!FLAGS_port.empty()) << "--port flag not set";
 
-  return createAndRunService<Service>(FLAGS_working_dir, FLAGS_port);
+  return createAndRunService<Service>(FLAGS_working_dir, FLAGS_port, FLAGS_unix_socket);
 }
 
 }  // namespace compiler_gym::util
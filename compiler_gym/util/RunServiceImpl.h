@@ -19,10 +19,12 @@
 
 namespace compiler_gym::util {
 
-// Create a service and run it. This function never returns.
+// Create a service and run it. If unixSocketPath is not empty, the service
+// also listens on a unix domain socket at this path. This function never
+// returns.
 template <typename Service>
 int createAndRunService(const boost::filesystem::path& workingDirectory,
-                        const std::string& requestedPort) {
+                        const std::string& requestedPort, const std::string& unixSocketPath = "") {
   CHECK(boost::filesystem::is_directory(workingDirectory))
       << "Directory not found: " << workingDirectory.string();
   Service service{workingDirectory};
@@ -39,10 +41,19 @@ int createAndRunService(const boost::filesystem::path& workingDirectory,
   std::string serverAddress = "0.0.0.0:" + requestedPort;
   builder.AddListeningPort(serverAddress, grpc::InsecureServerCredentials(), &port);
 
+  // Local clients can avoid the overhead of the TCP stack by connecting to a
+  // unix domain socket. The TCP port is always available as a fallback.
+  if (!unixSocketPath.empty()) {
+    builder.AddListeningPort("unix:" + unixSocketPath, grpc::InsecureServerCredentials());
+  }
+
   // Start the server.
   std::unique_ptr<grpc::Server> server(builder.BuildAndStart());
   CHECK(server) << "Failed to build RPC service";
   LOG(INFO) << "LLVM service listening on " << port;
+  if (!unixSocketPath.empty()) {
+    LOG(INFO) << "LLVM service listening on unix:" << unixSocketPath;
+  }
 
   {
     // Write the port to a <working_dir>/port.txt file, which an external
@@ -87,6 +87,12 @@ flags.DEFINE_float(
     "Service configuration option. Limits the number of seconds to wait for an "
     "RPC connection to establish on initialization.",
 )
+flags.DEFINE_boolean(
+    "service_use_step_stream",
+    False,
+    "Service configuration option. Send the actions of each episode over a "
+    "single streaming RPC, rather than making an RPC call for every step.",
+)
 
 FLAGS = flags.FLAGS
 
@@ -102,6 +108,7 @@ def connection_settings_from_flags(
         local_service_port_init_max_seconds=FLAGS.local_service_port_init_max_seconds,
         local_service_exit_max_seconds=FLAGS.local_service_exit_max_seconds,
         rpc_init_max_seconds=FLAGS.service_rpc_init_max_seconds,
+        use_step_stream=FLAGS.service_use_step_stream,
     )
 
 
@@ -68,6 +68,9 @@ def cache_path(relpath: str) -> Path:
     :param relpath: The relative path within the cache.
     :return: The absolute path of the cache.
     """
+    # NOTE: This function has a matching implementation in the C++ sources,
+    # compiler_gym::util::getCachePath(). Any change to behavior here must be
+    # reflected in the C++ version.
     forced = os.environ.get("COMPILER_GYM_CACHE")
     if forced:
         return Path(forced) / relpath
@@ -78,8 +78,8 @@ def _llvm_replay_commandline(env: LlvmEnv, commandline: str) -> Optional[float]:
     commandline = commandline[len("opt ") : -len(" input.bc -o output.bc")]
 
     actions = cast(Commandline, env.action_space).from_commandline(commandline)
-    for action in actions:
-        _, _, done, info = env.step(action)
+    if actions:
+        _, _, done, info = env.multistep(actions)
         if done:
             raise OSError(
                 f"Environment terminated with error: `{info.get('error_details')}`"
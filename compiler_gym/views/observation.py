@@ -2,10 +2,16 @@
 #
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
-from typing import Callable, List
+from typing import Callable, Iterable, List, Optional
 
 from compiler_gym.service import observation_t
-from compiler_gym.service.proto import Observation, ObservationRequest, ObservationSpace
+from compiler_gym.service.proto import (
+    GetObservationsReply,
+    GetObservationsRequest,
+    Observation,
+    ObservationRequest,
+    ObservationSpace,
+)
 from compiler_gym.views.observation_space_spec import ObservationSpaceSpec
 
 
@@ -24,12 +30,17 @@ class ObservationView(object):
     [0, 1, ..., 2]
     >>> observation["Ir"]
     int main() {...}
+    >>> env.observation.get_many(["Autophase", "IrInstructionCount"])
+    [[0, 1, ..., 2], [1024]]
     """
 
     def __init__(
         self,
         get_observation: Callable[[ObservationRequest], Observation],
         spaces: List[ObservationSpace],
+        get_observations: Optional[
+            Callable[[GetObservationsRequest], GetObservationsReply]
+        ] = None,
     ):
         if not spaces:
             raise ValueError("No observation spaces")
@@ -39,6 +50,7 @@ class ObservationView(object):
         self.session_id = -1
 
         self._get_observation = get_observation
+        self._get_observations = get_observations
 
     def __getitem__(self, observation_space: str) -> observation_t:
         """Request an observation from the given space.
@@ -54,6 +66,58 @@ class ObservationView(object):
         )
         return space.cb(self._get_observation(request))
 
+    def get_many(self, observation_spaces: Iterable[str]) -> List[observation_t]:
+        """Request observations from several observation spaces at once.
+
+        The observations are requested from the service in a single call.
+        Derived observation spaces share the observation of their base space,
+        so e.g. requesting :code:`Ir` and :code:`Inst2vec` computes the IR only
+        once. If the service does not support batched observations, each
+        observation is requested separately.
+
+        :param observation_spaces: The observation spaces to query.
+        :return: A list of observations, one for each observation space.
+        :raises KeyError: If a requested observation space does not exist.
+        """
+        spaces = [
+            self.spaces[observation_space] for observation_space in observation_spaces
+        ]
+        # Remove duplicate indices, preserving order.
+        indices = list(dict.fromkeys(space.index for space in spaces))
+
+        observations = None
+        if self._get_observations:
+            request = GetObservationsRequest(
+                session_id=self.session_id,
+                observation_space=indices,
+            )
+            try:
+                observations = self._get_observations(request).observation
+            except NotImplementedError:
+                # Fall back to one request per observation space from now on.
+                self._get_observations = None
+        if observations is None:
+            observations = [
+                self._get_observation(
+                    ObservationRequest(
+                        session_id=self.session_id, observation_space=index
+                    )
+                )
+                for index in indices
+            ]
+
+        # Decode the observation of each index once, and derive the observations
+        # of every space from it. An observation that is passed through shared
+        # memory can only be decoded once.
+        observations = dict(zip(indices, observations))
+        base_observations = {}
+        for space in spaces:
+            if space.index not in base_observations:
+                base_observations[space.index] = space.base_cb(
+                    observations[space.index]
+                )
+        return [space.translate(base_observations[space.index]) for space in spaces]
+
     def add_derived_space(
         self,
         id: str,
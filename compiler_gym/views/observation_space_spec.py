@@ -11,11 +11,15 @@ from gym.spaces import Box, Space
 
 from compiler_gym.service import observation_t, scalar_range2tuple
 from compiler_gym.service.proto import Observation, ObservationSpace
+from compiler_gym.service.proto2py import (
+    observation_binary_value,
+    observation_string_value,
+)
 from compiler_gym.spaces import Sequence
 
 
 def _json2nx(observation):
-    json_data = json.loads(observation.string_value)
+    json_data = json.loads(observation_string_value(observation))
     return nx.readwrite.json_graph.node_link_graph(
         json_data, multigraph=True, directed=True
     )
@@ -45,6 +49,17 @@ class ObservationSpaceSpec(object):
         :func:`CompilerEnv.step() <compiler_gym.envs.CompilerEnv.step>` if
         :func:`CompilerEnv.observation_space <compiler_gym.envs.CompilerEnv.observation_space>`
         is set and the service terminates.
+
+    :ivar base_cb: A callback that translates from an Observation message to
+        the observation of the space that this space is derived from, or of
+        this space if it is not a derived space.
+    :vartype base_cb: Callable[[Observation], observation_t]
+
+    :ivar translate: A callback that computes the observation of this space
+        from the observation that is returned by :code:`base_cb`. Spaces that
+        are derived from the same base space can share a single call to
+        :code:`base_cb`.
+    :vartype translate: Callable[[observation_t], observation_t]
     """
 
     def __init__(
@@ -57,6 +72,8 @@ class ObservationSpaceSpec(object):
         deterministic: bool,
         platform_dependent: bool,
         default_value: observation_t,
+        base_cb: Optional[Callable[[Observation], observation_t]] = None,
+        translate: Optional[Callable[[observation_t], observation_t]] = None,
     ):
         """Constructor. Don't call directly, use make_derived_space()."""
         self.id: str = id
@@ -67,6 +84,8 @@ class ObservationSpaceSpec(object):
         self.default_value = default_value
         self.cb = cb
         self.to_string = to_string
+        self.base_cb = base_cb or cb
+        self.translate = translate or (lambda observation: observation)
 
     def __repr__(self) -> str:
         return f"ObservationSpaceSpec({self.id})"
@@ -100,14 +119,16 @@ class ObservationSpaceSpec(object):
             # TODO(cummins): Add a Graph space.
             space = make_seq(proto.string_size_range, str, (0, None))
             cb = lambda observation: nx.readwrite.json_graph.node_link_graph(
-                json.loads(observation.string_value), multigraph=True, directed=True
+                json.loads(observation_string_value(observation)),
+                multigraph=True,
+                directed=True,
             )
             to_string = lambda observation: json.dumps(
                 nx.readwrite.json_graph.node_link_data(observation), indent=2
             )
         elif proto.opaque_data_format == "json://":
             space = make_seq(proto.string_size_range, str, (0, None))
-            cb = lambda observation: json.loads(observation.string_value)
+            cb = lambda observation: json.loads(observation_string_value(observation))
             to_string = lambda observation: json.dumps(observation, indent=2)
         elif shape_type == "int64_range_list":
             space = make_box(
@@ -129,11 +150,11 @@ class ObservationSpaceSpec(object):
             to_string = str
         elif shape_type == "string_size_range":
             space = make_seq(proto.string_size_range, str, (0, None))
-            cb = lambda observation: observation.string_value
+            cb = observation_string_value
             to_string = str
         elif shape_type == "binary_size_range":
             space = make_seq(proto.binary_size_range, bytes, (0, None))
-            cb = lambda observation: observation.binary_value
+            cb = observation_binary_value
             to_string = str
         else:
             raise TypeError(f"Cannot determine shape of ObservationSpace: {proto}")
@@ -179,11 +200,14 @@ class ObservationSpaceSpec(object):
             base observation space.
         :return: A new ObservationSpaceSpec.
         """
+        translate = lambda observation: cb(self.translate(observation))
         return ObservationSpaceSpec(
             id=id,
             index=self.index,
             space=space or self.space,
-            cb=lambda observation: cb(self.cb(observation)),
+            cb=lambda observation: translate(self.base_cb(observation)),
+            base_cb=self.base_cb,
+            translate=translate,
             to_string=to_string or self.to_string,
             default_value=(
                 cb(self.default_value) if default_value is None else default_value
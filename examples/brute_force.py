@@ -154,6 +154,18 @@ class BruteForceWorker(Thread):
     def run_one_episode(self, actions: List[int]) -> List[float]:
         """Evaluate the reward of every action in a list."""
         self.env.reset()
+        # Run the episode in a single request and recover the per-step rewards.
+        _, _, done, info = self.env.multistep(actions, per_action_feedback=True)
+        # A failed episode has no per-step rewards, and a service may not
+        # support them. Replay the episode one step at a time instead, so that
+        # the rewards up to the failed step are recorded.
+        if (done and "error_details" in info) or not info.get("per_action_reward"):
+            return self.run_one_episode_stepwise(actions)
+        return info["per_action_reward"]
+
+    def run_one_episode_stepwise(self, actions: List[int]) -> List[float]:
+        """Evaluate the reward of every action in a list, one step at a time."""
+        self.env.reset()
         rewards = []
         for action in actions:
             _, reward, done, _ = self.env.step(action)
@@ -126,6 +126,15 @@ Status ExampleService::TakeAction(ServerContext* /* unused*/, const ActionReques
   for (int i = 0; i < request->action_size(); ++i) {
     const auto& action = request->action(i);
     RETURN_IF_ERROR(rangeCheck(action, 0, static_cast<int32_t>(actionSpace_.size()) - 1));
+
+    if (request->per_action_feedback()) {
+      reply->add_per_action_had_no_effect(false);
+      if (eagerReward_) {
+        Reward reward;
+        RETURN_IF_ERROR(setReward(eagerRewardSpace_, &reward));
+        reply->add_per_action_reward(reward.reward());
+      }
+    }
   }
 
   if (eagerObservation_) {
@@ -16,9 +16,9 @@ Example usage:
 
 Use --help to list the configurable options.
 """
-import hashlib
 import itertools
 import math
+from copy import copy
 from enum import IntEnum
 from heapq import nlargest
 from multiprocessing import cpu_count
@@ -89,6 +89,14 @@ class CustomEnv:
     def step(self, action):
         return self._env.step(self._action_indices[action])
 
+    def multistep(self, actions):
+        return self._env.multistep([self._action_indices[a] for a in actions])
+
+    def fork(self):
+        fork = copy(self)
+        fork._env = self._env.fork()
+        return fork
+
     def reset(self):
         self._env.reset()
 
@@ -185,30 +193,25 @@ class StateGraph:
 
 
 def env_to_fingerprint(env):
-    # TODO: There is some sort of state in the env that is not
-    # captured by this. Figure out what it is and fix it. Also
-    # consider adding a fingerprint observation to env.
-    if False:
-        # BitcodeFile is slower, so using Ir instead.
-        path = env.observation["BitcodeFile"]
-        with open(path, "rb") as f:
-            data = f.read()
-    else:
-        data = env.observation["Ir"].encode()
-
-    return hashlib.sha256(data).digest()
+    # The ModuleHash observation is a 20-byte digest of the module computed by
+    # the service, which is much cheaper than transferring and hashing the IR.
+    return bytes(env.observation["ModuleHash"])
 
 
 def compute_edges(env, sequence):
+    # Replay the sequence once, then fork the resulting state for each action
+    # rather than replaying the sequence for every action.
+    env.reset()
+    prefix_reward = env.multistep(sequence)[1] if sequence else 0.0
+
     edges = []
     for action in env.actions():
-        env.reset()
-        reward_sum = 0.0
-        for action in sequence + [action]:
-            _, reward, _, _ = env.step(action)
-            reward_sum += reward
-
-        edges.append((env_to_fingerprint(env), reward_sum))
+        fork = env.fork()
+        try:
+            _, reward, _, _ = fork.step(action)
+            edges.append((env_to_fingerprint(fork), prefix_reward + reward))
+        finally:
+            fork.close()
     return edges
 
 
@@ -0,0 +1,94 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Tests for the asyncio CompilerEnv wrapper."""
+import asyncio
+
+import gym
+import pytest
+
+from compiler_gym.envs import AsyncCompilerEnv, CompilerEnv
+from tests.test_main import main
+
+pytest_plugins = ["tests.envs.llvm.fixtures"]
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture(scope="function")
+def env() -> CompilerEnv:
+    env = gym.make("llvm-v0")
+    env.require_dataset("cBench-v0")
+    try:
+        yield env
+    finally:
+        env.close()
+
+
+def test_async_step_matches_sync_step(env: CompilerEnv):
+    env.observation_space = "IrInstructionCount"
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    expected = env.multistep([0, 1, 2])
+
+    async_env = AsyncCompilerEnv(env)
+
+    async def episode():
+        await async_env.reset(benchmark="cBench-v0/crc32")
+        return await async_env.multistep([0, 1, 2])
+
+    observation, reward, done, info = run(episode())
+    assert observation == expected[0]
+    assert reward == expected[1]
+    assert done == expected[2]
+    assert info == expected[3]
+    run(async_env.close())
+
+
+def test_async_observation_get(env: CompilerEnv):
+    async_env = AsyncCompilerEnv(env)
+
+    async def episode():
+        await async_env.reset(benchmark="cBench-v0/crc32")
+        await async_env.step(0)
+        return (
+            await async_env.observation.get("IrInstructionCount"),
+            await async_env.observation.get_many(
+                ["IrInstructionCount", "IrInstructionCountO3"]
+            ),
+        )
+
+    instcount, (instcount_many, instcount_o3) = run(episode())
+    assert instcount == instcount_many
+    assert instcount == env.observation["IrInstructionCount"]
+    assert instcount_o3 == env.observation["IrInstructionCountO3"]
+    assert env.actions == [0]
+    run(async_env.close())
+
+
+def test_concurrent_episodes():
+    envs = [AsyncCompilerEnv(gym.make("llvm-autophase-ic-v0")) for _ in range(2)]
+    try:
+        for env in envs:
+            env.require_dataset("cBench-v0")
+
+        async def episode(env: AsyncCompilerEnv):
+            await env.reset(benchmark="cBench-v0/crc32")
+            _, reward, _, _ = await env.multistep([0, 1])
+            return reward
+
+        async def episodes():
+            return await asyncio.gather(*[episode(env) for env in envs])
+
+        first, second = run(episodes())
+        assert first == second
+    finally:
+        for env in envs:
+            run(env.close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Tests for the vectorized CompilerEnv wrapper."""
+import gym
+import numpy as np
+import pytest
+
+from compiler_gym.envs import CompilerVecEnv
+from tests.test_main import main
+
+pytest_plugins = ["tests.envs.llvm.fixtures"]
+
+
+@pytest.fixture(scope="function")
+def vec_env() -> CompilerVecEnv:
+    env = gym.make("llvm-autophase-ic-v0")
+    env.require_dataset("cBench-v0")
+    with CompilerVecEnv.from_env(env, num_envs=4) as vec_env:
+        yield vec_env
+
+
+def test_from_env_invalid_num_envs():
+    with pytest.raises(ValueError):
+        CompilerVecEnv.from_env(None, num_envs=0)
+
+
+def test_reset_stacks_observations(vec_env: CompilerVecEnv):
+    assert vec_env.num_envs == 4
+    observations = vec_env.reset(benchmark="cBench-v0/crc32")
+    assert isinstance(observations, np.ndarray)
+    assert observations.shape == (4, 56)
+    assert observations.dtype == np.int64
+    # All environments start from the same benchmark.
+    for observation in observations[1:]:
+        np.testing.assert_array_equal(observation, observations[0])
+
+
+def test_reset_with_list_of_benchmarks(vec_env: CompilerVecEnv):
+    with pytest.raises(ValueError):
+        vec_env.reset(benchmark=["cBench-v0/crc32"])
+    vec_env.reset(benchmark=["cBench-v0/crc32", "cBench-v0/qsort"] * 2)
+    assert [env.benchmark for env in vec_env.envs] == [
+        "benchmark://cBench-v0/crc32",
+        "benchmark://cBench-v0/qsort",
+    ] * 2
+
+
+def test_step_matches_single_env(vec_env: CompilerVecEnv):
+    vec_env.reset(benchmark="cBench-v0/crc32")
+    actions = [0, 1, 2, 3]
+    observations, rewards, dones, infos = vec_env.step(actions)
+    assert observations.shape == (4, 56)
+    assert rewards.shape == (4,)
+    assert dones.shape == (4,)
+    assert len(infos) == 4
+
+    env = gym.make("llvm-autophase-ic-v0")
+    try:
+        for i, action in enumerate(actions):
+            env.reset(benchmark="cBench-v0/crc32")
+            observation, reward, done, _ = env.step(action)
+            np.testing.assert_array_equal(observations[i], observation)
+            assert rewards[i] == pytest.approx(reward)
+            assert dones[i] == done
+    finally:
+        env.close()
+
+
+def test_step_wrong_number_of_actions(vec_env: CompilerVecEnv):
+    vec_env.reset(benchmark="cBench-v0/crc32")
+    with pytest.raises(ValueError):
+        vec_env.step([0])
+
+
+def test_auto_reset():
+    envs = [gym.make("llvm-autophase-ic-v0") for _ in range(2)]
+    with CompilerVecEnv(envs) as vec_env:
+        envs[0].require_dataset("cBench-v0")
+        initial_observations = vec_env.reset(benchmark="cBench-v0/crc32")
+        # Killing the service ends the episode.
+        envs[1].service.close()
+        observations, _, dones, infos = vec_env.step([0, 0])
+        assert list(dones) == [False, True]
+        assert "terminal_observation" not in infos[0]
+        assert "terminal_observation" in infos[1]
+        np.testing.assert_array_equal(observations[1], initial_observations[1])
+        assert envs[1].in_episode
+
+
+def test_auto_reset_restarts_shared_service_once(vec_env: CompilerVecEnv):
+    vec_env.reset(benchmark="cBench-v0/crc32")
+    service = vec_env.envs[0].service
+    # Killing the shared service ends the episodes of all environments.
+    service.connection.process.kill()
+    service.connection.process.wait()
+    _, _, dones, infos = vec_env.step([0] * 4)
+    assert list(dones) == [True] * 4
+    assert all("terminal_observation" in info for info in infos)
+
+    # The environments share a single new service.
+    new_service = vec_env.envs[0].service
+    assert new_service is not service
+    assert all(env.service is new_service for env in vec_env.envs)
+    assert new_service.refcount == 4
+    assert all(env.in_episode for env in vec_env.envs)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,7 @@ from pathlib import Path
 
 import pytest
 
-from compiler_gym.envs import LlvmEnv, llvm
+from compiler_gym.envs import LlvmEnv, TranspositionCache, llvm
 from compiler_gym.service.proto import Benchmark, File
 from compiler_gym.util.runfiles_path import runfiles_path
 from tests.test_main import main
@@ -308,5 +308,35 @@ def test_get_system_includes_output_parse_failure():
             os.environ["CXX"] = old_cxx
 
 
+def test_set_benchmark_with_new_program(env: LlvmEnv):
+    """Test that registering a new program for a benchmark URI that is in use
+    does not reset in place to the old program, or reuse its cached steps."""
+    with tempfile.TemporaryDirectory() as d:
+        source_1 = Path(d) / "a.c"
+        source_2 = Path(d) / "b.c"
+        with open(str(source_1), "w") as f:
+            f.write("int A() { return 0; }")
+        with open(str(source_2), "w") as f:
+            f.write("int B() { return 0; }")
+
+        program_1 = llvm.make_benchmark(str(source_1)).program
+        program_2 = llvm.make_benchmark(str(source_2)).program
+
+    env.transposition_cache = TranspositionCache()
+    env.benchmark = Benchmark(uri="benchmark://new", program=program_1)
+    env.reset()
+    env.step(0)
+    session_id = env._session_id
+
+    env.benchmark = Benchmark(uri="benchmark://new", program=program_2)
+    env.reset()
+    assert env._session_id != session_id
+    assert re.search(r"define (dso_local )?i32 @B\(\)", env.observation["Ir"])
+    assert not re.search(r"define (dso_local )?i32 @A\(\)", env.observation["Ir"])
+
+    env.step(0)
+    assert env.transposition_cache.hit_count == 0
+
+
 if __name__ == "__main__":
     main()
@@ -3,15 +3,21 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 """Integrations tests for the LLVM CompilerGym environments."""
+import os
 from typing import List
 
 import gym
+import numpy as np
 import pytest
 
 import compiler_gym
-from compiler_gym.envs import CompilerEnv, CompilerEnvState, llvm
+from compiler_gym.envs import CompilerEnv, CompilerEnvState, TranspositionCache, llvm
 from compiler_gym.envs.llvm.llvm_env import LlvmEnv
-from compiler_gym.service.connection import CompilerGymServiceConnection
+from compiler_gym.service.connection import (
+    CompilerGymServiceConnection,
+    ConnectionOpts,
+    ServiceIsClosed,
+)
 from tests.test_main import main
 
 pytest_plugins = ["tests.envs.llvm.fixtures"]
@@ -132,7 +138,7 @@ def test_change_benchmark_mid_episode(env: LlvmEnv):
     env.benchmark = "benchmark://cBench-v0/dijkstra"
     assert env.benchmark == "benchmark://cBench-v0/crc32"
     env.reset()
-    assert env.benchmark == "benchmark://cBench-v0/dijkstra"
+    assert env.benchmark.endswith("cBench-v0/dijkstra")
 
 
 def test_set_benchmark_invalid_type(env: LlvmEnv):
@@ -196,5 +202,503 @@ def test_state_to_csv_from_csv(env: LlvmEnv):
     assert state == state_from_csv
 
 
+def test_multistep_matches_step(env: LlvmEnv):
+    """Test that multistep() produces the same cumulative reward as step()."""
+    actions = [
+        env.action_space.flags.index(flag)
+        for flag in ["-mem2reg", "-instcombine", "-simplifycfg"]
+    ]
+
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        assert not done
+    step_episode_reward = env.episode_reward
+    step_commandline = env.commandline()
+
+    env.reset(benchmark="cBench-v0/crc32")
+    _, reward, done, _ = env.multistep(actions)
+    assert not done
+    assert reward == step_episode_reward
+    assert env.episode_reward == step_episode_reward
+    assert env.actions == actions
+    assert env.commandline() == step_commandline
+
+
+def test_multistep_per_action_feedback(env: LlvmEnv):
+    """Test that multistep() can return the reward of every action."""
+    actions = [
+        env.action_space.flags.index(flag)
+        for flag in ["-mem2reg", "-mem2reg", "-instcombine"]
+    ]
+
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    step_rewards = []
+    step_no_effect = []
+    for action in actions:
+        _, reward, done, info = env.step(action)
+        assert not done
+        step_rewards.append(reward)
+        step_no_effect.append(info["action_had_no_effect"])
+
+    env.reset(benchmark="cBench-v0/crc32")
+    _, reward, done, info = env.multistep(actions, per_action_feedback=True)
+    assert not done
+    assert info["per_action_reward"] == step_rewards
+    assert info["per_action_had_no_effect"] == step_no_effect
+    assert reward == sum(step_rewards)
+    assert env.episode_reward == sum(step_rewards)
+
+
+def test_get_many_observations(env: LlvmEnv):
+    """Test that batched observations match individual observations."""
+    env.reset(benchmark="cBench-v0/crc32")
+    spaces = ["Autophase", "IrInstructionCount", "Ir", "Inst2vecPreprocessedText"]
+    autophase, instcount, ir, inst2vec = env.observation.get_many(spaces)
+    np.testing.assert_array_equal(autophase, env.observation["Autophase"])
+    np.testing.assert_array_equal(instcount, env.observation["IrInstructionCount"])
+    assert ir == env.observation["Ir"]
+    assert inst2vec == env.observation["Inst2vecPreprocessedText"]
+
+
+def test_eager_observation_and_reward_space_lists(env: LlvmEnv):
+    """Test that lists of eager observation and reward spaces are returned by
+    step()."""
+    env.observation_space = ["Autophase", "IrInstructionCount"]
+    env.reward_space = ["IrInstructionCount", "IrInstructionCountOz"]
+    assert [space.id for space in env.observation_space] == [
+        "Autophase",
+        "IrInstructionCount",
+    ]
+    assert [space.id for space in env.reward_space] == [
+        "IrInstructionCount",
+        "IrInstructionCountOz",
+    ]
+
+    observation = env.reset(benchmark="cBench-v0/crc32")
+    assert len(observation) == 2
+    assert env.episode_reward == [0, 0]
+
+    action = env.action_space.flags.index("-mem2reg")
+    observation, reward, done, _ = env.step(action)
+    assert not done
+    autophase, instcount = observation
+    np.testing.assert_array_equal(autophase, env.observation["Autophase"])
+    np.testing.assert_array_equal(instcount, env.observation["IrInstructionCount"])
+    assert len(reward) == 2
+    # Both reward spaces use the same cost function, so both must be non-zero.
+    assert reward[0] > 0
+    assert reward[1] > 0
+    assert env.episode_reward == reward
+
+
+def test_eager_reward_space_list_with_single_observation_space(env: LlvmEnv):
+    env.observation_space = "IrInstructionCount"
+    env.reward_space = ["IrInstructionCount"]
+    env.reset(benchmark="cBench-v0/crc32")
+
+    observation, reward, done, _ = env.step(env.action_space.flags.index("-mem2reg"))
+    assert not done
+    np.testing.assert_array_equal(observation, env.observation["IrInstructionCount"])
+    assert isinstance(reward, list)
+    assert len(reward) == 1
+
+
+def test_shared_memory_observations():
+    """Test that observations passed through shared memory match observations
+    passed over RPC."""
+    env = gym.make("llvm-v0")
+    try:
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        ir = env.observation["Ir"]
+        programl = env.observation["Programl"]
+    finally:
+        env.close()
+
+    env = gym.make(
+        "llvm-v0",
+        connection_settings=ConnectionOpts(shared_memory_observation_threshold=1),
+    )
+    try:
+        env.reset(benchmark="cBench-v0/crc32")
+        assert env.observation["Ir"] == ir
+        assert env.observation["Programl"].nodes == programl.nodes
+        # A space derived from Ir reuses the single read of the shared memory.
+        ir_, text = env.observation.get_many(["Ir", "Inst2vecPreprocessedText"])
+        assert ir_ == ir
+        assert text == env.observation["Inst2vecPreprocessedText"]
+    finally:
+        env.close()
+
+
+def test_shared_memory_directory_is_removed_on_close():
+    """Test that the shared memory observations of a service are removed when
+    the service is closed, even if its sessions have not ended."""
+    env = gym.make(
+        "llvm-v0",
+        connection_settings=ConnectionOpts(shared_memory_observation_threshold=1),
+    )
+    try:
+        env.reset(benchmark="cBench-v0/crc32")
+        env.observation["Ir"]
+        shared_memory_dir = env.service.connection.shared_memory_dir
+        assert [p.name[:8] for p in shared_memory_dir.iterdir()] == ["session-"]
+    finally:
+        env.close()
+    assert not shared_memory_dir.exists()
+
+
+def test_share_service(env: LlvmEnv):
+    env.observation_space = "IrInstructionCount"
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    other_env = env.share()
+    try:
+        assert other_env.service is env.service
+        assert env.service.refcount == 2
+        assert other_env.observation_space.id == "IrInstructionCount"
+        assert other_env.reward_space.id == "IrInstructionCount"
+
+        # The two environments have independent episodes.
+        other_env.reset(benchmark="cBench-v0/crc32")
+        assert other_env._session_id != env._session_id
+        other_env.step(0)
+        assert other_env.actions == [0]
+        assert env.actions == []
+    finally:
+        other_env.close()
+
+    # Closing one environment leaves the service running for the other.
+    assert not env.service.closed
+    assert env.service.refcount == 1
+    env.step(0)
+
+
+def test_share_with_derived_observation_space(env: LlvmEnv):
+    """Test sharing an environment that uses observation spaces that are added
+    by LlvmEnv after CompilerEnv.__init__()."""
+    env.observation_space = ["Inst2vecEmbeddingIndices", "AutophaseDict"]
+    env.reward_space = "IrInstructionCountOz"
+    env.reset(benchmark="cBench-v0/crc32")
+    other_env = env.share()
+    try:
+        assert [space.id for space in other_env.observation_space] == [
+            "Inst2vecEmbeddingIndices",
+            "AutophaseDict",
+        ]
+        assert other_env.reward_space.id == "IrInstructionCountOz"
+        other_env.reset(benchmark="cBench-v0/crc32")
+        observation, _, _, _ = other_env.step(0)
+        assert isinstance(observation[1], dict)
+    finally:
+        other_env.close()
+
+    fork = env.fork()
+    try:
+        assert [space.id for space in fork.observation_space] == [
+            "Inst2vecEmbeddingIndices",
+            "AutophaseDict",
+        ]
+    finally:
+        fork.close()
+
+
+def test_shared_service_closed_by_last_user(env: LlvmEnv):
+    env.reset(benchmark="cBench-v0/crc32")
+    other_env = env.share()
+    service = env.service
+    env.close()
+    assert not service.closed
+    other_env.reset(benchmark="cBench-v0/crc32")
+    other_env.close()
+    assert service.closed
+
+
+def test_share_closed_env(env: LlvmEnv):
+    env.close()
+    with pytest.raises(ServiceIsClosed):
+        env.share()
+
+
+def test_step_stream():
+    env = gym.make(
+        "llvm-ic-v0", connection_settings=ConnectionOpts(use_step_stream=True)
+    )
+    try:
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        assert env._step_stream
+        rewards = [env.step(action)[1] for action in range(10)]
+        assert env.actions == list(range(10))
+
+        # Replay the actions without a stream.
+        env.connection_settings = ConnectionOpts()
+        env.reset(benchmark="cBench-v0/crc32")
+        assert not env._step_stream
+        assert [env.step(action)[1] for action in range(10)] == rewards
+    finally:
+        env.close()
+
+
+def test_step_stream_invalid_action():
+    env = gym.make(
+        "llvm-ic-v0", connection_settings=ConnectionOpts(use_step_stream=True)
+    )
+    try:
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        with pytest.raises(ValueError):
+            env.step(env.action_space.n)
+        # The episode continues with a new stream.
+        assert env._step_stream
+        _, _, done, _ = env.step(0)
+        assert not done
+    finally:
+        env.close()
+
+
+def test_fork(env: LlvmEnv):
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    env.step(0)
+    env.step(1)
+    fork = env.fork()
+    try:
+        assert fork.actions == [0, 1]
+        assert fork.benchmark == env.benchmark
+        assert fork.episode_reward == env.episode_reward
+        assert fork.observation["Ir"] == env.observation["Ir"]
+
+        # The fork and the original environment are independent.
+        _, fork_reward, _, _ = fork.step(2)
+        assert fork.actions == [0, 1, 2]
+        assert env.actions == [0, 1]
+
+        # The fork computes the same rewards as replaying the actions.
+        _, reward, _, _ = env.step(2)
+        assert reward == fork_reward
+        assert fork.observation["Ir"] == env.observation["Ir"]
+    finally:
+        fork.close()
+
+    # Closing the fork does not end the original episode.
+    env.step(3)
+
+
+def test_fork_before_reset(env: LlvmEnv):
+    with pytest.raises(AssertionError):
+        env.fork()
+
+
+def test_snapshot_restore(env: LlvmEnv):
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    env.multistep([0, 1, 2])
+    snapshot = env.snapshot()
+    assert isinstance(snapshot, bytes)
+    ir = env.observation["Ir"]
+    episode_reward = env.episode_reward
+
+    _, reward, _, _ = env.step(3)
+    env.restore(snapshot)
+    assert env.actions == [0, 1, 2]
+    assert env.episode_reward == episode_reward
+    assert env.observation["Ir"] == ir
+
+    # Rewards continue from the restored state.
+    _, restored_reward, _, _ = env.step(3)
+    assert restored_reward == reward
+
+
+def test_restore_computes_missing_baseline_costs(env: LlvmEnv):
+    """Test that a baseline cost that was not computed before the snapshot was
+    taken can be computed after it is restored."""
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/crc32")
+    env.multistep([0, 1, 2])
+    snapshot = env.snapshot()
+    env.reward_space = "IrInstructionCountOz"
+    _, reward, _, _ = env.step(3)
+
+    env.reward_space = "IrInstructionCount"
+    env.reset(benchmark="cBench-v0/adpcm")
+    env.restore(snapshot)
+    env.reward_space = "IrInstructionCountOz"
+    _, restored_reward, _, _ = env.step(3)
+    assert restored_reward == reward
+
+
+def test_restore_in_new_episode(env: LlvmEnv):
+    env.reset(benchmark="cBench-v0/crc32")
+    env.multistep([0, 1, 2])
+    snapshot = env.snapshot()
+    ir = env.observation["Ir"]
+
+    env.reset(benchmark="cBench-v0/adpcm")
+    env.restore(snapshot)
+    assert env.benchmark == "benchmark://cBench-v0/crc32"
+    assert env.observation["Ir"] == ir
+
+
+def test_restore_invalid_snapshot(env: LlvmEnv):
+    env.reset(benchmark="cBench-v0/crc32")
+    with pytest.raises(ValueError):
+        env.restore(b"")
+    snapshot = env.snapshot()
+    with pytest.raises(ValueError):
+        env.restore(snapshot[:-100])
+
+
+@pytest.mark.parametrize("snapshot_interval", [0, 2])
+def test_transposition_cache(env: LlvmEnv, snapshot_interval: int):
+    env.transposition_cache = TranspositionCache(snapshot_interval=snapshot_interval)
+    env.observation_space = "Autophase"
+    env.reward_space = "IrInstructionCount"
+    actions = [
+        env.action_space.flags.index(flag)
+        for flag in ["-mem2reg", "-instcombine", "-simplifycfg", "-gvn"]
+    ]
+
+    env.reset(benchmark="cBench-v0/crc32")
+    expected = [env.step(action) for action in actions]
+    expected_ir = env.observation["Ir"]
+    assert env.transposition_cache.hit_count == 0
+
+    # Replaying the prefix is served from the cache.
+    env.reset(benchmark="cBench-v0/crc32")
+    for action, (observation, reward, done, _) in zip(actions[:3], expected):
+        cached_observation, cached_reward, cached_done, _ = env.step(action)
+        np.testing.assert_array_equal(cached_observation, observation)
+        assert cached_reward == reward
+        assert cached_done == done
+    assert env.transposition_cache.hit_count == 3
+    assert env.actions == actions[:3]
+
+    # Leaving the cached prefix brings the service up to date.
+    observation, reward, _, _ = env.step(actions[3])
+    np.testing.assert_array_equal(observation, expected[3][0])
+    assert reward == expected[3][1]
+    assert env.observation["Ir"] == expected_ir
+    assert env.episode_reward == pytest.approx(sum(r for _, r, _, _ in expected))
+
+
+def test_transposition_cache_observation_applies_cached_steps(env: LlvmEnv):
+    env.transposition_cache = TranspositionCache()
+    env.reset(benchmark="cBench-v0/crc32")
+    env.step(0)
+    ir = env.observation["Ir"]
+
+    env.reset(benchmark="cBench-v0/crc32")
+    env.step(0)
+    assert env.transposition_cache.hit_count == 1
+    assert env.observation["Ir"] == ir
+
+
+def test_transposition_cache_not_used_for_nondeterministic_spaces(env: LlvmEnv):
+    env.transposition_cache = TranspositionCache()
+    env.observation_space = "BitcodeFile"
+    env.reset(benchmark="cBench-v0/crc32")
+    assert env._cache_node is None
+    first_path, _, _, _ = env.step(0)
+    try:
+        env.reset(benchmark="cBench-v0/crc32")
+        second_path, _, _, _ = env.step(0)
+        try:
+            # Each step writes a new bitcode file.
+            assert second_path != first_path
+            assert os.path.isfile(second_path)
+            assert env.transposition_cache.hit_count == 0
+            assert len(env.transposition_cache) == 0
+        finally:
+            os.unlink(second_path)
+    finally:
+        os.unlink(first_path)
+
+
+def test_reset_in_place(env: LlvmEnv):
+    env.observation_space = "Autophase"
+    env.reward_space = "IrInstructionCount"
+    initial_observation = env.reset(benchmark="cBench-v0/crc32")
+    initial_ir = env.observation["Ir"]
+    session_id = env._session_id
+    env.step(env.action_space.flags.index("-mem2reg"))
+    assert env.episode_reward > 0
+
+    # Resetting to the same benchmark reuses the session.
+    observation = env.reset(benchmark="cBench-v0/crc32")
+    assert env._session_id == session_id
+    np.testing.assert_array_equal(observation, initial_observation)
+    assert env.actions == []
+    assert env.episode_reward == 0
+    assert env.observation["Ir"] == initial_ir
+
+    # The episode rewards are relative to the initial state.
+    _, reward, _, _ = env.step(env.action_space.flags.index("-mem2reg"))
+    assert reward > 0
+
+
+def test_reset_in_place_new_benchmark(env: LlvmEnv):
+    env.reset(benchmark="cBench-v0/crc32")
+    session_id = env._session_id
+    env.reset(benchmark="cBench-v0/dijkstra")
+    assert env._session_id != session_id
+    assert env.benchmark.endswith("cBench-v0/dijkstra")
+
+
+def test_reset_in_place_after_restore(env: LlvmEnv):
+    env.reset(benchmark="cBench-v0/crc32")
+    env.step(0)
+    env.restore(env.snapshot())
+    # A restored session is replaced by a new session.
+    session_id = env._session_id
+    env.reset(benchmark="cBench-v0/crc32")
+    assert env._session_id != session_id
+    assert env.actions == []
+
+
+def test_step_with_no_effect_reuses_observation_and_reward(env: LlvmEnv):
+    """Test that an action with no effect returns the previous observation and
+    a zero reward."""
+    env.observation_space = "Autophase"
+    env.reward_space = "ObjectTextSizeBytes"
+    env.reset(benchmark="cBench-v0/crc32")
+
+    action = env.action_space.flags.index("-mem2reg")
+    observation, reward, done, info = env.step(action)
+    assert not done
+    assert not info["action_had_no_effect"]
+
+    # -mem2reg has nothing left to do.
+    next_observation, reward, done, info = env.step(action)
+    assert not done
+    assert info["action_had_no_effect"]
+    assert reward == 0
+    np.testing.assert_array_equal(next_observation, observation)
+    np.testing.assert_array_equal(next_observation, env.observation["Autophase"])
+
+
+def test_step_with_no_effect_shared_memory_observation():
+    """Test that observations in shared memory are valid after an action with
+    no effect."""
+    env = gym.make(
+        "llvm-v0",
+        observation_space="Ir",
+        connection_settings=ConnectionOpts(shared_memory_observation_threshold=1),
+    )
+    try:
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        action = env.action_space.flags.index("-mem2reg")
+        ir, _, _, _ = env.step(action)
+        next_ir, _, _, info = env.step(action)
+        assert info["action_had_no_effect"]
+        assert next_ir == ir
+    finally:
+        env.close()
+
+
 if __name__ == "__main__":
     main()
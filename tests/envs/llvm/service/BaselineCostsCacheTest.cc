@@ -0,0 +1,139 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include <gtest/gtest.h>
+
+#include <cmath>
+#include <fstream>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/BaselineCostsCache.h"
+
+namespace fs = boost::filesystem;
+
+using namespace ::testing;
+
+namespace compiler_gym::llvm_service {
+namespace {
+
+class BaselineCostsCacheTest : public Test {
+ protected:
+  void SetUp() override {
+    directory_ = fs::temp_directory_path() / fs::unique_path("baseline-costs-%%%%%%%%");
+    path_ = directory_ / "cache" / "baseline_costs.bin";
+  }
+
+  void TearDown() override { fs::remove_all(directory_); }
+
+  fs::path directory_;
+  fs::path path_;
+};
+
+BaselineCosts makeBaselineCosts(double value) {
+  BaselineCosts baselineCosts;
+  baselineCosts.fill(value);
+  return baselineCosts;
+}
+
+TEST_F(BaselineCostsCacheTest, lookupEmptyCache) {
+  BaselineCostsCache cache(path_);
+  BaselineCosts baselineCosts;
+  EXPECT_FALSE(cache.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_FALSE(fs::exists(path_));
+}
+
+TEST_F(BaselineCostsCacheTest, insertAndLookup) {
+  BaselineCostsCache cache(path_);
+  cache.insert({1, 2, 3, 4, 5}, makeBaselineCosts(10));
+
+  BaselineCosts baselineCosts;
+  ASSERT_TRUE(cache.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(10));
+  EXPECT_FALSE(cache.lookup({5, 4, 3, 2, 1}, &baselineCosts));
+}
+
+TEST_F(BaselineCostsCacheTest, costsAreSharedBetweenCaches) {
+  BaselineCostsCache a(path_);
+  BaselineCostsCache b(path_);
+  BaselineCosts baselineCosts;
+  EXPECT_FALSE(b.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+
+  a.insert({1, 2, 3, 4, 5}, makeBaselineCosts(10));
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(10));
+
+  // Costs persist across instances.
+  BaselineCostsCache c(path_);
+  ASSERT_TRUE(c.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(10));
+}
+
+TEST_F(BaselineCostsCacheTest, costsAreMerged) {
+  BaselineCosts first = getEmptyBaselineCosts();
+  first[0] = 10;
+  BaselineCosts second = getEmptyBaselineCosts();
+  second[1] = 20;
+
+  BaselineCostsCache a(path_);
+  BaselineCostsCache b(path_);
+  a.insert({1, 2, 3, 4, 5}, first);
+  b.insert({1, 2, 3, 4, 5}, second);
+
+  BaselineCosts baselineCosts;
+  BaselineCostsCache c(path_);
+  ASSERT_TRUE(c.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts[0], 10);
+  EXPECT_EQ(baselineCosts[1], 20);
+  EXPECT_TRUE(std::isnan(baselineCosts[2]));
+}
+
+TEST_F(BaselineCostsCacheTest, partialRecordIsIgnored) {
+  BaselineCostsCache a(path_);
+  a.insert({1, 2, 3, 4, 5}, makeBaselineCosts(10));
+  {
+    std::ofstream file(path_.string(), std::ios::binary | std::ios::app);
+    file << "partial";
+  }
+
+  BaselineCostsCache b(path_);
+  BaselineCosts baselineCosts;
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(10));
+}
+
+TEST_F(BaselineCostsCacheTest, invalidRecordIsSkipped) {
+  BaselineCostsCache a(path_);
+  a.insert({1, 2, 3, 4, 5}, makeBaselineCosts(10));
+  // A write that failed part way, followed by more records.
+  {
+    std::ofstream file(path_.string(), std::ios::binary | std::ios::app);
+    file << "partial";
+  }
+  a.insert({5, 4, 3, 2, 1}, makeBaselineCosts(20));
+
+  BaselineCostsCache b(path_);
+  BaselineCosts baselineCosts;
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(10));
+  ASSERT_TRUE(b.lookup({5, 4, 3, 2, 1}, &baselineCosts));
+  EXPECT_EQ(baselineCosts, makeBaselineCosts(20));
+}
+
+TEST_F(BaselineCostsCacheTest, corruptRecordIsIgnored) {
+  BaselineCostsCache a(path_);
+  a.insert({1, 2, 3, 4, 5}, makeBaselineCosts(10));
+  // Flip a byte of the costs.
+  {
+    std::fstream file(path_.string(), std::ios::binary | std::ios::in | std::ios::out);
+    file.seekp(30);
+    file.put('x');
+  }
+
+  BaselineCostsCache b(path_);
+  BaselineCosts baselineCosts;
+  EXPECT_FALSE(b.lookup({1, 2, 3, 4, 5}, &baselineCosts));
+}
+
+}  // anonymous namespace
+}  // namespace compiler_gym::llvm_service
@@ -0,0 +1,89 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include <gtest/gtest.h>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/Benchmark.h"
+#include "llvm/AsmParser/Parser.h"
+#include "llvm/Bitcode/BitcodeWriter.h"
+#include "llvm/IR/Function.h"
+#include "llvm/Support/SourceMgr.h"
+#include "llvm/Support/raw_ostream.h"
+
+namespace fs = boost::filesystem;
+
+using namespace ::testing;
+
+namespace compiler_gym::llvm_service {
+namespace {
+
+constexpr char kIr[] = R"(
+define i32 @A(i32 %a) {
+  %b = add i32 %a, 1
+  ret i32 %b
+}
+
+define i32 @B() {
+  %a = call i32 @A(i32 1)
+  ret i32 %a
+}
+)";
+
+std::string moduleToString(const llvm::Module& module) {
+  std::string str;
+  llvm::raw_string_ostream rso(str);
+  module.print(rso, /*AAW=*/nullptr);
+  return rso.str();
+}
+
+class BenchmarkTest : public Test {
+ protected:
+  void SetUp() override {
+    workingDirectory_ = fs::temp_directory_path() / fs::unique_path("benchmark-%%%%%%%%");
+    fs::create_directories(workingDirectory_);
+
+    llvm::LLVMContext context;
+    llvm::SMDiagnostic error;
+    auto module = llvm::parseAssemblyString(kIr, error, context);
+    ASSERT_TRUE(module) << error.getMessage().str();
+    llvm::raw_svector_ostream ostream(bitcode_);
+    llvm::WriteBitcodeToFile(*module, ostream);
+  }
+
+  void TearDown() override { fs::remove_all(workingDirectory_); }
+
+  fs::path workingDirectory_;
+  Bitcode bitcode_;
+};
+
+TEST_F(BenchmarkTest, cloneHasSameHashAndIr) {
+  Benchmark benchmark("benchmark://test", bitcode_, workingDirectory_);
+  auto clone = benchmark.clone(workingDirectory_);
+
+  EXPECT_EQ(clone->name(), benchmark.name());
+  EXPECT_EQ(clone->hash(), benchmark.hash());
+  EXPECT_EQ(getModuleHash(clone->module()), getModuleHash(benchmark.module()));
+  EXPECT_EQ(moduleToString(clone->module()), moduleToString(benchmark.module()));
+  // The clone has its own LLVMContext.
+  EXPECT_NE(clone->context_ptr(), benchmark.context_ptr());
+}
+
+TEST_F(BenchmarkTest, modifyingCloneDoesNotChangeOriginal) {
+  Benchmark benchmark("benchmark://test", bitcode_, workingDirectory_);
+  const std::string ir = moduleToString(benchmark.module());
+  const BenchmarkHash hash = getModuleHash(benchmark.module());
+
+  auto clone = benchmark.clone(workingDirectory_);
+  clone->module().getFunction("B")->eraseFromParent();
+  EXPECT_EQ(clone->module().getFunction("B"), nullptr);
+  EXPECT_NE(getModuleHash(clone->module()), hash);
+
+  EXPECT_NE(benchmark.module().getFunction("B"), nullptr);
+  EXPECT_EQ(moduleToString(benchmark.module()), ir);
+  EXPECT_EQ(getModuleHash(benchmark.module()), hash);
+}
+
+}  // anonymous namespace
+}  // namespace compiler_gym::llvm_service
@@ -0,0 +1,95 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include <gtest/gtest.h>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/CostCache.h"
+
+namespace fs = boost::filesystem;
+
+using namespace ::testing;
+
+namespace compiler_gym::llvm_service {
+namespace {
+
+TEST(CostCacheTest, lookupEmptyCache) {
+  CostCache cache(10);
+  double value;
+  EXPECT_FALSE(cache.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(cache.size(), 0);
+}
+
+TEST(CostCacheTest, insertAndLookup) {
+  CostCache cache(10);
+  cache.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  double value;
+  ASSERT_TRUE(cache.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 100);
+  EXPECT_EQ(cache.size(), 1);
+}
+
+TEST(CostCacheTest, costFunctionIsPartOfKey) {
+  CostCache cache(10);
+  cache.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  double value;
+  EXPECT_FALSE(cache.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::IR_INSTRUCTION_COUNT, &value));
+  EXPECT_FALSE(cache.lookup({1, 2, 3, 4, 6}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+}
+
+TEST(CostCacheTest, insertReplacesValue) {
+  CostCache cache(10);
+  cache.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+  cache.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 200);
+
+  double value;
+  ASSERT_TRUE(cache.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 200);
+  EXPECT_EQ(cache.size(), 1);
+}
+
+TEST(CostCacheTest, leastRecentlyUsedEntryIsEvicted) {
+  CostCache cache(2);
+  cache.insert({1, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 1);
+  cache.insert({2, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 2);
+
+  // Use the first entry so that the second is the least recently used.
+  double value;
+  ASSERT_TRUE(cache.lookup({1, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+
+  cache.insert({3, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 3);
+  EXPECT_EQ(cache.size(), 2);
+  EXPECT_TRUE(cache.lookup({1, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_FALSE(cache.lookup({2, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_TRUE(cache.lookup({3, 0, 0, 0, 0}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+}
+
+TEST(CostCacheTest, zeroSizeCacheIsDisabled) {
+  CostCache cache(0);
+  cache.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  double value;
+  EXPECT_FALSE(cache.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(cache.size(), 0);
+}
+
+TEST(CostCacheTest, costsAreSharedThroughDatabase) {
+  const fs::path path = fs::temp_directory_path() / fs::unique_path("costs-%%%%%%%%.bin");
+  CostDatabase database(path);
+  CostCache a(10, &database);
+  CostCache b(10, &database);
+  a.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  double value;
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 100);
+  // The cost read from the database is cached in memory.
+  EXPECT_EQ(b.size(), 1);
+  fs::remove(path);
+}
+
+}  // anonymous namespace
+}  // namespace compiler_gym::llvm_service
@@ -0,0 +1,119 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+//
+// This source code is licensed under the MIT license found in the
+// LICENSE file in the root directory of this source tree.
+#include <gtest/gtest.h>
+
+#include <fstream>
+
+#include "boost/filesystem.hpp"
+#include "compiler_gym/envs/llvm/service/CostDatabase.h"
+
+namespace fs = boost::filesystem;
+
+using namespace ::testing;
+
+namespace compiler_gym::llvm_service {
+namespace {
+
+class CostDatabaseTest : public Test {
+ protected:
+  void SetUp() override {
+    directory_ = fs::temp_directory_path() / fs::unique_path("costs-%%%%%%%%");
+    path_ = directory_ / "cache" / "costs.bin";
+  }
+
+  void TearDown() override { fs::remove_all(directory_); }
+
+  fs::path directory_;
+  fs::path path_;
+};
+
+TEST_F(CostDatabaseTest, lookupEmptyDatabase) {
+  CostDatabase database(path_);
+  double value;
+  EXPECT_FALSE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+}
+
+TEST_F(CostDatabaseTest, fileSizeIsBounded) {
+  CostDatabase database(path_, /*numSlots=*/16);
+  const auto size = fs::file_size(path_);
+  for (int i = 0; i < 100; ++i) {
+    database.insert({static_cast<uint32_t>(i)}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, i);
+  }
+  EXPECT_EQ(fs::file_size(path_), size);
+
+  // The most recent insert is always found.
+  double value;
+  ASSERT_TRUE(database.lookup({99}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 99);
+}
+
+TEST_F(CostDatabaseTest, existingFileKeepsNumberOfSlots) {
+  CostDatabase a(path_, /*numSlots=*/16);
+  a.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  CostDatabase b(path_, /*numSlots=*/32);
+  EXPECT_EQ(b.numSlots(), 16);
+  double value;
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 100);
+}
+
+TEST_F(CostDatabaseTest, insertOverwritesValue) {
+  CostDatabase database(path_);
+  database.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+  database.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 200);
+
+  double value;
+  ASSERT_TRUE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 200);
+}
+
+TEST_F(CostDatabaseTest, insertAndLookup) {
+  CostDatabase database(path_);
+  database.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+
+  double value;
+  ASSERT_TRUE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 100);
+  EXPECT_FALSE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::IR_INSTRUCTION_COUNT, &value));
+}
+
+TEST_F(CostDatabaseTest, costsAreSharedBetweenDatabases) {
+  CostDatabase a(path_);
+  CostDatabase b(path_);
+  double value;
+  // Read the file before the cost is added.
+  EXPECT_FALSE(b.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+
+  a.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+  a.insert({6, 7, 8, 9, 10}, LlvmCostFunction::IR_INSTRUCTION_COUNT, 200);
+
+  ASSERT_TRUE(b.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 100);
+  ASSERT_TRUE(b.lookup({6, 7, 8, 9, 10}, LlvmCostFunction::IR_INSTRUCTION_COUNT, &value));
+  EXPECT_EQ(value, 200);
+}
+
+TEST_F(CostDatabaseTest, corruptSlotIsIgnored) {
+  // A database with a single slot, so that the slot of the key is known.
+  CostDatabase database(path_, /*numSlots=*/1);
+  database.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 100);
+  {
+    std::fstream file(path_.string(), std::ios::binary | std::ios::in | std::ios::out);
+    file.seekp(10);
+    file << "corrupt";
+  }
+
+  double value;
+  EXPECT_FALSE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+
+  // The corrupt slot is reused.
+  database.insert({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, 200);
+  ASSERT_TRUE(database.lookup({1, 2, 3, 4, 5}, LlvmCostFunction::OBJECT_TEXT_SIZE_BYTES, &value));
+  EXPECT_EQ(value, 200);
+}
+
+}  // anonymous namespace
+}  // namespace compiler_gym::llvm_service
@@ -16,7 +16,7 @@ namespace {
 TEST(ObservationSpacesTest, getLlvmObservationSpaceList) {
   const auto spaces = getLlvmObservationSpaceList();
 
-  ASSERT_EQ(spaces.size(), 13);
+  ASSERT_EQ(spaces.size(), 14);
 
   EXPECT_EQ(spaces[0].name(), "Ir");
   EXPECT_EQ(spaces[0].string_size_range().min().value(), 0);
@@ -46,6 +46,10 @@ TEST(ObservationSpacesTest, getLlvmObservationSpaceList) {
   EXPECT_EQ(spaces[10].name(), "ObjectTextSizeO0");
   EXPECT_EQ(spaces[11].name(), "ObjectTextSizeO3");
   EXPECT_EQ(spaces[12].name(), "ObjectTextSizeOz");
+
+  EXPECT_EQ(spaces[13].name(), "ModuleHash");
+  EXPECT_EQ(spaces[13].binary_size_range().min().value(), 20);
+  EXPECT_EQ(spaces[13].binary_size_range().max().value(), 20);
 }
 
 }  // anonymous namespace
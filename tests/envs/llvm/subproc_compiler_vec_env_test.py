@@ -0,0 +1,82 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Tests for the multiprocess vectorized CompilerEnv wrapper."""
+import sys
+from functools import partial
+
+import gym
+import numpy as np
+import pytest
+
+from compiler_gym.envs import SubprocCompilerVecEnv
+from tests.test_main import main
+
+pytest_plugins = ["tests.envs.llvm.fixtures"]
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 8, 0), reason="Requires multiprocessing.shared_memory"
+)
+
+
+def test_invalid_num_envs():
+    with pytest.raises(ValueError):
+        SubprocCompilerVecEnv(partial(gym.make, "llvm-v0"), num_envs=0)
+
+
+def test_observations_are_stacked_in_shared_memory():
+    make_env = partial(gym.make, "llvm-autophase-ic-v0")
+    with SubprocCompilerVecEnv(make_env, num_envs=2) as vec_env:
+        observations = vec_env.reset(benchmark="cBench-v0/crc32")
+        assert isinstance(observations, np.ndarray)
+        assert observations.shape == (2, 56)
+        assert observations.dtype == np.int64
+        np.testing.assert_array_equal(observations[0], observations[1])
+
+        observations, rewards, dones, infos = vec_env.step([0, 1])
+        assert observations.shape == (2, 56)
+        assert rewards.shape == (2,)
+        assert list(dones) == [False, False]
+        assert len(infos) == 2
+
+        env = make_env()
+        try:
+            for i, action in enumerate([0, 1]):
+                env.reset(benchmark="cBench-v0/crc32")
+                observation, reward, _, _ = env.step(action)
+                np.testing.assert_array_equal(observations[i], observation)
+                assert rewards[i] == pytest.approx(reward)
+        finally:
+            env.close()
+
+
+def test_variable_size_observations_are_returned_as_list():
+    make_env = partial(gym.make, "llvm-v0", observation_space="Inst2vec")
+    with SubprocCompilerVecEnv(make_env, num_envs=2) as vec_env:
+        observations = vec_env.reset(benchmark=["cBench-v0/crc32", "cBench-v0/qsort"])
+        assert isinstance(observations, list)
+        assert len(observations) == 2
+        assert all(isinstance(o, np.ndarray) for o in observations)
+        assert observations[0].shape[1] == observations[1].shape[1]
+        assert observations[0].shape[0] != observations[1].shape[0]
+
+
+def test_non_array_observations_are_pickled():
+    make_env = partial(gym.make, "llvm-v0", observation_space="Ir")
+    with SubprocCompilerVecEnv(make_env, num_envs=2) as vec_env:
+        observations = vec_env.reset(benchmark="cBench-v0/crc32")
+        assert isinstance(observations, list)
+        assert all(isinstance(o, str) for o in observations)
+
+
+def test_error_is_raised_in_parent():
+    make_env = partial(gym.make, "llvm-autophase-ic-v0")
+    with SubprocCompilerVecEnv(make_env, num_envs=2) as vec_env:
+        vec_env.reset(benchmark="cBench-v0/crc32")
+        with pytest.raises(ValueError):
+            vec_env.step([0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Unit tests for //compiler_gym/envs:transposition_cache."""
+import numpy as np
+import pytest
+
+from compiler_gym.envs.transposition_cache import TranspositionCache
+from tests.test_main import main
+
+
+def _result(observation):
+    return observation, 1.0, False, {"action_had_no_effect": False}
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        TranspositionCache(max_bytes=-1)
+    with pytest.raises(ValueError):
+        TranspositionCache(snapshot_interval=-1)
+
+
+def test_lookup_insert():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    assert cache.root("a") is root
+    assert cache.root("b") is not root
+
+    assert cache.lookup(root, 0) is None
+    node = cache.insert(root, 0, _result(np.array([1, 2, 3])), 1.0)
+    assert node.depth == 1
+    assert cache.lookup(root, 0) is node
+    assert cache.lookup(node, 1) is None
+    assert len(cache) == 1
+    assert cache.hit_count == 1
+    assert cache.miss_count == 2
+
+
+def test_insert_copies_values():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    observation = np.array([1, 2, 3])
+    node = cache.insert(root, 0, _result(observation), 1.0)
+    observation[0] = 10
+    np.testing.assert_array_equal(node.step_result[0], [1, 2, 3])
+
+
+def test_memoryview_is_copied():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    node = cache.insert(root, 0, _result(memoryview(b"abc")), 1.0)
+    assert node.step_result[0] == b"abc"
+
+
+def test_lru_eviction():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    a = cache.insert(root, 0, _result(np.zeros(1000)), 1.0)
+    b = cache.insert(root, 1, _result(np.zeros(1000)), 1.0)
+    # Use the first entry, so that the second entry is evicted next.
+    assert cache.lookup(root, 0) is a
+
+    cache.max_bytes = cache.size_bytes
+    c = cache.insert(root, 2, _result(np.zeros(1000)), 1.0)
+    assert c is not None
+    assert b.detached
+    assert not a.detached
+    assert cache.lookup(root, 1) is None
+    assert cache.size_bytes <= cache.max_bytes
+
+
+def test_ancestors_outlive_descendants():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    a = cache.insert(root, 0, _result(np.zeros(1000)), 1.0)
+    b = cache.insert(a, 0, _result(np.zeros(1000)), 2.0)
+    cache.max_bytes = a.size + 1000
+    cache.insert(root, 1, _result(None), 1.0)
+    # The leaf is evicted first.
+    assert b.detached
+    assert not a.detached
+
+
+def test_evicting_a_node_evicts_its_descendants():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    a = cache.insert(root, 0, _result(None), 1.0)
+    b = cache.insert(a, 0, _result(None), 2.0)
+    # Replacing an entry removes its subtree.
+    cache.insert(root, 0, _result(None), 1.0)
+    assert a.detached
+    assert b.detached
+    assert len(cache) == 1
+    assert cache.insert(a, 1, _result(None), 1.0) is None
+
+
+def test_clear():
+    cache = TranspositionCache()
+    root = cache.root("a")
+    node = cache.insert(root, 0, _result(None), 1.0)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size_bytes == 0
+    assert node.detached
+    assert cache.root("a") is not root
+
+
+if __name__ == "__main__":
+    main()
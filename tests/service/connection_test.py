@@ -3,11 +3,20 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 """Unit tests for //compiler_gym/service:connection."""
+import asyncio
+from threading import Event
+
 import gym
 import pytest
 
 import compiler_gym.envs  # Register LLVM environments.
-from compiler_gym.service import CompilerGymServiceConnection, ConnectionOpts
+from compiler_gym.service import (
+    AsyncConnection,
+    CompilerGymServiceConnection,
+    ConnectionOpts,
+    ServiceIsClosed,
+)
+from compiler_gym.service.connection import RequestStream
 from compiler_gym.service.proto import GetSpacesRequest
 from tests.test_main import main
 
@@ -55,7 +64,9 @@ def test_create_channel_failed_subprocess(
             ),
         )
 
-    assert str(ctx.value).startswith("Failed to create connection to localhost:")
+    assert str(ctx.value).startswith(
+        f"Failed to create connection to {dead_connection.connection.url}"
+    )
     assert str(ctx.value).endswith(" (2/2 attempts made)")
 
 
@@ -75,7 +86,9 @@ def test_create_channel_failed_subprocess_rpc_timeout(
             ),
         )
 
-    assert str(ctx.value).startswith("Failed to create connection to localhost:")
+    assert str(ctx.value).startswith(
+        f"Failed to create connection to {dead_connection.connection.url}"
+    )
     assert str(ctx.value).endswith(" (1/2 attempts made)")
 
 
@@ -91,5 +104,123 @@ def test_call_stub_negative_timeout(connection: CompilerGymServiceConnection):
     assert str(ctx.value) == "Deadline Exceeded (-10.0 seconds)"
 
 
+def test_managed_connection_uses_unix_socket(connection: CompilerGymServiceConnection):
+    assert connection.connection.url.startswith("unix:")
+    assert connection.connection.url.endswith("/service.sock")
+
+
+def test_managed_connection_tcp():
+    env = gym.make(
+        "llvm-v0",
+        connection_settings=ConnectionOpts(local_service_use_unix_socket=False),
+    )
+    try:
+        assert env.service.connection.url.startswith("localhost:")
+        env.service(env.service.stub.GetSpaces, GetSpacesRequest())
+    finally:
+        env.close()
+
+
+def test_unmanaged_connection_over_unix_socket(
+    connection: CompilerGymServiceConnection,
+):
+    unmanaged = CompilerGymServiceConnection(connection.connection.url)
+    try:
+        unmanaged(unmanaged.stub.GetSpaces, GetSpacesRequest())
+    finally:
+        unmanaged.close()
+
+
+def test_async_connection(connection: CompilerGymServiceConnection):
+    async_connection = AsyncConnection(connection.connection.url)
+
+    async def get_spaces():
+        return await async_connection(
+            async_connection.stub.GetSpaces, GetSpacesRequest()
+        )
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(get_spaces()) == connection.connection.spaces
+    loop.run_until_complete(async_connection.close())
+    with pytest.raises(ServiceIsClosed):
+        loop.run_until_complete(get_spaces())
+
+
+def test_async_connection_negative_timeout(connection: CompilerGymServiceConnection):
+    async_connection = AsyncConnection(connection.connection.url)
+
+    async def call():
+        try:
+            return await async_connection(
+                async_connection.stub.GetSpaces, GetSpacesRequest(), timeout=-10
+            )
+        finally:
+            await async_connection.close()
+
+    with pytest.raises(TimeoutError):
+        asyncio.get_event_loop().run_until_complete(call())
+
+
+def test_shared_connection_refcount(connection: CompilerGymServiceConnection):
+    assert connection.refcount == 1
+    assert connection.share() is connection
+    assert connection.refcount == 2
+    connection.close()
+    assert not connection.closed
+    connection(connection.stub.GetSpaces, GetSpacesRequest())
+    connection.close()
+    assert connection.closed
+    with pytest.raises(ServiceIsClosed):
+        connection.share()
+
+
+class MockStreamCall(object):
+    """A mock of a bidirectional streaming RPC call, which replies to each
+    request using a function."""
+
+    def __init__(self, requests, reply_fn):
+        self.requests = requests
+        self.reply_fn = reply_fn
+        self.cancelled = Event()
+
+    def __iter__(self):
+        for request in self.requests:
+            reply = self.reply_fn(request, self.cancelled)
+            if reply is None:
+                return
+            yield reply
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def test_request_stream_reply():
+    stream = RequestStream(
+        lambda requests: MockStreamCall(requests, lambda request, _: request),
+        "mock://",
+    )
+    try:
+        assert stream(GetSpacesRequest()) == GetSpacesRequest()
+        assert stream(GetSpacesRequest()) == GetSpacesRequest()
+    finally:
+        stream.close()
+
+
+def test_request_stream_timeout():
+    """Test that a stream call times out if the service does not reply."""
+
+    def hang(request, cancelled):
+        cancelled.wait()
+
+    stream = RequestStream(
+        lambda requests: MockStreamCall(requests, hang), "mock://", timeout=0.1
+    )
+    with pytest.raises(TimeoutError):
+        stream(GetSpacesRequest())
+    assert stream.closed
+    with pytest.raises(ServiceIsClosed):
+        stream(GetSpacesRequest())
+
+
 if __name__ == "__main__":
     main()
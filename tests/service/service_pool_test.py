@@ -0,0 +1,93 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Unit tests for //compiler_gym/service:service_pool."""
+from time import sleep, time
+
+import gym
+import pytest
+
+from compiler_gym.envs import llvm
+from compiler_gym.service import ServiceError, ServicePool
+from tests.test_main import main
+
+
+def wait_for_idle_services(pool: ServicePool, timeout: float = 60) -> None:
+    end_time = time() + timeout
+    while pool.idle_count < pool.size:
+        assert time() < end_time, "Timeout waiting for pooled services"
+        sleep(0.1)
+
+
+@pytest.fixture(scope="function")
+def pool() -> ServicePool:
+    with ServicePool(llvm.LLVM_SERVICE_BINARY, size=2) as pool:
+        yield pool
+
+
+def test_invalid_endpoint():
+    with pytest.raises(TypeError):
+        ServicePool("localhost:8080")
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        ServicePool(llvm.LLVM_SERVICE_BINARY, size=0)
+
+
+def test_pool_fills_in_background(pool: ServicePool):
+    wait_for_idle_services(pool)
+    assert pool.idle_count == 2
+
+
+def test_make_env_from_pool(pool: ServicePool):
+    wait_for_idle_services(pool)
+    env = gym.make("llvm-v0", service=pool)
+    try:
+        assert pool.idle_count < 2
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        env.step(0)
+    finally:
+        env.close()
+    # The pool replaces the service that was taken.
+    wait_for_idle_services(pool)
+
+
+def test_envs_take_distinct_services(pool: ServicePool):
+    wait_for_idle_services(pool)
+    a = gym.make("llvm-v0", service=pool)
+    b = gym.make("llvm-v0", service=pool)
+    try:
+        assert a.service.connection.url != b.service.connection.url
+    finally:
+        a.close()
+        b.close()
+
+
+def test_acquire_from_closed_pool():
+    pool = ServicePool(llvm.LLVM_SERVICE_BINARY, size=1)
+    pool.close()
+    assert pool.closed
+    with pytest.raises(ServiceError):
+        pool.acquire()
+
+
+def test_env_outlives_pool():
+    with ServicePool(llvm.LLVM_SERVICE_BINARY, size=1) as pool:
+        env = gym.make("llvm-v0", service=pool)
+    try:
+        env.require_dataset("cBench-v0")
+        env.reset(benchmark="cBench-v0/crc32")
+        # A restarted environment starts its own service once the pool is
+        # closed.
+        env.close()
+        env.reset(benchmark="cBench-v0/crc32")
+        env.step(0)
+    finally:
+        env.close()
+
+
+if __name__ == "__main__":
+    main()
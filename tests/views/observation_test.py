@@ -9,6 +9,8 @@ from gym.spaces import Box
 
 from compiler_gym.service.proto import (
     DoubleList,
+    GetObservationsReply,
+    GetObservationsRequest,
     Int64List,
     Observation,
     ObservationRequest,
@@ -16,6 +18,7 @@ from compiler_gym.service.proto import (
     ScalarLimit,
     ScalarRange,
     ScalarRangeList,
+    SharedMemoryBuffer,
 )
 from compiler_gym.views import ObservationView
 from tests.test_main import main
@@ -35,6 +38,32 @@ class MockGetObservation(object):
         return ret
 
 
+class MockGetObservations(object):
+    """Mock for the get_observations callack of ObservationView."""
+
+    def __init__(self, ret=None):
+        self.called_observation_spaces = []
+        self.ret = ret or []
+
+    def __call__(self, request: GetObservationsRequest):
+        self.called_observation_spaces.append(list(request.observation_space))
+        return GetObservationsReply(
+            observation=[self.ret[i] for i in request.observation_space]
+        )
+
+
+class MockGetObservationsNotImplemented(object):
+    """Mock for a get_observations callback of a service that does not support
+    batched observations."""
+
+    def __init__(self):
+        self.call_count = 0
+
+    def __call__(self, request: GetObservationsRequest):
+        self.call_count += 1
+        raise NotImplementedError("GetObservations")
+
+
 def test_empty_space():
     with pytest.raises(ValueError) as ctx:
         ObservationView(MockGetObservation(), [])
@@ -157,5 +186,153 @@ def test_add_derived_space():
     ]
 
 
+def test_get_many():
+    spaces = [
+        ObservationSpace(
+            name="ir",
+            string_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+        ObservationSpace(
+            name="features",
+            int64_range_list=ScalarRangeList(
+                range=[
+                    ScalarRange(
+                        min=ScalarLimit(value=-100), max=ScalarLimit(value=100)
+                    ),
+                ]
+            ),
+        ),
+    ]
+    get_observations = MockGetObservations(
+        ret=[
+            Observation(string_value="Hello, world!"),
+            Observation(int64_list=Int64List(value=[5])),
+        ]
+    )
+    observation = ObservationView(
+        MockGetObservation(), spaces, get_observations=get_observations
+    )
+    observation.add_derived_space(
+        id="ir_len",
+        base_id="ir",
+        space=Box(low=0, high=float("inf"), shape=(1,), dtype=int),
+        cb=lambda base: [len(base)],
+    )
+
+    ir, ir_len, features = observation.get_many(["ir", "ir_len", "features"])
+    assert ir == "Hello, world!"
+    assert ir_len == [len("Hello, world!")]
+    np.testing.assert_array_equal(features, [5])
+
+    # Check that a single request was made, and that the base space of the
+    # derived observation was requested only once.
+    assert get_observations.called_observation_spaces == [[0, 1]]
+
+
+def test_get_many_fallback():
+    spaces = [
+        ObservationSpace(
+            name="ir",
+            string_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+        ObservationSpace(
+            name="ir2",
+            string_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+    ]
+    get_observation = MockGetObservation(
+        ret=[
+            Observation(string_value="a"),
+            Observation(string_value="b"),
+            Observation(string_value="c"),
+        ]
+    )
+    get_observations = MockGetObservationsNotImplemented()
+    observation = ObservationView(
+        get_observation, spaces, get_observations=get_observations
+    )
+
+    assert observation.get_many(["ir2", "ir"]) == ["a", "b"]
+    assert get_observation.called_observation_spaces == [1, 0]
+
+    # The batched RPC is not retried after it is found to be unsupported.
+    assert observation.get_many(["ir"]) == ["c"]
+    assert get_observations.call_count == 1
+
+
+def test_shared_memory_observations(tmp_path):
+    spaces = [
+        ObservationSpace(
+            name="ir",
+            string_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+        ObservationSpace(
+            name="binary",
+            binary_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+    ]
+    with open(tmp_path / "ir", "w") as f:
+        f.write("Hello, IR")
+    with open(tmp_path / "binary", "wb") as f:
+        f.write(b"Hello, bytes\0")
+    mock = MockGetObservation(
+        ret=[
+            Observation(
+                shared_memory=SharedMemoryBuffer(path=str(tmp_path / "ir"), size=9)
+            ),
+            Observation(
+                shared_memory=SharedMemoryBuffer(path=str(tmp_path / "binary"), size=13)
+            ),
+        ]
+    )
+    observation = ObservationView(mock, spaces)
+
+    assert observation["ir"] == "Hello, IR"
+    value = observation["binary"]
+    assert isinstance(value, memoryview)
+    assert value == b"Hello, bytes\0"
+
+    # The shared memory files are deleted once read.
+    assert not (tmp_path / "ir").exists()
+    assert not (tmp_path / "binary").exists()
+
+
+def test_get_many_shared_memory_derived_space(tmp_path):
+    spaces = [
+        ObservationSpace(
+            name="ir",
+            string_size_range=ScalarRange(min=ScalarLimit(value=0)),
+        ),
+    ]
+    with open(tmp_path / "ir", "w") as f:
+        f.write("Hello, IR")
+    get_observations = MockGetObservations(
+        ret=[
+            Observation(
+                shared_memory=SharedMemoryBuffer(path=str(tmp_path / "ir"), size=9)
+            ),
+        ]
+    )
+    observation = ObservationView(
+        MockGetObservation(), spaces, get_observations=get_observations
+    )
+    observation.add_derived_space(
+        id="ir_len",
+        base_id="ir",
+        space=Box(low=0, high=float("inf"), shape=(1,), dtype=int),
+        cb=lambda base: [len(base)],
+    )
+
+    # The shared memory file is read once and shared by the base space, the
+    # derived space, and repeated names.
+    assert observation.get_many(["ir", "ir_len", "ir"]) == [
+        "Hello, IR",
+        [len("Hello, IR")],
+        "Hello, IR",
+    ]
+    assert get_observations.called_observation_spaces == [[0]]
+    assert not (tmp_path / "ir").exists()
+
+
 if __name__ == "__main__":
     main()